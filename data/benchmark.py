@@ -0,0 +1,399 @@
+# This file is a benchmark harness for the spatial helpers in util.py and the
+# whole process_data pipeline. It generates synthetic houses, amenities and
+# crimes uniformly spread over the Chicago bounding box at increasing sizes,
+# times every helper (best of a few repeats), records the peak memory of one
+# extra run traced with tracemalloc, and appends the results to a JSON
+# history file. Each run is compared with the previous one in the history,
+# so a change that makes a helper slower shows up as a regression.
+
+# For a size N, the benchmarks use N crimes, N // 10 houses and N // 10
+# places of every amenity type. The single-house helpers (count_nearby,
+# crime_summary...) are timed per call, averaged over --queries houses.
+
+# Usage (from data/):
+#   python benchmark.py
+#   python benchmark.py --sizes 1000 10000 --pipeline-max-size 10000 --label "grid index"
+
+# Resource:
+    # 1) https://docs.python.org/3/library/tracemalloc.html
+    # 2) https://docs.python.org/3/library/time.html#time.perf_counter
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from crime_aggregator import CrimeAggregator
+from spatial_index import SpatialIndex
+from util import (
+    NONVIOLENT_CRIME_TYPES,
+    VIOLENT_CRIME_TYPES,
+    compute_restaurant_stats,
+    count_nearby,
+    crime_summary,
+    haversine_distance,
+    impute_house_price_per_sq_ft
+)
+
+# Bounding box of Chicago (lat_min, lat_max, lon_min, lon_max)
+CHICAGO_BBOX = (41.6445, 42.0230, -87.9401, -87.5240)
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+# Largest size for which the whole pipeline is run
+DEFAULT_PIPELINE_MAX_SIZE = 100_000
+DEFAULT_QUERIES = 20
+DEFAULT_REPEAT = 3
+HISTORY_FILE = "benchmark_history.json"
+# A benchmark this much slower than in the previous run is a regression
+REGRESSION_RATIO = 1.25
+
+CRIME_TYPES = sorted(VIOLENT_CRIME_TYPES | NONVIOLENT_CRIME_TYPES)
+PLACE_COLUMNS = ["Name", "Business Status", "Address", "Price Level", "Rating",
+                 "Total Ratings", "Types", "Latitude", "Longitude"]
+RESTAURANT_COLUMNS = ["Name", "Business Status", "Address", "City", "Price Level",
+                      "Rating", "Total Ratings", "Latitude", "Longitude"]
+
+
+def random_points(n, rng, bbox=CHICAGO_BBOX):
+    """
+    n points drawn uniformly from a bounding box.
+
+    Returns:
+      tuple of np arrays (lat, lon).
+    """
+    lat_min, lat_max, lon_min, lon_max = bbox
+    return rng.uniform(lat_min, lat_max, n), rng.uniform(lon_min, lon_max, n)
+
+
+def synthetic_houses(n, rng):
+    """
+    n houses in the columns of redfin_cleaned_v2.csv used by process_data,
+    with a tenth of the prices per square foot missing.
+    """
+    lat, lon = random_points(n, rng)
+    sq_ft = rng.uniform(500, 4000, n).round()
+    price_per_sq_ft = rng.uniform(100, 600, n).round()
+    price_per_sq_ft[rng.random(n) < 0.1] = np.nan
+    return pd.DataFrame({
+        "url": [f"https://redfin.com/IL/Chicago/home/{k}" for k in range(n)],
+        "price": (sq_ft * np.nan_to_num(price_per_sq_ft, nan=300)).round(),
+        "sq_ft": sq_ft,
+        "price_per_sq_ft": price_per_sq_ft,
+        "latitude": lat,
+        "longitude": lon,
+        "beds": rng.integers(1, 6, n).astype(float),
+        "baths": rng.integers(1, 4, n).astype(float),
+        "property_type": rng.choice(["Condo/Co-op", "Single Family Residential",
+                                     "Townhouse", "Multi-Family (2-4 Unit)"], n),
+        "year_built": rng.integers(1890, 2024, n).astype(float),
+    })
+
+
+def synthetic_places(n, rng, columns=PLACE_COLUMNS):
+    """
+    n places in the columns of the place CSVs written by get_places.py.
+    """
+    lat, lon = random_points(n, rng)
+    values = {
+        "Name": [f"Place {k}" for k in range(n)],
+        "Business Status": "OPERATIONAL",
+        "Address": [f"{k} Main Street" for k in range(n)],
+        "City": "Chicago",
+        "Price Level": rng.integers(1, 5, n).astype(float),
+        "Rating": rng.uniform(1, 5, n).round(1),
+        "Total Ratings": rng.integers(0, 2000, n),
+        "Types": "['point_of_interest', 'establishment']",
+        "Latitude": lat,
+        "Longitude": lon,
+    }
+    return pd.DataFrame({col: values[col] for col in columns})
+
+
+def synthetic_crimes(n, rng):
+    """
+    n crimes in the columns of crime.csv from get_crime.ipynb.
+    """
+    lat, lon = random_points(n, rng)
+    start = np.datetime64("2024-02-01T00:00:00")
+    seconds = rng.integers(0, 366 * 24 * 3600, n)
+    return pd.DataFrame({
+        "id": np.arange(n),
+        "case_number": [f"JH{k:06d}" for k in range(n)],
+        "date": (start + seconds.astype("timedelta64[s]")).astype(str),
+        "block": "001XX N STATE ST",
+        "primary_type": rng.choice(CRIME_TYPES, n),
+        "description": "x",
+        "location_description": "STREET",
+        "arrest": rng.random(n) < 0.2,
+        "domestic": rng.random(n) < 0.1,
+        "Latitude": lat,
+        "Longitude": lon,
+    })
+
+
+def synthetic_tables(size, seed=0):
+    """
+    Every input table of process_data for one benchmark size.
+
+    Returns:
+      dict: DataFrames for 'houses', 'restaurants', 'stores', 'schools',
+            'hospitals' and 'crime'.
+    """
+    rng = np.random.default_rng(seed)
+    n_places = max(size // 10, 1)
+    return {
+        "houses": synthetic_houses(n_places, rng),
+        "restaurants": synthetic_places(n_places, rng, RESTAURANT_COLUMNS),
+        "stores": synthetic_places(n_places, rng),
+        "schools": synthetic_places(n_places, rng),
+        "hospitals": synthetic_places(n_places, rng),
+        "crime": synthetic_crimes(size, rng),
+    }
+
+
+def write_pipeline_inputs(tables, root):
+    """
+    Write the tables as the input files process_data reads, under root.
+    """
+    for subdir in ("place_data", "crime_data", "redfin_data"):
+        os.makedirs(os.path.join(root, subdir), exist_ok=True)
+    tables["restaurants"].to_csv(os.path.join(root, "place_data", "chicago_restaurants.csv"),
+                                 header=False, index=False)
+    for group, name in (("stores", "convenience_store_data.csv"),
+                        ("schools", "school_data.csv"),
+                        ("hospitals", "hospital_data.csv")):
+        tables[group].to_csv(os.path.join(root, "place_data", name), index=False)
+    tables["crime"].to_csv(os.path.join(root, "crime_data", "crime.csv"), index=False)
+    tables["houses"].to_csv(os.path.join(root, "redfin_data", "redfin_cleaned_v2.csv"),
+                            index=False)
+
+
+@contextmanager
+def working_directory(path):
+    """
+    Temporarily change the working directory (process_data reads from it).
+    """
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def measure(func, repeat=DEFAULT_REPEAT, calls=1, trace_memory=True):
+    """
+    Time a function and record its peak memory.
+
+    Inputs:
+      func (function): Runs the benchmark once when called with an int k,
+                       the index of the call (e.g., which house to query).
+      repeat (int): Number of timed repeats; the fastest one is kept.
+      calls (int): Calls per repeat; the time is divided by it.
+      trace_memory (bool): Run once more under tracemalloc for the peak memory.
+
+    Returns:
+      dict: 'seconds' (per call) and 'peak_mb' (None if not traced).
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for k in range(calls):
+            func(k)
+        best = min(best, (time.perf_counter() - start) / calls)
+
+    peak_mb = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            func(0)
+            peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+    return {"seconds": best, "peak_mb": peak_mb}
+
+
+def helper_benchmarks(tables, queries=DEFAULT_QUERIES):
+    """
+    The util.py helpers (and their indexed versions) for one set of tables.
+
+    Returns:
+      dict: Benchmark name -> (function of the call index, number of calls).
+    """
+    houses = tables["houses"]
+    restaurants = tables["restaurants"]
+    stores = tables["stores"]
+    crime = tables["crime"]
+    queries = min(queries, len(houses))
+    lat = houses["latitude"].to_numpy()
+    lon = houses["longitude"].to_numpy()
+    missing = houses.index[houses["price_per_sq_ft"].isna()]
+    missing = missing if len(missing) else houses.index
+
+    store_index = SpatialIndex(stores)
+    crime_aggregator = CrimeAggregator(crime)
+    house_index = SpatialIndex(houses, lat_col="latitude", lon_col="longitude")
+
+    return {
+        "haversine_distance": (
+            lambda k: haversine_distance(lat[k], lon[k], crime["Latitude"].values,
+                                         crime["Longitude"].values), queries),
+        "spatial_index_build": (lambda k: SpatialIndex(crime), 1),
+        "crime_aggregator_build": (lambda k: CrimeAggregator(crime), 1),
+        "count_nearby": (lambda k: count_nearby(lat[k], lon[k], stores), queries),
+        "count_nearby_indexed": (lambda k: count_nearby(lat[k], lon[k], store_index), queries),
+        "crime_summary": (lambda k: crime_summary(lat[k], lon[k], crime), queries),
+        "crime_summary_aggregator": (
+            lambda k: crime_summary(lat[k], lon[k], crime_aggregator), queries),
+        "compute_restaurant_stats": (
+            lambda k: compute_restaurant_stats(lat[k], lon[k], restaurants, "Rating"), queries),
+        "impute_house_price_per_sq_ft": (
+            lambda k: impute_house_price_per_sq_ft(houses.loc[missing[k % len(missing)]],
+                                                   houses), queries),
+        "impute_house_price_per_sq_ft_indexed": (
+            lambda k: impute_house_price_per_sq_ft(houses.loc[missing[k % len(missing)]],
+                                                   house_index), queries),
+    }
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, pipeline_max_size=DEFAULT_PIPELINE_MAX_SIZE,
+                   queries=DEFAULT_QUERIES, repeat=DEFAULT_REPEAT, trace_memory=True,
+                   seed=0):
+    """
+    Run every benchmark at every size.
+
+    Inputs:
+      sizes (list): Number of crimes of each size (see the top of this file).
+      pipeline_max_size (int): Largest size for which process_data is run.
+      queries (int): Houses queried per single-house helper.
+      repeat (int): Timed repeats per benchmark (the fastest one is kept).
+      trace_memory (bool): Record the peak memory of every benchmark.
+      seed (int): Seed of the synthetic data.
+
+    Returns:
+      list: One dict per benchmark and size with 'benchmark', 'size',
+            'seconds' and 'peak_mb'.
+    """
+    # Imported here, as it pulls in the whole pipeline
+    from process_and_combine import process_data
+
+    results = []
+    for size in sizes:
+        tables = synthetic_tables(size, seed)
+        for name, (func, calls) in helper_benchmarks(tables, queries).items():
+            result = measure(func, repeat, calls, trace_memory)
+            results.append({"benchmark": name, "size": size, **result})
+            print(format_result(results[-1]))
+
+        if size <= pipeline_max_size:
+            with tempfile.TemporaryDirectory(prefix="benchmark_") as root:
+                write_pipeline_inputs(tables, root)
+                with working_directory(root):
+                    # One repeat: the pipeline is long enough to time once
+                    result = measure(lambda k: process_data(), 1, 1, trace_memory)
+            results.append({"benchmark": "process_data", "size": size, **result})
+            print(format_result(results[-1]))
+    return results
+
+
+def format_result(result, previous=None):
+    """
+    One line of the report, with the ratio to the previous run if there is one.
+    """
+    line = f"{result['benchmark']:<36} {result['size']:>9,} {result['seconds'] * 1000:>12.3f} ms"
+    if result["peak_mb"] is not None:
+        line += f" {result['peak_mb']:>10.1f} MB"
+    if previous is not None and previous["seconds"] > 0:
+        ratio = result["seconds"] / previous["seconds"]
+        line += f"   x{ratio:.2f} vs previous"
+        if ratio > REGRESSION_RATIO:
+            line += "  REGRESSION"
+    return line
+
+
+def git_commit():
+    """
+    Short hash of the current git commit, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path=HISTORY_FILE):
+    """
+    Previous runs in the history file (an empty list if there is none).
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_run(results, path=HISTORY_FILE, label=None):
+    """
+    Append a run to the history file and print it next to the previous run.
+
+    Inputs:
+      results (list): Output of run_benchmarks.
+      path (str): Path of the JSON history file.
+      label (str): Optional description of the run (e.g., the change tested).
+
+    Returns:
+      dict: The run that was appended.
+    """
+    history = load_history(path)
+    previous = {}
+    if history:
+        previous = {(r["benchmark"], r["size"]): r for r in history[-1]["results"]}
+
+    run = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "label": label,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "results": results,
+    }
+    history.append(run)
+    with open(path, "w") as f:
+        json.dump(history, f, indent=4)
+
+    print(f"\nRun {len(history)} (commit {run['commit']}) saved to {path}")
+    for result in results:
+        print(format_result(result, previous.get((result["benchmark"], result["size"]))))
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the spatial helpers and process_data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="numbers of crimes to benchmark (houses and places are a tenth)")
+    parser.add_argument("--pipeline-max-size", type=int, default=DEFAULT_PIPELINE_MAX_SIZE,
+                        help="largest size for which process_data is run (0 to skip it)")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the extra tracemalloc run of every benchmark")
+    parser.add_argument("--history", default=HISTORY_FILE)
+    parser.add_argument("--label", help="description of this run in the history")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.pipeline_max_size, args.queries, args.repeat,
+                             not args.no_memory, args.seed)
+    save_run(results, args.history, args.label)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+# This file contains precomputed geohash cell aggregates of the amenity and
+# crime tables, to answer "how many X within ~r km of here?" for arbitrary
+# points with a few hash lookups instead of a search over the points.
+
+# Every place / crime is binned into the geohash cell containing it (a
+# geohash of precision p is a fixed lat/lng grid, with 5 * p bits split
+# between longitude and latitude; at the default precision 7 a cell is about
+# 150 m x 100 m in Chicago). Each occupied cell keeps its number of points,
+# the sum and number of non-missing values of some columns (e.g., 'Rating'
+# and 'Price Level', for means), and for crimes a histogram of the crime
+# types. A radius query then looks up the ring of cells around the point:
+#   - approximate (default): add up the cells whose center is within the
+#     radius, i.e., points up to half a cell away from the circle can be
+#     counted in or out;
+#   - exact: add up the cells whose four corners are all within the radius
+#     (so all their points are), and check the points of the cells on the
+#     boundary one by one, which gives the same result as util.count_nearby,
+#     util.compute_restaurant_stats and util.crime_summary.
+
+# Usage (from data/, to precompute the cells of every input table):
+#   python cell_aggregates.py --precision 7
+
+# Resource:
+    # 1) https://en.wikipedia.org/wiki/Geohash
+    # 2) https://pandas.pydata.org/docs/reference/api/pandas.Index.get_indexer.html
+
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+from crime_aggregator import reduce_type_counts
+from spatial_index import _expand_ranges
+from util import (
+    EARTH_RADIUS_KM,
+    NONVIOLENT_CRIME_TYPES,
+    VIOLENT_CRIME_TYPES,
+    haversine_distance
+)
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+DEFAULT_PRECISION = 7
+CELL_DIR = "cell_aggregates"
+
+# Relative padding of the search window and of the "cell inside the circle"
+# test, so floating point rounding never misclassifies a cell
+WINDOW_PADDING = 1e-6
+INSIDE_MARGIN = 1e-9
+
+# Number of query points looked up at a time
+QUERY_CHUNK = 1024
+
+
+def geohash_bits(precision):
+    """
+    Number of (latitude, longitude) bits of a geohash of this precision.
+    """
+    return 5 * precision // 2, (5 * precision + 1) // 2
+
+
+def cell_size_deg(precision):
+    """
+    Height and width in degrees of a geohash cell of this precision.
+    """
+    lat_bits, lon_bits = geohash_bits(precision)
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def cell_index(lat, lon, precision=DEFAULT_PRECISION):
+    """
+    Row and column of the geohash cells containing some points.
+
+    Returns:
+      tuple of np arrays (iy, ix) of int64.
+    """
+    height, width = cell_size_deg(precision)
+    lat_bits, lon_bits = geohash_bits(precision)
+    iy = np.floor((np.asarray(lat, dtype=float) + 90) / height).astype(np.int64)
+    ix = np.floor((np.asarray(lon, dtype=float) + 180) / width).astype(np.int64)
+    return np.clip(iy, 0, 2 ** lat_bits - 1), np.clip(ix, 0, 2 ** lon_bits - 1)
+
+
+def geohash(lat, lon, precision=DEFAULT_PRECISION):
+    """
+    Geohash strings of some points (e.g., 'dp3wjzt' for downtown Chicago).
+
+    Inputs:
+      lat, lon (array-like): Coordinates of the points.
+      precision (int): Number of characters.
+
+    Returns:
+      np array: One geohash per point.
+    """
+    iy, ix = cell_index(np.atleast_1d(lat), np.atleast_1d(lon), precision)
+    lat_bits, lon_bits = geohash_bits(precision)
+    # Bits alternate between longitude and latitude, starting with longitude
+    chars = np.zeros((len(iy), precision), dtype=np.int64)
+    lat_pos, lon_pos = lat_bits, lon_bits
+    for bit in range(5 * precision):
+        if bit % 2 == 0:
+            lon_pos -= 1
+            value = (ix >> lon_pos) & 1
+        else:
+            lat_pos -= 1
+            value = (iy >> lat_pos) & 1
+        chars[:, bit // 5] = chars[:, bit // 5] * 2 + value
+    alphabet = np.array(list(GEOHASH_BASE32))
+    return np.array(["".join(row) for row in alphabet[chars]])
+
+
+class CellAggregates:
+    """
+    Per-cell counts, value sums and crime type histograms of a point table.
+
+    Only occupied cells are stored, in `keys` (iy * 2 ** lon_bits + ix) with
+    a hash index to find them. The points themselves are kept sorted by cell
+    for the exact refinement of the boundary cells.
+    """
+
+    def __init__(self, df, value_columns=(), type_col=None, precision=DEFAULT_PRECISION,
+                 lat_col="Latitude", lon_col="Longitude"):
+        """
+        Bin the points of a table into geohash cells.
+
+        Inputs:
+          df (DataFrame): The amenity or crime table.
+          value_columns (iterable): Columns to average, e.g., 'Rating'.
+          type_col (str): Column with the crime type, to keep type histograms.
+          precision (int): Geohash precision of the cells.
+          lat_col, lon_col (str): Coordinate columns.
+        """
+        self.precision = precision
+        self.value_columns = list(value_columns)
+        self.height, self.width = cell_size_deg(precision)
+        self.lon_bits = geohash_bits(precision)[1]
+
+        lat = pd.to_numeric(df[lat_col], errors="coerce").to_numpy(dtype=float)
+        lon = pd.to_numeric(df[lon_col], errors="coerce").to_numpy(dtype=float)
+        valid = ~(np.isnan(lat) | np.isnan(lon))
+        values = np.column_stack(
+            [pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+             for col in self.value_columns]
+        ) if self.value_columns else np.empty((len(df), 0))
+
+        if type_col is None:
+            codes = np.full(len(df), -1, dtype=np.int64)
+            type_names = []
+        else:
+            codes, type_names = pd.factorize(df[type_col], sort=True)
+        self.type_names = np.asarray(type_names, dtype=object)
+        self.is_violent = np.isin(self.type_names, list(VIOLENT_CRIME_TYPES))
+        self.is_nonviolent = np.isin(self.type_names, list(NONVIOLENT_CRIME_TYPES))
+
+        iy, ix = cell_index(lat[valid], lon[valid], precision)
+        point_keys = iy * 2 ** self.lon_bits + ix
+        order = np.argsort(point_keys, kind="stable")
+        self.lat = lat[valid][order]
+        self.lon = lon[valid][order]
+        self.values = values[valid][order]
+        self.codes = codes[valid][order]
+
+        keys, starts, counts = np.unique(point_keys[order], return_index=True,
+                                         return_counts=True)
+        self.set_cells(keys, starts, counts)
+
+    def set_cells(self, keys, starts, counts):
+        """
+        Compute the per-cell aggregates from the points sorted by cell.
+        """
+        self.keys = keys
+        self.starts = starts
+        self.counts = counts
+        self.key_index = pd.Index(keys)
+        cell_of_point = np.repeat(np.arange(len(keys)), counts)
+
+        present = ~np.isnan(self.values)
+        self.value_sums = np.column_stack(
+            [np.bincount(cell_of_point, weights=np.where(present[:, j], self.values[:, j], 0),
+                         minlength=len(keys)) for j in range(self.values.shape[1])]
+        ) if self.value_columns else np.empty((len(keys), 0))
+        self.value_counts = np.column_stack(
+            [np.bincount(cell_of_point, weights=present[:, j], minlength=len(keys))
+             for j in range(self.values.shape[1])]
+        ) if self.value_columns else np.empty((len(keys), 0))
+
+        n_types = len(self.type_names)
+        typed = self.codes >= 0
+        self.type_histograms = np.bincount(
+            cell_of_point[typed] * n_types + self.codes[typed], minlength=len(keys) * n_types
+        ).reshape(len(keys), n_types).astype(np.int32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def cell_frame(self):
+        """
+        The aggregates as a DataFrame with one row per occupied cell.
+
+        Returns:
+          DataFrame: 'geohash', 'count', 'mean_<column>' for every value
+                     column and, for crimes, one count column per crime type.
+        """
+        iy = self.keys // 2 ** self.lon_bits
+        ix = self.keys % 2 ** self.lon_bits
+        center_lat = (iy + 0.5) * self.height - 90
+        center_lon = (ix + 0.5) * self.width - 180
+        frame = pd.DataFrame({"geohash": geohash(center_lat, center_lon, self.precision),
+                              "count": self.counts})
+        for j, col in enumerate(self.value_columns):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                frame[f"mean_{col}"] = self.value_sums[:, j] / self.value_counts[:, j]
+        for t, name in enumerate(self.type_names):
+            frame[name] = self.type_histograms[:, t]
+        return frame
+
+    def _ring(self, query_lat, radius_km):
+        """
+        Row / column offsets of every cell that can be within radius_km of
+        the query points (the same bound as SpatialIndex._window).
+        """
+        angle = radius_km / EARTH_RADIUS_KM * (1 + WINDOW_PADDING)
+        max_lat = min(float(np.nanmax(np.abs(query_lat), initial=0.0)) + np.degrees(angle), 89.9)
+        ratio = np.sin(angle / 2) / np.cos(np.radians(max_lat))
+        k_y = int(np.ceil(np.degrees(angle) / self.height))
+        k_x = int(np.ceil(np.degrees(2 * np.arcsin(min(1.0, ratio))) / self.width))
+        dy, dx = np.meshgrid(np.arange(-k_y, k_y + 1), np.arange(-k_x, k_x + 1), indexing="ij")
+        return dy.ravel(), dx.ravel()
+
+    def _query_chunk(self, lat, lon, radius_km, exact):
+        """
+        Counts, value sums / counts and type histograms around a chunk of points.
+        """
+        n = len(lat)
+        n_values = len(self.value_columns)
+        n_types = len(self.type_names)
+        counts = np.zeros(n, dtype=np.int64)
+        sums = np.zeros((n, n_values))
+        value_counts = np.zeros((n, n_values))
+        histograms = np.zeros((n, n_types), dtype=np.int64)
+
+        valid = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)))
+        if len(valid) == 0 or len(self) == 0:
+            return counts, sums, value_counts, histograms
+        iy, ix = cell_index(lat[valid], lon[valid], self.precision)
+        dy, dx = self._ring(lat[valid], radius_km)
+
+        # Every (query, cell) pair of the ring, keeping the occupied cells
+        q = np.repeat(valid, len(dy))
+        cell_y = (iy[:, None] + dy[None, :]).ravel()
+        cell_x = (ix[:, None] + dx[None, :]).ravel()
+        pos = self.key_index.get_indexer(cell_y * 2 ** self.lon_bits + cell_x)
+        occupied = pos >= 0
+        q, cell_y, cell_x, pos = q[occupied], cell_y[occupied], cell_x[occupied], pos[occupied]
+
+        if exact:
+            # Max distance to a lat/lng box is reached at one of its corners
+            corner = np.zeros(len(q))
+            for cy in (0, 1):
+                for cx in (0, 1):
+                    corner = np.maximum(corner, haversine_distance(
+                        lat[q], lon[q], (cell_y + cy) * self.height - 90,
+                        (cell_x + cx) * self.width - 180))
+            whole = corner <= radius_km * (1 - INSIDE_MARGIN)
+        else:
+            center = haversine_distance(lat[q], lon[q], (cell_y + 0.5) * self.height - 90,
+                                        (cell_x + 0.5) * self.width - 180)
+            whole = center <= radius_km
+
+        # Cells counted as a whole
+        cell_q, cell_pos = q[whole], pos[whole]
+        counts += np.bincount(cell_q, weights=self.counts[cell_pos], minlength=n).astype(np.int64)
+        for j in range(n_values):
+            sums[:, j] += np.bincount(cell_q, weights=self.value_sums[cell_pos, j], minlength=n)
+            value_counts[:, j] += np.bincount(cell_q, weights=self.value_counts[cell_pos, j],
+                                              minlength=n)
+        if n_types:
+            flat = (np.repeat(cell_q, n_types) * n_types
+                    + np.tile(np.arange(n_types), len(cell_q)))
+            histograms += np.bincount(flat, weights=self.type_histograms[cell_pos].ravel(),
+                                      minlength=n * n_types).reshape(n, n_types).astype(np.int64)
+
+        if exact:
+            # Boundary cells: check their points one by one
+            edge_q, edge_pos = q[~whole], pos[~whole]
+            point_q = np.repeat(edge_q, self.counts[edge_pos])
+            points = _expand_ranges(self.starts[edge_pos], self.counts[edge_pos])
+            within = haversine_distance(lat[point_q], lon[point_q], self.lat[points],
+                                        self.lon[points]) <= radius_km
+            point_q, points = point_q[within], points[within]
+            counts += np.bincount(point_q, minlength=n)
+            for j in range(n_values):
+                nearby = self.values[points, j]
+                present = ~np.isnan(nearby)
+                sums[:, j] += np.bincount(point_q[present], weights=nearby[present], minlength=n)
+                value_counts[:, j] += np.bincount(point_q[present], minlength=n)
+            if n_types:
+                typed = self.codes[points] >= 0
+                histograms += np.bincount(point_q[typed] * n_types + self.codes[points][typed],
+                                          minlength=n * n_types).reshape(n, n_types)
+        return counts, sums, value_counts, histograms
+
+    def _query(self, query_lat, query_lon, radius_km, exact):
+        """
+        The result of `query`, and the (n_queries, n_types) crime type histograms.
+        """
+        query_lat = np.asarray(query_lat, dtype=float).ravel()
+        query_lon = np.asarray(query_lon, dtype=float).ravel()
+        starts = range(0, max(len(query_lat), 1), QUERY_CHUNK)
+        parts = [self._query_chunk(query_lat[start:start + QUERY_CHUNK],
+                                   query_lon[start:start + QUERY_CHUNK], radius_km, exact)
+                 for start in starts]
+        counts, sums, value_counts, histograms = (np.concatenate(arrays)
+                                                  for arrays in zip(*parts))
+
+        result = {"count": counts}
+        for j, col in enumerate(self.value_columns):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = sums[:, j] / value_counts[:, j]
+            mean[counts == 0] = np.nan
+            result[f"mean_{col}"] = mean
+        if len(self.type_names):
+            result.update(reduce_type_counts(histograms, self.type_names, self.is_violent,
+                                             self.is_nonviolent))
+        return pd.DataFrame(result), histograms
+
+    def query(self, query_lat, query_lon, radius_km=1.0, exact=False):
+        """
+        Aggregates of the points within radius_km of many query points.
+
+        Inputs:
+          query_lat, query_lon (array-like): Coordinates of the query points.
+          radius_km (float): Search radius in kilometers.
+          exact (bool): Check the points of the boundary cells one by one
+                        instead of deciding by the cell centers.
+
+        Returns:
+          DataFrame: One row per query point with 'count', 'mean_<column>'
+                     for every value column (NaN without points nearby), and
+                     for crimes 'violent_crime_count', 'nonviolent_crime_count',
+                     'most_prevalent_crime' and 'crime_proportion'.
+        """
+        return self._query(query_lat, query_lon, radius_km, exact)[0]
+
+    def lookup(self, lat, lon, radius_km=1.0, exact=False):
+        """
+        Aggregates of the points within radius_km of a single point.
+
+        Returns:
+          dict: The columns of `query`, plus 'type_counts' (crime type ->
+                count, for the types present) for crimes. As in
+                util.crime_summary, 'most_prevalent_crime' is None when there
+                is no crime nearby.
+        """
+        result, histograms = self._query([lat], [lon], radius_km, exact)
+        row = result.iloc[0].to_dict()
+        if len(self.type_names):
+            histogram = histograms[0]
+            row["type_counts"] = {name: int(histogram[t])
+                                  for t, name in enumerate(self.type_names) if histogram[t]}
+            if row["count"] == 0 or not row["type_counts"]:
+                row["most_prevalent_crime"] = None
+        row["count"] = int(row["count"])
+        return row
+
+    def save(self, path):
+        """
+        Write the cells and the points sorted by cell to an .npz file.
+        """
+        np.savez(path, lat=self.lat, lon=self.lon, values=self.values, codes=self.codes,
+                 keys=self.keys, starts=self.starts, counts=self.counts,
+                 meta=np.array(json.dumps({"precision": self.precision,
+                                           "value_columns": self.value_columns,
+                                           "type_names": list(self.type_names)})))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read cells written by save (the aggregates are recomputed from the
+        sorted points, which only takes a few bincounts).
+        """
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            cells = cls.__new__(cls)
+            cells.precision = meta["precision"]
+            cells.value_columns = meta["value_columns"]
+            cells.height, cells.width = cell_size_deg(cells.precision)
+            cells.lon_bits = geohash_bits(cells.precision)[1]
+            cells.type_names = np.asarray(meta["type_names"], dtype=object)
+            cells.is_violent = np.isin(cells.type_names, list(VIOLENT_CRIME_TYPES))
+            cells.is_nonviolent = np.isin(cells.type_names, list(NONVIOLENT_CRIME_TYPES))
+            cells.lat, cells.lon = data["lat"], data["lon"]
+            cells.values, cells.codes = data["values"], data["codes"]
+            cells.set_cells(data["keys"], data["starts"], data["counts"])
+        return cells
+
+
+def build_cell_aggregates(tables, precision=DEFAULT_PRECISION, cell_dir=None):
+    """
+    Precompute the cells of every input table of process_data.
+
+    Inputs:
+      tables (dict): The 'restaurants', 'stores', 'schools', 'hospitals' and
+                     'crime' DataFrames (any subset).
+      precision (int): Geohash precision of the cells.
+      cell_dir (str): If given, the cells are also saved there as <group>.npz.
+
+    Returns:
+      dict: A CellAggregates per table.
+    """
+    cells = {}
+    for group, table in tables.items():
+        if group == "crime":
+            cells[group] = CellAggregates(table, type_col="primary_type", precision=precision)
+        else:
+            value_columns = [col for col in ("Rating", "Price Level") if col in table.columns]
+            cells[group] = CellAggregates(table, value_columns, precision=precision)
+        if cell_dir is not None:
+            os.makedirs(cell_dir, exist_ok=True)
+            cells[group].save(os.path.join(cell_dir, f"{group}.npz"))
+    return cells
+
+
+def load_cell_aggregates(cell_dir=CELL_DIR):
+    """
+    Load every table's cells saved by build_cell_aggregates.
+    """
+    return {name[:-len(".npz")]: CellAggregates.load(os.path.join(cell_dir, name))
+            for name in sorted(os.listdir(cell_dir)) if name.endswith(".npz")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute geohash cell aggregates")
+    parser.add_argument("--precision", type=int, default=DEFAULT_PRECISION)
+    parser.add_argument("--cell-dir", default=CELL_DIR)
+    args = parser.parse_args()
+
+    # Imported here, as it pulls in the whole pipeline
+    from process_and_combine import load_input_tables
+
+    tables, _, _ = load_input_tables()
+    cells = build_cell_aggregates(tables, args.precision, args.cell_dir)
+    for group, table_cells in cells.items():
+        print(f"{group}: {len(table_cells)} cells")
+    print(f"Cell aggregates saved to {args.cell_dir}")
+
+
+if __name__ == "__main__":
+    main()
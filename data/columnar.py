@@ -0,0 +1,109 @@
+# This file contains a typed columnar (Parquet) cache for the pipeline's
+# inputs and output. The place and crime CSVs are parsed and cleaned once;
+# the cleaned table is then stored as Parquet next to a small JSON file with
+# the hash of the source CSV, and later runs read the Parquet file instead of
+# re-parsing the CSV (as long as the CSV did not change). Only the requested
+# columns are read.
+
+# Parquet needs pyarrow. Without it, everything falls back to plain CSV
+# parsing, so the pipeline still runs, just without the cache.
+
+# Resource:
+    # 1) https://pandas.pydata.org/docs/reference/api/pandas.read_parquet.html
+    # 2) https://arrow.apache.org/docs/python/parquet.html
+
+import hashlib
+import json
+import os
+import pandas as pd
+from util import file_hash
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Fixed dtypes of the cleaned tables (everything else is kept as strings)
+FLOAT_COLUMNS = ["Latitude", "Longitude", "Price Level", "Rating",
+                 "latitude", "longitude"]
+
+
+def to_typed(df):
+    """
+    Give a cleaned table fixed dtypes so it can be stored as Parquet.
+
+    Numeric columns are float64, and object columns only hold strings or
+    missing values (mixed columns such as 'most_prevalent_crime', which holds
+    0 for houses without crime, are stored as they would be read back from
+    CSV, i.e., '0').
+
+    Inputs:
+      df (DataFrame): The table.
+
+    Returns:
+      DataFrame: A typed copy of the table.
+    """
+    df = df.copy()
+    for col in df.columns:
+        if col in FLOAT_COLUMNS:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+        elif df[col].dtype == object:
+            df[col] = df[col].map(lambda x: x if x is None or isinstance(x, str)
+                                  or pd.isna(x) else str(x))
+    return df
+
+
+def write_columnar(df, filepath):
+    """
+    Write a table as Parquet.
+
+    Inputs:
+      df (DataFrame): The table.
+      filepath (str): Path of the Parquet file.
+
+    Returns:
+      bool: True if the file was written, False if pyarrow is missing.
+    """
+    if not HAS_PYARROW:
+        return False
+    to_typed(df).to_parquet(filepath, index=False)
+    return True
+
+
+def cached_load(filepath, load, cache_dir, columns=None):
+    """
+    Load a cleaned input table, from its Parquet cache when it is up to date.
+
+    Inputs:
+      filepath (str): Path to the source CSV.
+      load (function): Parses and cleans the CSV into a DataFrame; only called
+                       when there is no up-to-date cache.
+      cache_dir (str): Directory of the Parquet cache (created if needed).
+      columns (list): Columns to return (default all).
+
+    Returns:
+      DataFrame: The cleaned table.
+    """
+    if not HAS_PYARROW:
+        df = load()
+        return df if columns is None else df[columns]
+
+    # Keyed by the full path, so inputs with the same file name don't collide
+    path_hash = hashlib.sha1(os.path.abspath(filepath).encode()).hexdigest()[:12]
+    name = f"{os.path.basename(filepath)}-{path_hash}"
+    parquet_path = os.path.join(cache_dir, f"{name}.parquet")
+    meta_path = os.path.join(cache_dir, f"{name}.json")
+    source_hash = file_hash(filepath)
+
+    if os.path.exists(parquet_path) and os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            if json.load(f).get("source_hash") == source_hash:
+                return pd.read_parquet(parquet_path, columns=columns)
+
+    df = to_typed(load())
+    os.makedirs(cache_dir, exist_ok=True)
+    df.to_parquet(parquet_path, index=False)
+    with open(meta_path, "w") as f:
+        json.dump({"source": filepath, "source_hash": source_hash}, f, indent=4)
+    return df if columns is None else df[columns]
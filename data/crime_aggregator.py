@@ -0,0 +1,198 @@
+# This file contains a precompiled crime aggregator. The crime types are
+# encoded once as integer category codes, with a violent / non-violent lookup
+# per code, so the crimes around a house can be summarized with np.bincount
+# instead of filtering the whole crime DataFrame and running a pandas groupby
+# for every house.
+
+# Resource:
+    # 1) https://pandas.pydata.org/docs/reference/api/pandas.factorize.html
+    # 2) https://numpy.org/doc/stable/reference/generated/numpy.bincount.html
+
+import numpy as np
+import pandas as pd
+from spatial_index import SpatialIndex, DEFAULT_MAX_MEMORY_MB
+from util import (
+    VIOLENT_CRIME_TYPES,
+    NONVIOLENT_CRIME_TYPES,
+    as_radius_list,
+    radius_label
+)
+
+SUMMARY_COLUMNS = ["violent_crime_count", "nonviolent_crime_count",
+                   "most_prevalent_crime", "crime_proportion"]
+
+
+def reduce_type_counts(type_counts, type_names, is_violent, is_nonviolent):
+    """
+    Turn per-house crime type counts into the crime summary columns.
+
+    Inputs:
+      type_counts (np array): An (n_houses, n_types) matrix of counts.
+      type_names (np array): The sorted crime type names.
+      is_violent, is_nonviolent (np array): Whether each type is (non-)violent.
+
+    Returns:
+      dict: Arrays for each of SUMMARY_COLUMNS. Houses without any
+            incident get 0 as the most prevalent crime and proportion,
+            as in the summary_redfin.csv produced by process_data.
+    """
+    n_houses = len(type_counts)
+    total = type_counts.sum(axis=1)
+    has_crime = total > 0
+    top = np.zeros(n_houses, dtype=np.int64)
+    if len(type_names):
+        top = type_counts.argmax(axis=1)
+
+    most_prevalent = np.full(n_houses, 0, dtype=object)
+    most_prevalent[has_crime] = type_names[top[has_crime]]
+    proportion = np.zeros(n_houses)
+    proportion[has_crime] = type_counts[has_crime, top[has_crime]] / total[has_crime]
+
+    return {
+        "violent_crime_count": type_counts[:, is_violent].sum(axis=1),
+        "nonviolent_crime_count": type_counts[:, is_nonviolent].sum(axis=1),
+        "most_prevalent_crime": most_prevalent,
+        "crime_proportion": proportion,
+    }
+
+
+class CrimeAggregator:
+    """
+    Crime incidents with their types encoded as category codes.
+
+    Codes follow the sorted crime type names, so taking the first maximum
+    count gives the same 'most_prevalent_crime' as groupby(...).idxmax() in
+    util.crime_summary. Incidents with a missing type get code -1; they count
+    towards 'num_crimes' but not towards the type breakdown.
+    """
+
+    def __init__(self, crime_df, index=None, codes=None, type_names=None):
+        """
+        Encode the crime types and index the incident coordinates once.
+
+        Inputs:
+          crime_df (DataFrame): Crime incidents with 'Latitude', 'Longitude'
+                                and 'primary_type' columns.
+          index (SpatialIndex): An index already built on crime_df (optional).
+          codes, type_names: Crime types already encoded (e.g., by a
+                             crime_store.CrimeStore): a code per incident
+                             (-1 if missing) into the sorted type names. If
+                             not given, 'primary_type' is encoded.
+        """
+        self.df = crime_df
+        self.index = index if index is not None else SpatialIndex(crime_df)
+
+        if codes is None:
+            codes, type_names = pd.factorize(crime_df["primary_type"], sort=True)
+        self.codes = codes
+        self.type_names = np.asarray(type_names, dtype=object)
+        self.is_violent = np.isin(self.type_names, list(VIOLENT_CRIME_TYPES))
+        self.is_nonviolent = np.isin(self.type_names, list(NONVIOLENT_CRIME_TYPES))
+
+    @property
+    def n_types(self):
+        return len(self.type_names)
+
+    def count_types(self, house_idx, rows, n_houses):
+        """
+        Count the incidents of each crime type around each house.
+
+        Inputs:
+          house_idx (np array): House of every (house, incident) pair.
+          rows (np array): Positional row of the incident in every pair.
+          n_houses (int): Number of houses.
+
+        Returns:
+          np array: An (n_houses, n_types) matrix of counts.
+        """
+        nearby_codes = self.codes[rows]
+        typed = nearby_codes >= 0
+        flat = house_idx[typed] * self.n_types + nearby_codes[typed]
+        counts = np.bincount(flat, minlength=n_houses * self.n_types)
+        return counts.reshape(n_houses, self.n_types)
+
+    def reduce(self, type_counts):
+        """
+        Turn per-house crime type counts into the crime summary columns
+        (see reduce_type_counts).
+        """
+        return reduce_type_counts(type_counts, self.type_names, self.is_violent,
+                                  self.is_nonviolent)
+
+    def summarize(self, house_lat, house_lon, radius_km=1.0,
+                  max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+        """
+        Crime counts and summary for all houses in one batched call.
+
+        Inputs:
+          house_lat, house_lon (np array): Coordinates of all houses.
+          radius_km (float or list of float): Search radius in kilometers
+                     (default to 1 km). A list of radii is answered from a
+                     single search at the largest one.
+          max_memory_mb (float): Memory cap for one chunk of pairs.
+
+        Returns:
+          DataFrame: One row per house with 'num_crimes' followed by SUMMARY_COLUMNS.
+                     With a list of radii, every column is repeated per radius
+                     with a suffix, e.g., 'num_crimes_500m', 'num_crimes_1km'.
+        """
+        radii = as_radius_list(radius_km)
+        n_houses = len(house_lat)
+        columns = {
+            r: {
+                "num_crimes": np.zeros(n_houses, dtype=np.int64),
+                "violent_crime_count": np.zeros(n_houses, dtype=np.int64),
+                "nonviolent_crime_count": np.zeros(n_houses, dtype=np.int64),
+                "most_prevalent_crime": np.full(n_houses, 0, dtype=object),
+                "crime_proportion": np.zeros(n_houses),
+            }
+            for r in radii
+        }
+
+        for chunk, house_idx, rows, distances in self.index.iter_pairs(
+                house_lat, house_lon, max(radii), max_memory_mb):
+            n_chunk = chunk.stop - chunk.start
+            for r in radii:
+                within = distances <= r
+                columns[r]["num_crimes"][chunk] = np.bincount(house_idx[within],
+                                                              minlength=n_chunk)
+                type_counts = self.count_types(house_idx[within], rows[within], n_chunk)
+                summary = self.reduce(type_counts)
+                for col in SUMMARY_COLUMNS:
+                    columns[r][col][chunk] = summary[col]
+
+        if np.ndim(radius_km) == 0:
+            return pd.DataFrame(columns[radii[0]])
+        return pd.DataFrame({f"{col}_{radius_label(r)}": values
+                             for r in radii for col, values in columns[r].items()})
+
+    def summary(self, house_lat, house_lon, radius_km=1.0):
+        """
+        Crime summary for a single house, in the format of util.crime_summary.
+
+        Inputs:
+          house_lat (float): Latitude of the house.
+          house_lon (float): Longitude of the house.
+          radius_km (float or list of float): Search radius in kilometers (default to 1 km).
+
+        Returns:
+          dict: Same keys and values as util.crime_summary (a dict per radius
+                if a list of radii is given).
+        """
+        radii = as_radius_list(radius_km)
+        _, rows, distances = self.index.query_pairs([house_lat], [house_lon], max(radii))
+
+        summaries = {}
+        for r in radii:
+            within = rows[distances <= r]
+            type_counts = self.count_types(np.zeros(len(within), dtype=np.int64), within, 1)
+            if type_counts.sum() == 0:
+                summaries[r] = {"most_prevalent_crime": None, "crime_proportion": 0,
+                                "violent_crime_count": 0, "nonviolent_crime_count": 0}
+            else:
+                summary = self.reduce(type_counts)
+                summaries[r] = {col: summary[col][0] for col in SUMMARY_COLUMNS}
+
+        if np.ndim(radius_km) == 0:
+            return summaries[radii[0]]
+        return summaries
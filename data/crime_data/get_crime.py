@@ -0,0 +1,310 @@
+# This file requests crime data in Chicago from the City of Chicago data
+# portal (the script version of get_crime.ipynb). Instead of one request for
+# the whole year, the SoQL API is paged through with $offset / $order, and
+# every page is written straight to a typed columnar (Parquet) file with
+# only the kept columns, so the full response is never held in memory.
+
+# Every run fetches one date window into its own part file in crime_parquet/,
+# and the windows fetched so far are listed in crime_parquet/manifest.json.
+# A refresh only fetches the days after the last window (optionally
+# re-fetching a few days to pick up late reports); rows fetched twice are
+# dropped by id when the parts are loaded. Every window records the SHA-256
+# of its part file, so the manifest changes whenever the crimes do.
+
+# Usage (from data/crime_data/):
+#   python get_crime.py --start 2024-02-01 --end 2025-02-01
+#   python get_crime.py --refresh
+# The endpoint can be changed with --url, e.g., to a local stub server.
+
+# Resource:
+    # 1) https://data.cityofchicago.org/Public-Safety/Crimes-2001-to-Present/ijzp-q8t2/about_data
+    # 2) https://dev.socrata.com/docs/paging.html
+    # 3) https://dev.socrata.com/docs/queries/
+    # 4) https://arrow.apache.org/docs/python/parquet.html
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import requests
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+CRIME_URL = "https://data.cityofchicago.org/resource/ijzp-q8t2.json"
+PAGE_SIZE = 50000
+
+# Columns kept from the API, with their types; latitude and longitude are
+# stored as 'Latitude' and 'Longitude', the names process_and_combine.py uses
+COLUMNS_TO_KEEP = ["id", "case_number", "date", "block", "primary_type", "description",
+                   "location_description", "arrest", "domestic", "latitude", "longitude"]
+RENAME = {"latitude": "Latitude", "longitude": "Longitude"}
+STRING_COLUMNS = ["case_number", "block", "primary_type", "description", "location_description"]
+BOOL_COLUMNS = ["arrest", "domestic"]
+FLOAT_COLUMNS = ["Latitude", "Longitude"]
+
+STORE_DIR = "crime_parquet"
+MANIFEST_FILE = "manifest.json"
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+if HAS_PYARROW:
+    SCHEMA = pa.schema(
+        [("id", pa.int64()), ("case_number", pa.string()), ("date", pa.timestamp("ms")),
+         ("block", pa.string()), ("primary_type", pa.string()), ("description", pa.string()),
+         ("location_description", pa.string()), ("arrest", pa.bool_()),
+         ("domestic", pa.bool_()), ("Latitude", pa.float64()), ("Longitude", pa.float64())]
+    )
+
+
+def to_typed(records):
+    """
+    Turn one page of API records into a typed DataFrame with the kept columns.
+
+    Inputs:
+      records (list): JSON records from the API.
+
+    Returns:
+      DataFrame: The page, with the column order and types of SCHEMA.
+                 Records without a valid id are dropped, as crimes are
+                 deduplicated by id.
+    """
+    df = pd.DataFrame.from_records(records, columns=COLUMNS_TO_KEEP).rename(columns=RENAME)
+    df["id"] = pd.to_numeric(df["id"], errors="coerce")
+    df = df[df["id"].notna()].reset_index(drop=True)
+    df["id"] = df["id"].astype("int64")
+    df["date"] = pd.to_datetime(df["date"], errors="coerce").astype("datetime64[ms]")
+    for col in STRING_COLUMNS:
+        df[col] = df[col].astype(object).where(df[col].notna(), None)
+    for col in BOOL_COLUMNS:
+        df[col] = df[col].map(lambda x: str(x).lower() == "true").astype(bool)
+    for col in FLOAT_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    return df
+
+
+def date_window(start, end):
+    """
+    SoQL condition selecting crimes with start <= date < end.
+    """
+    return (f"date >= '{start.strftime(DATE_FORMAT)}' "
+            f"AND date < '{end.strftime(DATE_FORMAT)}'")
+
+
+def fetch_pages(start, end, url=CRIME_URL, page_size=PAGE_SIZE, get=requests.get):
+    """
+    Page through the crimes of a date window.
+
+    Pages are ordered by date and id, so that $offset paging is stable.
+
+    Inputs:
+      start, end (datetime): The date window (end excluded).
+      url (str): The SoQL endpoint.
+      page_size (int): Rows per request ($limit).
+      get (function): Function used for HTTP GET requests.
+
+    Yields:
+      list: The records of one page.
+    """
+    offset = 0
+    while True:
+        params = {
+            "$select": ", ".join(COLUMNS_TO_KEEP),
+            "$where": date_window(start, end),
+            "$order": "date, id",
+            "$limit": page_size,
+            "$offset": offset,
+        }
+        response = get(url, params=params, timeout=60)
+        response.raise_for_status()
+        records = response.json()
+        if not records:
+            break
+        yield records
+        if len(records) < page_size:
+            break
+        offset += page_size
+
+
+def part_hash(path, block_size=1 << 20):
+    """
+    SHA-256 of a part file, recorded in the manifest so that re-fetching a
+    window with changed crimes (but the same number of rows) changes it.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(store_dir=STORE_DIR):
+    """
+    Date windows fetched so far, as listed in the store's manifest.
+    """
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"windows": []}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def ingest(start, end, store_dir=STORE_DIR, url=CRIME_URL, page_size=PAGE_SIZE,
+           get=requests.get):
+    """
+    Fetch the crimes of a date window into a new part file of the store.
+
+    The part is written to a temporary file and renamed once complete, and
+    only then added to the manifest, so an interrupted run leaves no
+    partial data behind.
+
+    Inputs:
+      start, end (datetime): The date window (end excluded).
+      store_dir (str): Directory of the part files.
+      url (str): The SoQL endpoint.
+      page_size (int): Rows per request.
+      get (function): Function used for HTTP GET requests.
+
+    Returns:
+      int: Number of rows fetched.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    ext = "parquet" if HAS_PYARROW else "csv"
+    name = f"crime_{start:%Y%m%d}_{end:%Y%m%d}.{ext}"
+    path = os.path.join(store_dir, name)
+    tmp_path = path + ".tmp"
+
+    if os.path.exists(tmp_path):
+        # Left over from an interrupted run
+        os.remove(tmp_path)
+
+    rows = 0
+    writer = None
+    try:
+        for records in fetch_pages(start, end, url, page_size, get):
+            page = to_typed(records)
+            if HAS_PYARROW:
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, SCHEMA)
+                writer.write_table(pa.Table.from_pandas(page, schema=SCHEMA,
+                                                        preserve_index=False))
+            else:
+                page.to_csv(tmp_path, mode="a", header=rows == 0, index=False)
+            rows += len(page)
+            print(f"Fetched {rows} crimes from {start:%Y-%m-%d} to {end:%Y-%m-%d}")
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if rows == 0:
+        print(f"No crimes from {start:%Y-%m-%d} to {end:%Y-%m-%d}")
+        return 0
+
+    os.replace(tmp_path, path)
+    manifest = load_manifest(store_dir)
+    manifest["windows"] = [w for w in manifest["windows"] if w["file"] != name]
+    manifest["windows"].append({"start": start.strftime(DATE_FORMAT),
+                                "end": end.strftime(DATE_FORMAT),
+                                "file": name, "rows": rows, "hash": part_hash(path),
+                                "fetched_at": datetime.now().strftime(DATE_FORMAT)})
+    with open(os.path.join(store_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=4)
+    return rows
+
+
+def refresh(end=None, overlap_days=0, store_dir=STORE_DIR, url=CRIME_URL,
+            page_size=PAGE_SIZE, get=requests.get):
+    """
+    Fetch only the days after the last window in the store.
+
+    Inputs:
+      end (datetime): End of the new window (default: start of today).
+      overlap_days (int): Days before the end of the last window to fetch
+                          again, to pick up crimes reported late.
+      store_dir, url, page_size, get: as in ingest.
+
+    Returns:
+      int: Number of rows fetched.
+    """
+    manifest = load_manifest(store_dir)
+    if not manifest["windows"]:
+        raise ValueError(f"No crime data in {store_dir} yet; run with --start first")
+    last_end = max(datetime.strptime(w["end"], DATE_FORMAT) for w in manifest["windows"])
+    start = last_end - timedelta(days=overlap_days)
+    end = end or datetime.combine(date.today(), datetime.min.time())
+    if start >= end:
+        print("Crime data is up to date")
+        return 0
+    return ingest(start, end, store_dir, url, page_size, get)
+
+
+def load_crimes(store_dir=STORE_DIR, columns=None):
+    """
+    Read all part files of the store into one DataFrame.
+
+    Crimes fetched by more than one window are kept once (from the newest
+    window).
+
+    Inputs:
+      store_dir (str): Directory of the part files.
+      columns (list): Columns to return (default all).
+
+    Returns:
+      DataFrame: The crimes (empty, with the typed columns, if the store has
+                 no part files).
+    """
+    manifest = load_manifest(store_dir)
+    files = [os.path.join(store_dir, w["file"]) for w in manifest["windows"]]
+    if not files:
+        files = sorted(glob.glob(os.path.join(store_dir, "crime_*.*")))
+    if not files:
+        df = to_typed([])
+        return df if columns is None else df[columns]
+    read_columns = None if columns is None else list(dict.fromkeys(["id"] + list(columns)))
+
+    parts = []
+    for path in files:
+        if path.endswith(".parquet"):
+            parts.append(pd.read_parquet(path, columns=read_columns))
+        else:
+            parts.append(pd.read_csv(path, usecols=read_columns))
+    df = pd.concat(parts, ignore_index=True)
+    if len(files) > 1:
+        df = df.drop_duplicates(subset="id", keep="last").reset_index(drop=True)
+    return df if columns is None else df[columns]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch Chicago crime data page by page")
+    parser.add_argument("--start", help="start date (YYYY-MM-DD) of a new window")
+    parser.add_argument("--end", help="end date (YYYY-MM-DD, excluded; default today)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="fetch the days after the last window in the store")
+    parser.add_argument("--overlap-days", type=int, default=0,
+                        help="with --refresh, days of the last window to fetch again")
+    parser.add_argument("--store-dir", default=STORE_DIR)
+    parser.add_argument("--url", default=CRIME_URL)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    args = parser.parse_args()
+
+    end = datetime.strptime(args.end, "%Y-%m-%d") if args.end else None
+    if args.refresh:
+        rows = refresh(end, args.overlap_days, args.store_dir, args.url, args.page_size)
+    elif args.start:
+        start = datetime.strptime(args.start, "%Y-%m-%d")
+        end = end or datetime.combine(date.today(), datetime.min.time())
+        rows = ingest(start, end, args.store_dir, args.url, args.page_size)
+    else:
+        parser.error("give --start or --refresh")
+    print(f"Fetched {rows} crimes into {args.store_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# This file contains a compact, memory-mappable store of the crime incidents.
+# The feature pipeline only ever uses the coordinates and the 'primary_type'
+# of a crime, so instead of keeping the whole crime table (case number,
+# block, description, date... as Python strings) in memory, the store keeps:
+#   - lat.npy / lon.npy: float32 coordinate arrays (4 bytes each per crime);
+#   - codes.npy: a uint8 code per crime for its 'primary_type', indexing the
+#     sorted type names in meta.json (MISSING_CODE for a missing type);
+# which is 9 bytes per crime. The .npy files are opened with np.load(...,
+# mmap_mode='r'), so loading a multi-year history takes milliseconds and the
+# pages are only read from disk when they are used.
+
+# The crimes are stored in the cell order of their spatial index (crimes
+# without coordinates last), and the non-empty cells and their start
+# positions are saved next to them (cell_ids.npy / cell_starts.npy, the grid
+# in meta.json), so the index is opened over the memory-mapped arrays
+# without sorting or copying them again.
+
+# float32 keeps about 7 significant digits, i.e., coordinates are rounded to
+# less than half a meter in Chicago, far below the block-level precision of
+# the published crime locations.
+
+# A CrimeStore can be passed to util.count_nearby and util.crime_summary, and
+# to features.build_features in place of the crime DataFrame.
+
+# Resource:
+    # 1) https://numpy.org/doc/stable/reference/generated/numpy.load.html
+    # 2) https://numpy.org/doc/stable/reference/generated/numpy.lib.format.open_memmap.html
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from crime_aggregator import CrimeAggregator
+from spatial_index import SpatialIndex
+import util
+
+COORD_DTYPE = np.float32
+CODE_DTYPE = np.uint8
+# Code of incidents with a missing 'primary_type'
+MISSING_CODE = np.iinfo(CODE_DTYPE).max
+
+ARRAY_FILES = {"lat": "lat.npy", "lon": "lon.npy", "codes": "codes.npy"}
+INDEX_FILES = {"cell_ids": "cell_ids.npy", "cell_starts": "cell_starts.npy"}
+META_FILE = "meta.json"
+
+
+class CrimeStore:
+    """
+    Crime coordinates and type codes as compact (possibly memory-mapped) arrays.
+
+    The aggregator and spatial index used to answer radius queries are only
+    built on first use. `df` is a DataFrame view of the arrays with the
+    'Latitude', 'Longitude' and 'primary_type' columns of the crime table.
+    """
+
+    def __init__(self, lat, lon, codes, type_names, grid=None, cell_ids=None,
+                 cell_starts=None):
+        """
+        Inputs:
+          lat, lon (np array): Coordinates of the crimes (float32).
+          codes (np array): Type code of every crime (uint8).
+          type_names (list): Sorted crime type names, indexed by the codes.
+          grid, cell_ids, cell_starts: The spatial index of the crimes, if
+                                       they are sorted by cell (see
+                                       SpatialIndex.from_sorted).
+        """
+        self.lat = lat
+        self.lon = lon
+        self.codes = codes
+        self.type_names = np.asarray(type_names, dtype=object)
+        self.grid = grid
+        self.cell_ids = cell_ids
+        self.cell_starts = cell_starts
+        self._aggregator = None
+
+    @classmethod
+    def from_frame(cls, crime_df, lat_col="Latitude", lon_col="Longitude",
+                   type_col="primary_type"):
+        """
+        Encode a crime DataFrame into a store, with the crimes sorted by
+        the cell of their spatial index.
+
+        Inputs:
+          crime_df (DataFrame): Crime incidents.
+          lat_col, lon_col, type_col (str): Names of the columns to keep.
+
+        Returns:
+          CrimeStore: The store, held in memory.
+        """
+        codes, type_names = pd.factorize(crime_df[type_col], sort=True)
+        if len(type_names) >= MISSING_CODE:
+            raise ValueError(f"Too many crime types for {np.dtype(CODE_DTYPE).name} "
+                             f"codes: {len(type_names)}")
+        codes = np.where(codes < 0, MISSING_CODE, codes).astype(CODE_DTYPE)
+        lat = pd.to_numeric(crime_df[lat_col], errors="coerce").to_numpy(dtype=COORD_DTYPE)
+        lon = pd.to_numeric(crime_df[lon_col], errors="coerce").to_numpy(dtype=COORD_DTYPE)
+
+        # Index the float32 coordinates, and store the crimes in its order
+        index = SpatialIndex(pd.DataFrame({"Latitude": lat, "Longitude": lon}, copy=False))
+        indexed = index.point_rows
+        missing = np.setdiff1d(np.arange(len(lat)), indexed)
+        order = np.concatenate([indexed, missing])
+        cell_ids, cell_starts = index.cells
+        return cls(lat[order], lon[order], codes[order], list(type_names),
+                   index.grid, cell_ids, cell_starts)
+
+    @classmethod
+    def load(cls, store_dir, mmap=True):
+        """
+        Open a store written by save.
+
+        Inputs:
+          store_dir (str): Directory of the store.
+          mmap (bool): Memory-map the arrays (default) instead of reading them.
+
+        Returns:
+          CrimeStore: The store.
+        """
+        mode = "r" if mmap else None
+        arrays = {name: np.load(os.path.join(store_dir, file), mmap_mode=mode)
+                  for name, file in ARRAY_FILES.items()}
+        with open(os.path.join(store_dir, META_FILE), "r") as f:
+            meta = json.load(f)
+        grid = meta.get("grid")
+        if grid is not None:
+            # The cells are small: read them instead of mapping them
+            arrays.update({name: np.load(os.path.join(store_dir, file))
+                           for name, file in INDEX_FILES.items()})
+        return cls(arrays["lat"], arrays["lon"], arrays["codes"], meta["type_names"],
+                   grid, arrays.get("cell_ids"), arrays.get("cell_starts"))
+
+    def save(self, store_dir, source_hash=None):
+        """
+        Write the store as .npy files and a JSON file of type names.
+
+        Inputs:
+          store_dir (str): Directory of the store (created if needed).
+          source_hash (str): Hash of the file the store was built from.
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        files = dict(ARRAY_FILES, **INDEX_FILES) if self.grid is not None else ARRAY_FILES
+        for name, file in files.items():
+            np.save(os.path.join(store_dir, file), getattr(self, name))
+        with open(os.path.join(store_dir, META_FILE), "w") as f:
+            json.dump({"rows": len(self), "type_names": list(self.type_names),
+                       "grid": self.grid, "source_hash": source_hash}, f, indent=4)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.lat.nbytes + self.lon.nbytes + self.codes.nbytes
+
+    def type_codes(self):
+        """
+        Type codes as int16, with -1 for a missing type (as pd.factorize).
+        """
+        codes = self.codes.astype(np.int16)
+        codes[codes == MISSING_CODE] = -1
+        return codes
+
+    @property
+    def df(self):
+        """
+        The store as a crime DataFrame (sharing the coordinate arrays).
+        """
+        primary_type = pd.Categorical.from_codes(self.type_codes(), self.type_names)
+        return pd.DataFrame({"Latitude": self.lat, "Longitude": self.lon,
+                             "primary_type": primary_type}, copy=False)
+
+    @property
+    def aggregator(self):
+        """
+        CrimeAggregator over the store, built on first use. The saved index
+        is opened over the (memory-mapped) coordinates when there is one.
+        """
+        if self._aggregator is None:
+            coords = pd.DataFrame({"Latitude": self.lat, "Longitude": self.lon}, copy=False)
+            if self.grid is None:
+                index = SpatialIndex(coords)
+            else:
+                index = SpatialIndex.from_sorted(coords, self.grid, self.cell_ids,
+                                                 self.cell_starts, self.lat, self.lon)
+            self._aggregator = CrimeAggregator(coords, index=index,
+                                               codes=self.type_codes(),
+                                               type_names=self.type_names)
+        return self._aggregator
+
+    @property
+    def index(self):
+        return self.aggregator.index
+
+    def query_pairs(self, query_lat, query_lon, radius_km=1.0):
+        """
+        See SpatialIndex.query_pairs.
+        """
+        return self.index.query_pairs(query_lat, query_lon, radius_km)
+
+    def query_radius(self, lat, lon, radius_km=1.0):
+        """
+        See SpatialIndex.query_radius.
+        """
+        return self.index.query_radius(lat, lon, radius_km)
+
+    def summary(self, house_lat, house_lon, radius_km=1.0):
+        """
+        Crime summary for a single house (see CrimeAggregator.summary).
+        """
+        return self.aggregator.summary(house_lat, house_lon, radius_km)
+
+
+def cached_crime_store(filepath, load, store_dir):
+    """
+    Open the compact store of a crime file, building it when it is out of date.
+
+    Inputs:
+      filepath (str): Path to the source file (crime CSV or store manifest).
+      load (function): Loads the crime DataFrame; only called when the store
+                       is missing or was built from different data.
+      store_dir (str): Directory of the store.
+
+    Returns:
+      CrimeStore: The memory-mapped store.
+    """
+    # The manifest of a part-file store is hashed with its part files
+    source_hash = util.source_hash(filepath)
+    meta_path = os.path.join(store_dir, META_FILE)
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        # Stores written before the index was saved are rebuilt
+        if meta.get("source_hash") == source_hash and meta.get("grid") is not None:
+            return CrimeStore.load(store_dir)
+
+    CrimeStore.from_frame(load()).save(store_dir, source_hash)
+    return CrimeStore.load(store_dir)
@@ -0,0 +1,152 @@
+# This file contains a persistent cache for the nearby-amenity and crime
+# features of process_and_combine.py, so that a rerun only recomputes what
+# actually changed.
+
+# Every house is keyed by its URL and coordinates, and every input CSV by a
+# hash of its content. On a rerun:
+#   - a feature group whose input file (or the feature settings) changed is
+#     recomputed for all houses;
+#   - an unchanged group is only computed for houses not in the cache yet.
+# A group whose table changes representation (e.g., the crimes loaded as a
+# DataFrame instead of the compact crime store) counts as changed.
+
+# Resource:
+    # 1) https://pandas.pydata.org/docs/reference/api/pandas.read_pickle.html
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from features import (
+    DEFAULT_MAX_MEMORY_MB,
+    all_feature_columns,
+    compute_group,
+    feature_columns,
+    feature_groups
+)
+from util import source_hash
+
+MANIFEST_FILE = "manifest.json"
+FEATURES_FILE = "features.pkl"
+
+
+def house_keys(df_houses):
+    """
+    Cache key of every house: its URL and its coordinates.
+
+    Inputs:
+      df_houses (DataFrame): Houses with 'url', 'latitude' and 'longitude'.
+
+    Returns:
+      Index: One key per house.
+    """
+    return pd.Index(
+        df_houses["url"].astype(str) + "|"
+        + df_houses["latitude"].map(repr) + "|"
+        + df_houses["longitude"].map(repr),
+        name="house_key"
+    )
+
+
+def load_cache(cache_dir):
+    """
+    Load the cached features and manifest, or empty ones if there is no cache.
+
+    Inputs:
+      cache_dir (str): Directory of the cache.
+
+    Returns:
+      tuple (DataFrame, dict): Cached features indexed by house key, and the
+                               manifest with 'settings' and 'sources'.
+    """
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    features_path = os.path.join(cache_dir, FEATURES_FILE)
+    if not (os.path.exists(manifest_path) and os.path.exists(features_path)):
+        return pd.DataFrame(index=pd.Index([], name="house_key")), {"settings": None, "sources": {}}
+
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    return pd.read_pickle(features_path), manifest
+
+
+def save_cache(cache_dir, features, manifest):
+    """
+    Write the cached features and manifest to cache_dir.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    features = features[~features.index.duplicated(keep="last")]
+    features.to_pickle(os.path.join(cache_dir, FEATURES_FILE))
+    with open(os.path.join(cache_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=4)
+
+
+def cached_build_features(df_houses, tables, source_files, cache_dir,
+                          radius_km=1.0, max_memory_mb=DEFAULT_MAX_MEMORY_MB, executor=None):
+    """
+    Same result as features.build_features, reusing cached values where possible.
+
+    Inputs:
+      df_houses (DataFrame): Houses with 'url', 'latitude' and 'longitude'.
+      tables (dict): Input table of every group in features.FEATURE_GROUPS
+                     (and optionally of features.TEMPORAL_GROUP).
+      source_files (dict): Path of the input CSV of every group, used for hashing.
+      cache_dir (str): Directory of the cache (created if needed).
+      radius_km (float or list of float): Search radius (or radii) in kilometers.
+      max_memory_mb (float): Memory cap for one chunk of neighbour pairs.
+      executor (ShardExecutor): Computes the missing features in worker
+                                processes if given (see shard_executor.py).
+
+    Returns:
+      tuple (DataFrame, dict): The features (same index as df_houses), and a
+                               report with the rows/columns recomputed per group.
+    """
+    cached, manifest = load_cache(cache_dir)
+    settings = {"radius_km": radius_km if np.ndim(radius_km) == 0 else list(radius_km)}
+    keys = house_keys(df_houses)
+
+    # Compute every unique house once
+    unique = ~keys.duplicated()
+    unique_keys = keys[unique]
+    lat = df_houses["latitude"].to_numpy(dtype=float)[unique]
+    lon = df_houses["longitude"].to_numpy(dtype=float)[unique]
+
+    new_sources = {}
+    parts = []
+    report = {"groups": {}, "rows": 0, "columns": 0}
+    for group in feature_groups(tables):
+        columns = feature_columns(group, radius_km, tables[group])
+        # The representation of the table is part of the key: e.g., the float32
+        # crime_store.CrimeStore and the crime DataFrame give different counts
+        new_sources[group] = source_hash(source_files[group]) + "|" + type(tables[group]).__name__
+        if hasattr(tables[group], "settings"):
+            # e.g., the time windows of the temporal crime features
+            new_sources[group] += "|" + json.dumps(tables[group].settings, sort_keys=True)
+
+        up_to_date = (manifest["settings"] == settings
+                      and manifest["sources"].get(group) == new_sources[group]
+                      and all(col in cached.columns for col in columns))
+        if up_to_date:
+            todo = ~unique_keys.isin(cached.index)
+        else:
+            todo = np.ones(len(unique_keys), dtype=bool)
+
+        part = cached.reindex(index=unique_keys[~todo], columns=columns)
+        if todo.any():
+            computed = compute_group(group, tables[group], lat[todo], lon[todo],
+                                     radius_km, max_memory_mb, executor)
+            computed.index = unique_keys[todo]
+            part = computed if part.empty else pd.concat([part, computed])
+        parts.append(part.reindex(unique_keys))
+
+        report["groups"][group] = {"rows": int(todo.sum()),
+                                   "columns": len(columns) if todo.any() else 0}
+        report["rows"] = max(report["rows"], int(todo.sum()))
+        report["columns"] += report["groups"][group]["columns"]
+
+    features = pd.concat(parts, axis=1)[all_feature_columns(radius_km, tables)]
+
+    save_cache(cache_dir, features, {"settings": settings, "sources": new_sources})
+
+    features = features.reindex(keys)
+    features.index = df_houses.index
+    return features, report
@@ -0,0 +1,300 @@
+# This file contains the batched feature engine used by process_and_combine.py.
+# Instead of calling the helpers in util.py once per house through df.apply,
+# every feature for every house is computed from one radius query per amenity
+# table: the (house, amenity) pairs within the radius are found with the
+# spatial index, and counts / means / crime breakdowns are reduced from those
+# pairs with np.bincount.
+
+# Houses are processed in chunks so that the neighbour pairs held in memory
+# at any time stay below a configurable cap (max_memory_mb).
+
+# Resource:
+    # 1) https://numpy.org/doc/stable/reference/generated/numpy.bincount.html
+
+import numpy as np
+import pandas as pd
+from spatial_index import SpatialIndex, DEFAULT_MAX_MEMORY_MB
+from crime_aggregator import CrimeAggregator, SUMMARY_COLUMNS
+from util import as_radius_list, radius_label
+from instrument import stage
+
+
+CRIME_COLUMNS = ["num_crimes"] + SUMMARY_COLUMNS
+
+# Output columns computed from each amenity table, and the amenity value
+# they come from ('count' for the number of places nearby, otherwise the
+# column of the amenity table that is averaged).
+AMENITY_GROUPS = {
+    "restaurants": {
+        "num_restaurants": "count",
+        "avg_restaurant_price_level": "Price Level",
+        "avg_restaurant_rating": "Rating",
+    },
+    "stores": {"num_stores": "count"},
+    "schools": {"num_schools": "count"},
+    "hospitals": {"num_hospitals": "count"},
+}
+
+# Every input table, in the column order of summary_redfin.csv
+FEATURE_GROUPS = list(AMENITY_GROUPS) + ["crime"]
+
+# Optional group of time-windowed / decayed crime features, computed from a
+# temporal_crime.TemporalCrimeIndex and appended after FEATURE_GROUPS
+TEMPORAL_GROUP = "crime_time"
+
+
+def as_index(data, lat_col="Latitude", lon_col="Longitude"):
+    """
+    Return a SpatialIndex for `data`, building one if a DataFrame is given.
+    """
+    if isinstance(data, SpatialIndex):
+        return data
+    return SpatialIndex(data, lat_col=lat_col, lon_col=lon_col)
+
+
+def amenity_features(index, house_lat, house_lon, mean_columns=(), radius_km=1.0,
+                     max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+    """
+    Count amenities near every house and average some of their columns.
+
+    Gives the same values as util.count_nearby and util.compute_restaurant_stats
+    (missing values are skipped in the means, and houses with no amenity
+    nearby get NaN), computed in a single pass over the amenity table.
+
+    Inputs:
+      index (SpatialIndex or DataFrame): The amenity table or its index.
+      house_lat, house_lon (np array): Coordinates of all houses.
+      mean_columns (iterable): Columns of the amenity table to average.
+      radius_km (float or list of float): Search radius in kilometers. A list
+                 of radii is answered from a single search at the largest one.
+      max_memory_mb (float): Memory cap for one chunk of pairs.
+
+    Returns:
+      dict: 'count' maps to an int array with one entry per house, and every
+            column in mean_columns maps to a float array of means. With a list
+            of radii, a dict mapping each radius to such a dict.
+    """
+    index = as_index(index)
+    radii = as_radius_list(radius_km)
+    n_houses = len(house_lat)
+    values = {col: pd.to_numeric(index.df[col], errors="coerce").to_numpy(dtype=float)
+              for col in mean_columns}
+
+    counts = {r: np.zeros(n_houses, dtype=np.int64) for r in radii}
+    sums = {(r, col): np.zeros(n_houses) for r in radii for col in mean_columns}
+    valid_counts = {(r, col): np.zeros(n_houses) for r in radii for col in mean_columns}
+
+    for chunk, house_idx, rows, distances in index.iter_pairs(house_lat, house_lon,
+                                                              max(radii), max_memory_mb):
+        n_chunk = chunk.stop - chunk.start
+        for r in radii:
+            within = distances <= r
+            counts[r][chunk] = np.bincount(house_idx[within], minlength=n_chunk)
+            for col, vals in values.items():
+                nearby = vals[rows[within]]
+                present = ~np.isnan(nearby)
+                nearby_houses = house_idx[within][present]
+                sums[r, col][chunk] = np.bincount(nearby_houses, weights=nearby[present],
+                                                  minlength=n_chunk)
+                valid_counts[r, col][chunk] = np.bincount(nearby_houses, minlength=n_chunk)
+
+    features = {}
+    for r in radii:
+        features[r] = {"count": counts[r]}
+        for col in mean_columns:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = sums[r, col] / valid_counts[r, col]
+            # No amenity nearby at all gives NaN, as in compute_restaurant_stats
+            mean[counts[r] == 0] = np.nan
+            features[r][col] = mean
+
+    if np.ndim(radius_km) == 0:
+        return features[radii[0]]
+    return features
+
+
+def prepare_table(group, table):
+    """
+    Build the spatial index (or crime aggregator) of an input table once, so
+    it can be reused for several batches of houses.
+
+    Inputs:
+      group (str): One of FEATURE_GROUPS, or TEMPORAL_GROUP.
+      table: The input table (DataFrame, or its index / CrimeAggregator /
+             CrimeStore / TemporalCrimeIndex).
+
+    Returns:
+      The SpatialIndex of an amenity table, the CrimeAggregator of the crime
+      table, or the TemporalCrimeIndex itself.
+    """
+    if group == TEMPORAL_GROUP:
+        return table
+    if group == "crime":
+        if hasattr(table, "aggregator"):
+            return table.aggregator
+        return table if isinstance(table, CrimeAggregator) else CrimeAggregator(table)
+    return as_index(table)
+
+
+def crime_features(crime, house_lat, house_lon, radius_km=1.0,
+                   max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+    """
+    Count crimes near every house and summarize them, in one pass.
+
+    Gives the same values as util.count_nearby and util.crime_summary for
+    every house.
+
+    Inputs:
+      crime (CrimeAggregator, CrimeStore or DataFrame): The crime table, its
+             aggregator, or its compact store (see crime_store.py).
+      house_lat, house_lon (np array): Coordinates of all houses.
+      radius_km (float or list of float): Search radius in kilometers.
+      max_memory_mb (float): Memory cap for one chunk of pairs.
+
+    Returns:
+      DataFrame: One row per house with 'num_crimes', 'violent_crime_count',
+                 'nonviolent_crime_count', 'most_prevalent_crime' and
+                 'crime_proportion' (suffixed per radius for a list of radii).
+    """
+    crime = prepare_table("crime", crime)
+    return crime.summarize(house_lat, house_lon, radius_km, max_memory_mb)
+
+
+def feature_groups(tables=None):
+    """
+    The groups computed for a set of input tables: FEATURE_GROUPS, followed
+    by TEMPORAL_GROUP when it has a table.
+    """
+    if tables is not None and tables.get(TEMPORAL_GROUP) is not None:
+        return FEATURE_GROUPS + [TEMPORAL_GROUP]
+    return list(FEATURE_GROUPS)
+
+
+def feature_columns(group, radius_km=1.0, table=None):
+    """
+    Names of the output columns that come from one input table.
+
+    Inputs:
+      group (str): One of FEATURE_GROUPS, or TEMPORAL_GROUP.
+      radius_km (float or list of float): Search radius (or radii) in kilometers.
+      table (TemporalCrimeIndex): The table of TEMPORAL_GROUP, whose windows
+                                  and half-lives give its columns.
+
+    Returns:
+      list: Column names, suffixed with the radius when a list of radii is given.
+    """
+    if group == TEMPORAL_GROUP:
+        base = table.columns
+    elif group == "crime":
+        base = CRIME_COLUMNS
+    else:
+        base = list(AMENITY_GROUPS[group])
+    if np.ndim(radius_km) == 0:
+        return base
+    return [f"{col}_{radius_label(r)}" for r in as_radius_list(radius_km) for col in base]
+
+
+def all_feature_columns(radius_km=1.0, tables=None):
+    """
+    Every feature column in the order used by summary_redfin.csv (grouped by
+    radius when a list of radii is given). `tables` is only needed for the
+    columns of TEMPORAL_GROUP.
+    """
+    base = [col for group in feature_groups(tables)
+            for col in feature_columns(group, table=(tables or {}).get(group))]
+    if np.ndim(radius_km) == 0:
+        return base
+    return [f"{col}_{radius_label(r)}" for r in as_radius_list(radius_km) for col in base]
+
+
+def group_features(group, table, house_lat, house_lon, radius_km=1.0,
+                   max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+    """
+    Compute the output columns that come from one input table.
+
+    Inputs:
+      group (str): One of FEATURE_GROUPS, e.g., 'restaurants' or 'crime', or
+                   TEMPORAL_GROUP.
+      table: The input table (DataFrame, or its index / CrimeAggregator /
+             TemporalCrimeIndex).
+      house_lat, house_lon (np array): Coordinates of the houses.
+      radius_km (float or list of float): Search radius (or radii) in kilometers.
+      max_memory_mb (float): Memory cap for one chunk of neighbour pairs.
+
+    Returns:
+      DataFrame: One row per house with the columns of feature_columns(group, radius_km).
+    """
+    radii = as_radius_list(radius_km)
+    if group == TEMPORAL_GROUP:
+        return table.features(house_lat, house_lon, radius_km, max_memory_mb)
+    if group == "crime":
+        crimes = crime_features(table, house_lat, house_lon, radii, max_memory_mb)
+        by_radius = {r: {col: crimes[f"{col}_{radius_label(r)}"].to_numpy()
+                         for col in CRIME_COLUMNS} for r in radii}
+    else:
+        columns = AMENITY_GROUPS[group]
+        mean_columns = [source for source in columns.values() if source != "count"]
+        amenities = amenity_features(table, house_lat, house_lon, mean_columns,
+                                     radii, max_memory_mb)
+        by_radius = {r: {col: amenities[r][source] for col, source in columns.items()}
+                     for r in radii}
+
+    if np.ndim(radius_km) == 0:
+        return pd.DataFrame(by_radius[radii[0]])
+    return pd.DataFrame({f"{col}_{radius_label(r)}": values
+                         for r in radii for col, values in by_radius[r].items()})
+
+
+def compute_group(group, table, house_lat, house_lon, radius_km=1.0,
+                  max_memory_mb=DEFAULT_MAX_MEMORY_MB, executor=None):
+    """
+    group_features for one input table, in the worker processes of `executor`
+    if given, recorded as the stage 'features: <group>' (see instrument.py).
+    """
+    with stage(f"features: {group}", rows=len(house_lat)):
+        if executor is None:
+            return group_features(group, table, house_lat, house_lon, radius_km, max_memory_mb)
+        return executor.group_features(group, house_lat, house_lon, radius_km, max_memory_mb)
+
+
+def build_features(df_houses, df_restaurants, df_stores, df_schools, df_hospital, df_crime,
+                   radius_km=1.0, max_memory_mb=DEFAULT_MAX_MEMORY_MB, crime_time=None,
+                   executor=None):
+    """
+    Compute every nearby-amenity and crime column of summary_redfin.csv.
+
+    Each input table can be a DataFrame or an index already built on it.
+
+    Inputs:
+      df_houses (DataFrame): Houses with 'latitude' and 'longitude'.
+      df_restaurants, df_stores, df_schools, df_hospital: The amenity
+        tables (or their indexes).
+      df_crime: The crime table (or its CrimeAggregator or CrimeStore).
+      radius_km (float or list of float): Search radius in kilometers (default
+        to 1 km). With a list of radii (e.g., [0.25, 0.5, 1, 2]) every column
+        is computed for each radius from one sweep per table and suffixed with
+        the radius, e.g., 'num_crimes_500m' and 'num_crimes_1km'.
+      max_memory_mb (float): Memory cap for one chunk of neighbour pairs.
+      crime_time (TemporalCrimeIndex): If given, its time-windowed and decayed
+        crime columns are appended (see temporal_crime.py).
+      executor (ShardExecutor): If given, the houses are split into shards
+        computed by its worker processes (see shard_executor.py), from the
+        tables the executor was created with; the result is the same.
+
+    Returns:
+      DataFrame: One row per house (same index as df_houses) with the feature
+                 columns in the order used by summary_redfin.csv.
+    """
+    lat = df_houses["latitude"].to_numpy(dtype=float)
+    lon = df_houses["longitude"].to_numpy(dtype=float)
+    tables = dict(zip(FEATURE_GROUPS,
+                      [df_restaurants, df_stores, df_schools, df_hospital, df_crime]))
+    tables[TEMPORAL_GROUP] = crime_time
+
+    features = pd.concat([compute_group(group, tables[group], lat, lon,
+                                        radius_km, max_memory_mb, executor)
+                          for group in feature_groups(tables)], axis=1)
+    features = features[all_feature_columns(radius_km, tables)]
+    features.index = df_houses.index
+    return features
+
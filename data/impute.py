@@ -0,0 +1,100 @@
+# This file contains the imputation stage for missing 'price_per_sq_ft' in
+# the Redfin houses. All missing houses are imputed in one batch from an
+# index over the priced houses only, using a snapshot of the original prices,
+# so the result does not depend on the order in which houses are filled.
+
+# Modes:
+#   - 'radius': mean of the priced houses within radius_km (the original
+#               behaviour of util.impute_house_price_per_sq_ft)
+#   - 'knn':    mean of the k nearest priced houses
+#   - 'idw':    inverse-distance weighted mean of the k nearest priced houses
+
+# Resource:
+    # 1) https://en.wikipedia.org/wiki/Inverse_distance_weighting
+    # 2) https://en.wikipedia.org/wiki/K-nearest_neighbors_algorithm
+
+import numpy as np
+from spatial_index import SpatialIndex, DEFAULT_MAX_MEMORY_MB
+
+IMPUTE_MODES = ("radius", "knn", "idw")
+
+
+def inverse_distance_weights(query_idx, distances, n_queries):
+    """
+    Inverse-distance weights of (query, neighbour) pairs.
+
+    A query with one or more neighbours at distance 0 (same coordinates)
+    gets the plain mean of those neighbours, which is the limit of the
+    inverse-distance weighted mean.
+
+    Inputs:
+      query_idx (np array): Query of every pair.
+      distances (np array): Distance (in km) of every pair.
+      n_queries (int): Number of queries.
+
+    Returns:
+      np array: Weight of every pair.
+    """
+    exact = distances == 0
+    has_exact = np.bincount(query_idx[exact], minlength=n_queries) > 0
+    with np.errstate(divide="ignore"):
+        weights = 1.0 / distances
+    return np.where(has_exact[query_idx], exact.astype(float), weights)
+
+
+def impute_price_per_sq_ft(df_houses, mode="radius", radius_km=1.0, k=5,
+                           max_memory_mb=DEFAULT_MAX_MEMORY_MB, column="price_per_sq_ft"):
+    """
+    Fill missing prices per square foot from nearby priced houses.
+
+    With mode='radius' this gives the same result as applying
+    util.impute_house_price_per_sq_ft to every row.
+
+    Inputs:
+      df_houses (DataFrame): Houses with 'latitude', 'longitude' and `column`.
+      mode (str): One of IMPUTE_MODES ('radius', 'knn' or 'idw').
+      radius_km (float): Search radius in kilometers for mode='radius'.
+      k (int): Number of nearest priced houses for mode='knn' and 'idw'.
+      max_memory_mb (float): Memory cap for one chunk of neighbour pairs.
+      column (str): The price column to impute.
+
+    Returns:
+      np array: The prices with the missing values imputed (NaN when no priced
+                house is found).
+    """
+    if mode not in IMPUTE_MODES:
+        raise ValueError(f"Unknown imputation mode {mode!r}, expected one of {IMPUTE_MODES}")
+
+    # Snapshot of the original prices: only these are ever read
+    prices = df_houses[column].to_numpy(dtype=float).copy()
+    missing = np.flatnonzero(np.isnan(prices))
+    imputed = prices.copy()
+    if len(missing) == 0:
+        return imputed
+
+    priced = df_houses[~np.isnan(prices)]
+    priced_values = prices[~np.isnan(prices)]
+    index = SpatialIndex(priced, lat_col="latitude", lon_col="longitude", cell_km=radius_km)
+    lat = df_houses["latitude"].to_numpy(dtype=float)[missing]
+    lon = df_houses["longitude"].to_numpy(dtype=float)[missing]
+
+    sums = np.zeros(len(missing))
+    weights_total = np.zeros(len(missing))
+    if mode == "radius":
+        for chunk, house_idx, rows, _ in index.iter_pairs(lat, lon, radius_km, max_memory_mb):
+            n_chunk = chunk.stop - chunk.start
+            sums[chunk] = np.bincount(house_idx, weights=priced_values[rows], minlength=n_chunk)
+            weights_total[chunk] = np.bincount(house_idx, minlength=n_chunk)
+    else:
+        house_idx, rows, distances = index.query_knn(lat, lon, k, start_km=radius_km)
+        if mode == "knn":
+            weights = np.ones(len(rows))
+        else:
+            weights = inverse_distance_weights(house_idx, distances, len(missing))
+        sums = np.bincount(house_idx, weights=weights * priced_values[rows],
+                           minlength=len(missing))
+        weights_total = np.bincount(house_idx, weights=weights, minlength=len(missing))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        imputed[missing] = sums / weights_total
+    return imputed
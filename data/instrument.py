@@ -0,0 +1,240 @@
+# This file contains the per-stage instrumentation of process_and_combine.py.
+# Every stage of the pipeline (loading each input, imputation, each feature
+# group, ...) is wrapped in `with stage("name", rows=...)`, which records its
+# wall time, CPU time, number of rows and the peak resident memory (RSS) of
+# the process at the end of the stage. Optionally, every top-level stage is
+# also run under cProfile and its stats are dumped to a .prof file.
+
+# The work of worker processes (e.g., the process pool of the feature
+# builder) is not in the CPU time and RSS of this process: it is recorded
+# separately as child_cpu_s (CPU time of the children that ended during the
+# stage) and child_peak_rss_mb (peak RSS of the largest child so far), from
+# getrusage(RUSAGE_CHILDREN). A child only counts once it has exited and been
+# waited for, i.e., once its pool is shut down.
+
+# Nothing is recorded unless a recorder is enabled, either with enable() (as
+# `python process_and_combine.py --profile` does) or by setting the
+# PROCESS_PROFILE environment variable to 1 (and PROCESS_PROFILE_DIR to a
+# directory for the cProfile dumps). When disabled, stage() does nothing.
+
+# The .prof files can be read with `python -m pstats <file>` or snakeviz.
+
+# Resource:
+    # 1) https://docs.python.org/3/library/profile.html
+    # 2) https://docs.python.org/3/library/resource.html#resource.getrusage
+    # 3) https://docs.python.org/3/library/time.html#time.process_time
+    # 4) https://man7.org/linux/man-pages/man2/getrusage.2.html
+
+import cProfile
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:
+    # Not available on Windows; peak RSS is then not reported
+    HAS_RESOURCE = False
+
+ENV_VAR = "PROCESS_PROFILE"
+ENV_PROFILE_DIR = "PROCESS_PROFILE_DIR"
+REPORT_FILE = "stage_report.json"
+
+# Recorder of the current run, None when instrumentation is off
+_recorder = None
+
+
+def peak_rss_mb(who=None):
+    """
+    Peak resident memory of this process so far, in MB (None if unknown).
+    With who=resource.RUSAGE_CHILDREN, peak of its largest finished child.
+    """
+    if not HAS_RESOURCE:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def child_peak_rss_mb():
+    """
+    Peak resident memory of the largest finished child process, in MB (None
+    if unknown).
+    """
+    return peak_rss_mb(resource.RUSAGE_CHILDREN) if HAS_RESOURCE else None
+
+
+def child_cpu_time():
+    """
+    CPU time (user + system) of the finished child processes, in seconds
+    (0 if unknown).
+    """
+    if not HAS_RESOURCE:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageRecorder:
+    """
+    Collects the measurements of every stage of a run, in the order the
+    stages finish (a nested stage finishes before the stage around it).
+    """
+
+    def __init__(self, profile_dir=None):
+        """
+        Inputs:
+          profile_dir (str): Directory for a cProfile dump of every top-level
+                             stage, or None to not profile.
+        """
+        self.profile_dir = profile_dir
+        self.stages = []
+        self.depth = 0
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.start_child_cpu = child_cpu_time()
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Measure the code in the `with` block as one stage.
+
+        Inputs:
+          name (str): Name of the stage.
+          rows (int): Number of rows handled, if known up front.
+
+        Yields:
+          dict: The stage's record; set record["rows"] inside the block when
+                the number of rows is only known at the end.
+        """
+        record = {"stage": name, "depth": self.depth, "rows": rows}
+        profiler = None
+        if self.profile_dir is not None and self.depth == 0:
+            profiler = cProfile.Profile()
+        self.depth += 1
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        start_child_cpu = child_cpu_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record["wall_s"] = time.perf_counter() - start_wall
+            record["cpu_s"] = time.process_time() - start_cpu
+            record["peak_rss_mb"] = peak_rss_mb()
+            record["child_cpu_s"] = child_cpu_time() - start_child_cpu
+            record["child_peak_rss_mb"] = child_peak_rss_mb()
+            self.depth -= 1
+            if profiler is not None:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                file_name = re.sub(r"[^\w.-]+", "_", f"{len(self.stages):02d}_{name}") + ".prof"
+                record["profile"] = os.path.join(self.profile_dir, file_name)
+                profiler.dump_stats(record["profile"])
+            self.stages.append(record)
+
+    def summary(self):
+        """
+        Totals of the run so far.
+        """
+        return {"wall_s": time.perf_counter() - self.start_wall,
+                "cpu_s": time.process_time() - self.start_cpu,
+                "peak_rss_mb": peak_rss_mb(),
+                "child_cpu_s": child_cpu_time() - self.start_child_cpu,
+                "child_peak_rss_mb": child_peak_rss_mb()}
+
+    def report(self):
+        """
+        The stages as a text table, slowest stages easy to spot by wall time.
+        The CPU time and peak RSS of worker processes are in the child columns.
+        """
+        def row(name, rows, record, share):
+            rss = "" if record["peak_rss_mb"] is None else f"{record['peak_rss_mb']:.1f}"
+            child_rss = ("" if record["child_peak_rss_mb"] is None
+                         else f"{record['child_peak_rss_mb']:.1f}")
+            return (f"{name:<36} {rows:>10} {record['wall_s']:>10.3f} "
+                    f"{record['cpu_s']:>10.3f} {record['child_cpu_s']:>10.3f} "
+                    f"{share:>6.1f}% {rss:>14} {child_rss:>14}")
+
+        total = self.summary()
+        lines = [f"{'stage':<36} {'rows':>10} {'wall (s)':>10} {'cpu (s)':>10} "
+                 f"{'child cpu':>10} {'% wall':>7} {'peak RSS (MB)':>14} {'child RSS (MB)':>14}"]
+        for record in self.stages:
+            name = "  " * record["depth"] + record["stage"]
+            rows = "" if record["rows"] is None else f"{record['rows']:,}"
+            share = 100 * record["wall_s"] / total["wall_s"] if total["wall_s"] else 0
+            lines.append(row(name, rows, record, share))
+        lines.append(row("total", "", total, 100.0))
+        return "\n".join(lines)
+
+    def save(self, path=REPORT_FILE):
+        """
+        Write the stages and totals as JSON.
+        """
+        with open(path, "w") as f:
+            json.dump({"stages": self.stages, "total": self.summary()}, f, indent=4)
+
+
+def enable(profile_dir=None):
+    """
+    Start recording stages (replacing any previous recorder).
+
+    Inputs:
+      profile_dir (str): Directory for cProfile dumps of the top-level stages.
+
+    Returns:
+      StageRecorder: The new recorder.
+    """
+    global _recorder
+    _recorder = StageRecorder(profile_dir)
+    return _recorder
+
+
+def enable_from_env():
+    """
+    Start recording if the PROCESS_PROFILE environment variable is set to a
+    true value ('1', 'true', 'yes').
+
+    Returns:
+      StageRecorder: The new recorder, or None if the variable is not set.
+    """
+    if os.environ.get(ENV_VAR, "").strip().lower() not in ("1", "true", "yes"):
+        return None
+    return enable(os.environ.get(ENV_PROFILE_DIR) or None)
+
+
+def disable():
+    """
+    Stop recording; returns the recorder of the run that ended (or None).
+    """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+def current():
+    """
+    The active recorder, or None when instrumentation is off.
+    """
+    return _recorder
+
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Measure a stage with the active recorder (see StageRecorder.stage); does
+    nothing but yield a scratch dict when instrumentation is off.
+    """
+    if _recorder is None:
+        yield {"stage": name, "rows": rows}
+        return
+    with _recorder.stage(name, rows) as record:
+        yield record
@@ -32,7 +32,85 @@ LAT_STEP = 0.009  # ~1 km per step
 LNG_STEP = 0.012  # ~1 km per step
 RADIUS = 1000  # 1km search radius
 
-def get_places_info(lat, lng, place_type):
+# Places without a place_id are identified by name and coordinates rounded
+# to 5 decimals (about 1 m), or by name only if they have no coordinates
+COORD_DECIMALS = 5
+
+
+class PlaceDeduper:
+
+    """
+    Keys of the places seen so far, to drop the duplicates returned by
+    overlapping grid cells while scraping. A place is keyed by its Google
+    place_id, or by its name and rounded coordinates if it has none.
+
+    With a seen_file, the keys are loaded from it and every new key is
+    appended to it, so they persist between runs.
+    """
+
+    def __init__(self, seen_file=None):
+        """
+        Input:
+            seen_file (str): file of keys kept between runs (optional)
+        """
+        self.keys = set()
+        self.f = None
+        if seen_file is not None:
+            if os.path.exists(seen_file):
+                with open(seen_file, "r", encoding="utf-8") as f:
+                    self.keys.update(line.rstrip("\n") for line in f)
+            self.f = open(seen_file, "a", encoding="utf-8")
+
+    @staticmethod
+    def key(place):
+        """
+        Key of a raw place object. A place with neither a place_id nor
+        coordinates is keyed by its name alone.
+        """
+        if place.get("place_id"):
+            return place["place_id"]
+        location = (place.get("geometry") or {}).get("location") or {}
+        if location.get("lat") is None or location.get("lng") is None:
+            return "{}||".format(place.get("name"))
+        return "{}|{:.{d}f}|{:.{d}f}".format(place.get("name"), location["lat"],
+                                            location["lng"], d=COORD_DECIMALS)
+
+    def filter(self, place_objects, places):
+        """
+        Keep the places not seen before, and remember them.
+
+        Input:
+            place_objects (list): raw place objects
+            places (list): rows of the same places, as from get_places_info
+
+        Return: The new place objects, their rows and their keys
+        """
+        new_objects, new_places, new_keys = [], [], []
+        for place, row in zip(place_objects, places):
+            key = self.key(place)
+            if key in self.keys:
+                continue
+            self.keys.add(key)
+            new_objects.append(place)
+            new_places.append(row)
+            new_keys.append(key)
+        return new_objects, new_places, new_keys
+
+    def save(self, keys):
+        """
+        Append keys to the seen_file (if any).
+        """
+        if self.f is not None:
+            self.f.writelines(key + "\n" for key in keys)
+            self.f.flush()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+
+def get_places_info(lat, lng, place_type, radius=RADIUS, api_key=None, base_url=BASE_URL,
+                    get=requests.get, page_delay=(1, 3)):
 
     """
     Helper function to get name, address, price_index, ratings, location of places 
@@ -42,22 +120,28 @@ def get_places_info(lat, lng, place_type):
         lat (int): lattitude of a place
         lng (int): longitude of a place
         place_type (str): place type, e.g., restuarant
-
-    Return: A list of information (including name, address, etc.) of a place
+        radius (int): search radius in meters
+        api_key (str): Google API key (default API_KEY)
+        base_url (str): Nearby Search endpoint (e.g., a local fake for testing)
+        get (function): function used for HTTP GET requests
+        page_delay (tuple): range of seconds to wait before using a page token
+
+    Return: The raw place objects, and a list of information (including name,
+            address, etc.) of every place
     """
 
     params = {
         "location": f"{lat},{lng}",
-        "radius": RADIUS,
+        "radius": radius,
         "type": place_type,
-        "key": API_KEY
+        "key": API_KEY if api_key is None else api_key
     }
     
     places = []
     place_objects = []
 
     while True:
-        response = requests.get(BASE_URL, params=params).json()
+        response = get(base_url, params=params).json()
 
         for place in response.get("results", []):
             name = place.get("name")
@@ -76,7 +160,7 @@ def get_places_info(lat, lng, place_type):
         if not next_page_token:
             break
         
-        time.sleep(random.uniform(1, 3))
+        time.sleep(random.uniform(*page_delay))
         params["pagetoken"] = next_page_token
 
     return place_objects, places
@@ -102,6 +186,8 @@ def scrape(place_type):
     header = ["Name", "Business Status", "Address", "Price Level", "Rating", "Total Ratings", "Types", "Latitude", "Longitude"]
 
     all_objects = []
+    # Overlapping cells return the same places; only keep the first hit
+    deduper = PlaceDeduper()
     
     with open(places_output_file, "w", encoding="utf-8", newline='') as f:
         writer = csv.writer(f)
@@ -117,6 +203,7 @@ def scrape(place_type):
             while lng <= LNG_MAX:
                 print(f"Scraping {place_type} at {lat}, {lng}...")
                 place_object, places = get_places_info(lat, lng, place_type)
+                place_object, places, _ = deduper.filter(place_object, places)
                 writer.writerows(places)
                 all_objects.extend(place_object)
                 lng += LNG_STEP  # Move right
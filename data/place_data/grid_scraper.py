@@ -0,0 +1,515 @@
+# This file runs the grid search of get_places.py in parallel and resumably.
+# The Chicago grid is split into tiles of neighbouring cells, and the tiles
+# are scraped by a pool of worker threads. Every place found is streamed to
+# disk as soon as its cell is done: the CSV rows of get_places.py, and the
+# raw place objects as newline-delimited JSON (instead of one big JSON list
+# kept in memory until the end). Completed cells are appended to a
+# checkpoint file, so a rerun after a crash skips them and resumes where it
+# stopped. Places already found (by another cell, or in a previous run) are
+# dropped before they are written, see get_places.PlaceDeduper.
+
+# Two search modes:
+#   - 'grid':     the fixed ~1 km grid of get_places.py
+#   - 'quadtree': start from cells of about 4 km and split a cell into four
+#                 only when its search hits the 60-result cap of the Places
+#                 API (dense downtown cells), so sparse cells cost a single
+#                 request and dense ones are not silently truncated
+# Both modes write the same files, so a checkpoint is only resumed in the
+# mode it was written in (start over with --restart, or use another
+# --output-dir to keep both).
+
+# The endpoint can be changed on the command line, so the scraper can be run
+# against a local fake Places endpoint, e.g.:
+#   python grid_scraper.py restaurant --workers 8 --base-url http://localhost:8000/nearby
+
+# Resource:
+        # 1) https://developers.google.com/maps/documentation/places/web-service/nearby-search
+        # 2) https://docs.python.org/3/library/concurrent.futures.html
+        # 3) https://jsonlines.org/
+        # 4) https://en.wikipedia.org/wiki/Quadtree
+
+import argparse
+import csv
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+import requests
+
+from get_places import (
+    API_KEY,
+    BASE_URL,
+    LAT_MAX,
+    LAT_MIN,
+    LAT_STEP,
+    LNG_MAX,
+    LNG_MIN,
+    LNG_STEP,
+    RADIUS,
+    PlaceDeduper,
+    get_places_info
+)
+
+HEADER = ["Name", "Business Status", "Address", "Price Level", "Rating",
+          "Total Ratings", "Types", "Latitude", "Longitude"]
+
+# Cells per tile side: a tile of 4 x 4 cells is one unit of work
+TILE_SIZE = 4
+
+# Statuses of a successful Nearby Search response
+OK_STATUSES = ("OK", "ZERO_RESULTS")
+
+# Nearby Search returns at most 3 pages of 20 results
+MAX_RESULTS = 60
+
+# Quadtree mode: top-level cells are ROOT_SCALE grid steps wide (~4 km), and
+# are split at most MAX_DEPTH times (down to ~250 m)
+ROOT_SCALE = 4
+MAX_DEPTH = 4
+
+EARTH_RADIUS_M = 6371000
+
+
+def grid_cells(lat_min=LAT_MIN, lat_max=LAT_MAX, lng_min=LNG_MIN, lng_max=LNG_MAX,
+               lat_step=LAT_STEP, lng_step=LNG_STEP):
+    """
+    Centers of the grid cells, in the order get_places.scrape visits them
+    (with the same floating point steps, so the cells are identical).
+
+    Return: A list of (row, column, lat, lng)
+    """
+    cells = []
+    i, lat = 0, lat_min
+    while lat <= lat_max:
+        j, lng = 0, lng_min
+        while lng <= lng_max:
+            cells.append((i, j, lat, lng))
+            j, lng = j + 1, lng + lng_step
+        i, lat = i + 1, lat + lat_step
+    return cells
+
+
+def make_tiles(cells, tile_size=TILE_SIZE):
+    """
+    Group grid cells into square tiles of tile_size x tile_size cells.
+
+    Return: A list of tiles, each a list of cells
+    """
+    tiles = {}
+    for cell in cells:
+        tiles.setdefault((cell[0] // tile_size, cell[1] // tile_size), []).append(cell)
+    return list(tiles.values())
+
+
+class PlaceSink:
+
+    """
+    Thread-safe writer of the scraper outputs in output_dir:
+        {place_type}_data.csv             rows as in get_places.scrape
+        {place_type}_data.ndjson          one raw place object per line
+        {place_type}_checkpoint.ndjson    one line per completed cell
+        {place_type}_seen.txt             keys of the places written so far
+
+    Only places not written before are written. A cell is only marked
+    complete after its places are written, so a crash can at worst make a
+    rerun scrape the last cells again.
+
+    The search mode is stored in every checkpoint record: a checkpoint of
+    the other mode is refused instead of being resumed, since its cells
+    cover different areas.
+    """
+
+    def __init__(self, output_dir, place_type, restart=False, mode="grid"):
+        """
+        Input:
+            output_dir (str): directory of the output files
+            place_type (str): place type, e.g., restaurant
+            restart (bool): ignore an existing checkpoint and start over
+            mode (str): search mode, 'grid' or 'quadtree'
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        self.places_file = os.path.join(output_dir, f"{place_type}_data.csv")
+        self.objects_file = os.path.join(output_dir, f"{place_type}_data.ndjson")
+        self.checkpoint_file = os.path.join(output_dir, f"{place_type}_checkpoint.ndjson")
+        self.seen_file = os.path.join(output_dir, f"{place_type}_seen.txt")
+        self.mode = mode
+
+        if restart and os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+        self.done = self.load_checkpoint()
+
+        # Without a checkpoint the outputs (and the places seen) are started over
+        mode = "a" if self.done else "w"
+        if mode == "w" and os.path.exists(self.seen_file):
+            os.remove(self.seen_file)
+        self.deduper = PlaceDeduper(self.seen_file)
+        self.csv_f = open(self.places_file, mode, encoding="utf-8", newline='')
+        self.objects_f = open(self.objects_file, mode, encoding="utf-8")
+        self.checkpoint_f = open(self.checkpoint_file, "a", encoding="utf-8")
+        self.writer = csv.writer(self.csv_f)
+        if mode == "w":
+            self.writer.writerow(HEADER)
+        self.lock = threading.Lock()
+        self.found = 0
+        self.written = 0
+
+    def load_checkpoint(self):
+        """
+        Completed cells of a previous run.
+
+        Return: A dict mapping cell id to its checkpoint record
+        Raises: ValueError if the checkpoint was written in another mode
+        """
+        done = {}
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line cut off by a crash: that cell is redone
+                        continue
+                    # Records written before the mode was stored: quadtree
+                    # cell ids start with 'q'
+                    mode = record.get("mode", "quadtree" if record["cell"].startswith("q")
+                                      else "grid")
+                    if mode != self.mode:
+                        raise ValueError(
+                            f"{self.checkpoint_file} is a checkpoint of a {mode} scrape, "
+                            f"not {self.mode}: use --restart or another --output-dir")
+                    done[record["cell"]] = record
+        return done
+
+    def write(self, cell_id, place_objects, places, **info):
+        """
+        Write the new places of a completed cell, then mark the cell as done.
+
+        Input:
+            cell_id (str): id of the cell
+            place_objects (list): raw place objects of the cell
+            places (list): rows of the cell, as from get_places_info
+            info: extra fields stored in the checkpoint record
+        """
+        with self.lock:
+            new_objects, new_places, new_keys = self.deduper.filter(place_objects, places)
+            self.writer.writerows(new_places)
+            for place in new_objects:
+                self.objects_f.write(json.dumps(place) + "\n")
+            self.csv_f.flush()
+            self.objects_f.flush()
+            self.deduper.save(new_keys)
+
+            record = {"cell": cell_id, "mode": self.mode, "places": len(places),
+                      "new": len(new_places), **info}
+            self.checkpoint_f.write(json.dumps(record) + "\n")
+            self.checkpoint_f.flush()
+            self.done[cell_id] = record
+            self.found += len(places)
+            self.written += len(new_places)
+
+    def close(self):
+        for f in (self.csv_f, self.objects_f, self.checkpoint_f):
+            f.close()
+        self.deduper.close()
+
+
+class PlacesClient:
+
+    """
+    GET function for the worker threads: one requests.Session per thread
+    (connections are reused) and a count of the requests made. Failed
+    requests raise, so their cell is not marked as done.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def get(self, url, **kwargs):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        with self.lock:
+            self.requests += 1
+        kwargs.setdefault("timeout", 30)
+        response = self.local.session.get(url, **kwargs)
+        response.raise_for_status()
+        status = response.json().get("status", "OK")
+        if status not in OK_STATUSES:
+            raise RuntimeError(f"Places API returned {status}")
+        return response
+
+
+def scrape_cell(cell_id, lat, lng, radius, place_type, sink, client, api_key, base_url,
+                page_delay, **info):
+    """
+    Scrape one cell and write its places.
+
+    Return: Number of places found, or None if the request failed
+    """
+    print(f"Scraping {place_type} at {lat}, {lng} (radius {radius} m)...")
+    try:
+        place_objects, places = get_places_info(lat, lng, place_type, radius, api_key,
+                                                base_url, client.get, page_delay)
+    except Exception as e:
+        # Not checkpointed, so the next run tries this cell again
+        print(f"Error scraping cell {cell_id}: {str(e)}")
+        return None
+    saturated = len(place_objects) >= MAX_RESULTS
+    sink.write(cell_id, place_objects, places, saturated=saturated, **info)
+    return len(place_objects)
+
+
+def scrape_tile(tile, place_type, sink, client, api_key, base_url, page_delay):
+    """
+    Scrape the cells of one tile that are not done yet.
+
+    Return: Number of cells scraped and number of cells that failed
+    """
+    scraped, failed = 0, 0
+    for i, j, lat, lng in tile:
+        cell_id = f"{i}_{j}"
+        if cell_id in sink.done:
+            continue
+        found = scrape_cell(cell_id, lat, lng, RADIUS, place_type, sink, client, api_key,
+                            base_url, page_delay)
+        if found is None:
+            failed += 1
+        else:
+            scraped += 1
+    return scraped, failed
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distance between two points in meters.
+    """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def quad_center(bounds):
+    """
+    Center of a quadtree cell and the radius (in meters) of the circle
+    around it that covers the whole cell.
+
+    Input:
+        bounds (tuple): (lat_min, lat_max, lng_min, lng_max) of the cell
+
+    Return: (lat, lng, radius)
+    """
+    lat0, lat1, lng0, lng1 = bounds
+    lat, lng = (lat0 + lat1) / 2, (lng0 + lng1) / 2
+    # The corners nearer the pole are a bit closer, so take the farthest one
+    radius = max(haversine_m(lat, lng, corner_lat, lng1) for corner_lat in (lat0, lat1))
+    return lat, lng, math.ceil(radius)
+
+
+def quad_roots(lat_min=LAT_MIN, lat_max=LAT_MAX, lng_min=LNG_MIN, lng_max=LNG_MAX,
+               lat_step=LAT_STEP * ROOT_SCALE, lng_step=LNG_STEP * ROOT_SCALE):
+    """
+    Top-level quadtree cells tiling the bounding box.
+
+    Return: A list of (cell id, bounds)
+    """
+    n_lat = math.ceil((lat_max - lat_min) / lat_step)
+    n_lng = math.ceil((lng_max - lng_min) / lng_step)
+    return [(f"q{i}_{j}-", (lat_min + i * lat_step, lat_min + (i + 1) * lat_step,
+                            lng_min + j * lng_step, lng_min + (j + 1) * lng_step))
+            for i in range(n_lat) for j in range(n_lng)]
+
+
+def quad_children(cell_id, bounds):
+    """
+    The four quadrants of a quadtree cell; the id of a child is the id of its
+    parent followed by the quadrant number (0 to 3).
+
+    Return: A list of (cell id, bounds)
+    """
+    lat0, lat1, lng0, lng1 = bounds
+    lat_mid, lng_mid = (lat0 + lat1) / 2, (lng0 + lng1) / 2
+    quadrants = [(lat0, lat_mid, lng0, lng_mid), (lat0, lat_mid, lng_mid, lng1),
+                 (lat_mid, lat1, lng0, lng_mid), (lat_mid, lat1, lng_mid, lng1)]
+    return [(f"{cell_id}{k}", quadrant) for k, quadrant in enumerate(quadrants)]
+
+
+def quad_depth(cell_id):
+    return len(cell_id.split("-")[1])
+
+
+def report_line(report):
+    """
+    Summary of a scrape: requests made versus unique places found.
+    """
+    per_request = report['unique_places'] / report['requests'] if report['requests'] else 0
+    return (f"{report['cells']} cells ({report['failed']} failed), {report['requests']} requests, "
+            f"{report['places']} places found, {report['unique_places']} new unique places "
+            f"({per_request:.2f} unique places per request)")
+
+
+def scrape_grid(place_type, output_dir=None, workers=8, tile_size=TILE_SIZE, api_key=API_KEY,
+                base_url=BASE_URL, page_delay=(1, 3), restart=False):
+    """
+    Scrape places of a specific type over the Chicago grid with a pool of
+    workers, resuming from the checkpoint of a previous run.
+
+    Input:
+        place_type (str): place type, e.g., restaurant
+        output_dir (str): directory of the output files (default ./google_data)
+        workers (int): number of tiles scraped at the same time
+        tile_size (int): cells per tile side
+        api_key (str): Google API key
+        base_url (str): Nearby Search endpoint
+        page_delay (tuple): range of seconds to wait before using a page token
+        restart (bool): ignore an existing checkpoint and start over
+
+    Returns: A dict with the number of cells scraped and failed, requests
+             made, places found and new unique places written
+    """
+    output_dir = output_dir or os.path.join(os.getcwd(), 'google_data')
+    cells = grid_cells()
+    tiles = make_tiles(cells, tile_size)
+    sink = PlaceSink(output_dir, place_type, restart, mode="grid")
+    client = PlacesClient()
+    skipped = sum(f"{i}_{j}" in sink.done for i, j, _, _ in cells)
+    if skipped:
+        print(f"Resuming: {skipped} of {len(cells)} cells already done")
+
+    scraped, failed = 0, 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(scrape_tile, tile, place_type, sink, client, api_key,
+                                   base_url, page_delay) for tile in tiles]
+            for future in as_completed(futures):
+                tile_scraped, tile_failed = future.result()
+                scraped += tile_scraped
+                failed += tile_failed
+    finally:
+        sink.close()
+
+    if failed:
+        print(f"{failed} cells failed; run again to retry them.")
+    print(f"Data scraping for {place_type} complete. Data saved to {sink.places_file}.")
+    print(f"JSON data saved to {sink.objects_file}.")
+    return {"cells": scraped, "failed": failed, "requests": client.requests,
+            "places": sink.found, "unique_places": sink.written}
+
+
+def scrape_quadtree(place_type, output_dir=None, workers=8, max_depth=MAX_DEPTH,
+                    api_key=API_KEY, base_url=BASE_URL, page_delay=(1, 3), restart=False):
+    """
+    Scrape places of a specific type with an adaptive quadtree: start from
+    coarse cells (ROOT_SCALE grid steps wide), and split a cell into four
+    only when its search hits the MAX_RESULTS cap. Empty and sparse cells are
+    not split, so they cost a single request.
+
+    Resumes from the checkpoint of a previous run: the split cells of that
+    run are expanded again without new requests.
+
+    Input:
+        place_type (str): place type, e.g., restaurant
+        output_dir (str): directory of the output files (default ./google_data)
+        workers (int): number of cells scraped at the same time
+        max_depth (int): maximum number of splits of a top-level cell
+        api_key (str): Google API key
+        base_url (str): Nearby Search endpoint
+        page_delay (tuple): range of seconds to wait before using a page token
+        restart (bool): ignore an existing checkpoint and start over
+
+    Returns: A dict with the number of cells scraped and failed, requests
+             made, places found, new unique places written, and cells still
+             saturated at max_depth (where places may be missing)
+    """
+    output_dir = output_dir or os.path.join(os.getcwd(), 'google_data')
+    sink = PlaceSink(output_dir, place_type, restart, mode="quadtree")
+    client = PlacesClient()
+    scraped, failed, capped = 0, 0, 0
+    pending = {}
+
+    def visit(cell_id, bounds):
+        # Expand cells done in a previous run, submit the others
+        record = sink.done.get(cell_id)
+        if record is None:
+            lat, lng, radius = quad_center(bounds)
+            future = pool.submit(scrape_cell, cell_id, lat, lng, radius, place_type, sink,
+                                 client, api_key, base_url, page_delay,
+                                 depth=quad_depth(cell_id))
+            pending[future] = (cell_id, bounds)
+        elif record.get("saturated"):
+            split(cell_id, bounds)
+
+    def split(cell_id, bounds):
+        nonlocal capped
+        if quad_depth(cell_id) >= max_depth:
+            capped += 1
+            return
+        for child in quad_children(cell_id, bounds):
+            visit(*child)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for root in quad_roots():
+                visit(*root)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    cell_id, bounds = pending.pop(future)
+                    found = future.result()
+                    if found is None:
+                        failed += 1
+                        continue
+                    scraped += 1
+                    if found >= MAX_RESULTS:
+                        split(cell_id, bounds)
+    finally:
+        sink.close()
+
+    if failed:
+        print(f"{failed} cells failed; run again to retry them.")
+    if capped:
+        print(f"{capped} cells still hit the {MAX_RESULTS}-result cap at depth {max_depth}.")
+    print(f"Data scraping for {place_type} complete. Data saved to {sink.places_file}.")
+    print(f"JSON data saved to {sink.objects_file}.")
+    return {"cells": scraped, "failed": failed, "requests": client.requests,
+            "places": sink.found, "unique_places": sink.written,
+            "capped": capped}
+
+
+def main():
+
+    """
+    Run scrapping
+    """
+
+    parser = argparse.ArgumentParser(description="Parallel, resumable grid search of places")
+    parser.add_argument("place_type", help="place type to scrape, e.g., restaurant")
+    parser.add_argument("--mode", choices=["grid", "quadtree"], default="grid",
+                        help="fixed ~1 km grid, or adaptive quadtree")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE)
+    parser.add_argument("--max-depth", type=int, default=MAX_DEPTH)
+    parser.add_argument("--output-dir", default=None)
+    parser.add_argument("--api-key", default=os.environ.get("GOOGLE_API_KEY", API_KEY))
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore the checkpoint of a previous run")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.mode == "quadtree":
+        report = scrape_quadtree(args.place_type, args.output_dir, args.workers,
+                                 args.max_depth, args.api_key, args.base_url,
+                                 restart=args.restart)
+    else:
+        report = scrape_grid(args.place_type, args.output_dir, args.workers, args.tile_size,
+                             args.api_key, args.base_url, restart=args.restart)
+    print(f"{report_line(report)} in {time.time() - start_time:.1f} seconds")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,23 @@
 # Resource:
     # 1) https://stackoverflow.com/questions/33440805/pandas-dataframe-read-csv-on-bad-data
 
+import argparse
 import os
 import pandas as pd
-from util import (
-    count_nearby,
-    crime_summary,
-    compute_restaurant_stats,
-    impute_house_price_per_sq_ft
-)
+from features import DEFAULT_MAX_MEMORY_MB, TEMPORAL_GROUP, build_features
+from feature_cache import cached_build_features
+from impute import impute_price_per_sq_ft
+from columnar import cached_load, write_columnar
+from redfin_data.property_store import load_houses
+from crime_data.get_crime import MANIFEST_FILE, STORE_DIR, load_crimes
+from crime_store import cached_crime_store
+from temporal_crime import TemporalCrimeIndex
+from shard_executor import ShardExecutor
+import instrument
+from instrument import stage
+
+# The only crime columns used to build features
+CRIME_INPUT_COLUMNS = ["Latitude", "Longitude", "primary_type"]
 
 def load_and_clean_csv(filepath, header='infer', columns=None, drop_duplicate=False):
     """
@@ -48,102 +57,281 @@ def load_and_clean_csv(filepath, header='infer', columns=None, drop_duplicate=Fa
 
     return df
 
-def process_data():
+def load_input(filepath, columnar_dir=None, usecols=None, **kwargs):
     """
-    To process the data, calculate essential data and aggregate data 
-    to a master data frame
+    Load and clean an input CSV (see load_and_clean_csv), through the typed
+    Parquet cache in columnar_dir if given (see columnar.py).
+
+    Inputs:
+      filepath: path to CSV file.
+      columnar_dir: directory of the Parquet cache, or None to parse the CSV.
+      usecols: list of columns to return (default all).
+      kwargs: passed to load_and_clean_csv.
+
+    Returns:
+      Cleaned DataFrame.
+    """
+    def load():
+        return load_and_clean_csv(filepath, **kwargs)
+
+    if columnar_dir is None:
+        df = load()
+        return df if usecols is None else df[usecols]
+    return cached_load(filepath, load, columnar_dir, columns=usecols)
+
+def input_source_files():
+    """
+    Paths of the input files of the amenity and crime tables, under the
+    current working directory (the crime store manifest of get_crime.py if
+    there is one, else crime.csv).
+
+    Returns:
+      dict: Path of the file of every table of load_input_tables (hash them
+            with util.source_hash, which also covers the crime part files).
     """
-    # Get the current working directory
     current_directory = os.getcwd()
-    
-    # Define data directories
     google_data_dir = os.path.join(current_directory, "place_data")
     crime_data_dir = os.path.join(current_directory, "crime_data")
-    redfin_data_dir = os.path.join(current_directory, "redfin_data")
+    crime_manifest = os.path.join(crime_data_dir, STORE_DIR, MANIFEST_FILE)
+    return {
+        "restaurants": os.path.join(google_data_dir, "chicago_restaurants.csv"),
+        "stores": os.path.join(google_data_dir, "convenience_store_data.csv"),
+        "schools": os.path.join(google_data_dir, "school_data.csv"),
+        "hospitals": os.path.join(google_data_dir, "hospital_data.csv"),
+        "crime": (crime_manifest if os.path.exists(crime_manifest)
+                  else os.path.join(crime_data_dir, "crime.csv")),
+    }
+
+def load_input_tables(columnar_dir=None, crime_store_dir=None):
+    """
+    Load the amenity and crime tables from the data directories under the
+    current working directory.
+
+    Inputs:
+      columnar_dir: directory of the typed Parquet cache of the cleaned input
+                    CSVs, or None to parse the CSVs every time.
+      crime_store_dir: directory of the compact crime store (see process_data),
+                       or None to load the crimes as a DataFrame.
+
+    Returns:
+      tables: dict with the 'restaurants', 'stores', 'schools', 'hospitals'
+              and 'crime' tables.
+      source_files: dict with the path of the file each table was read from.
+      load_crime: function loading the crime DataFrame with the given columns.
+    """
+    source_files = input_source_files()
 
     # --- Load Input CSVs Scraped from get_places.py ---
     # Restaurants
-    restaurants_file = os.path.join(google_data_dir, "chicago_restaurants.csv")
-    df_restaurants = load_and_clean_csv(
-        restaurants_file, header=None,
-        columns=["Name", "Business Status", "Address", "City", 
-                 "Price Level", "Rating", "Total Ratings", "Latitude", "Longitude"],
-        drop_duplicate=True
-    )
+    restaurants_file = source_files["restaurants"]
+    with stage("load restaurants") as record:
+        df_restaurants = load_input(
+            restaurants_file, columnar_dir, header=None,
+            columns=["Name", "Business Status", "Address", "City", 
+                     "Price Level", "Rating", "Total Ratings", "Latitude", "Longitude"],
+            drop_duplicate=True
+        )
+        record["rows"] = len(df_restaurants)
     
     # Convenience / Grocery Stores
-    stores_file = os.path.join(google_data_dir, "convenience_store_data.csv")
-    df_stores = load_and_clean_csv(stores_file, drop_duplicate=True)
+    stores_file = source_files["stores"]
+    with stage("load stores") as record:
+        df_stores = load_input(stores_file, columnar_dir, drop_duplicate=True)
+        record["rows"] = len(df_stores)
     
     # Schools
-    schools_file = os.path.join(google_data_dir, "school_data.csv")
-    df_schools = load_and_clean_csv(schools_file, drop_duplicate=True)
+    schools_file = source_files["schools"]
+    with stage("load schools") as record:
+        df_schools = load_input(schools_file, columnar_dir, drop_duplicate=True)
+        record["rows"] = len(df_schools)
     
     # Hospitals
-    hospital_file = os.path.join(google_data_dir, "hospital_data.csv")
-    df_hospital = load_and_clean_csv(hospital_file, drop_duplicate=True)
+    hospital_file = source_files["hospitals"]
+    with stage("load hospitals") as record:
+        df_hospital = load_input(hospital_file, columnar_dir, drop_duplicate=True)
+        record["rows"] = len(df_hospital)
     
-    # Crime Data
-    crime_file = os.path.join(crime_data_dir, "crime.csv")
-    df_crime = load_and_clean_csv(crime_file)
+    # Crime Data (from the Parquet store of get_crime.py if there is one)
+    crime_file = source_files["crime"]
+    if os.path.basename(crime_file) == MANIFEST_FILE:
+        crime_store = os.path.dirname(crime_file)
+        def load_crime(columns=CRIME_INPUT_COLUMNS):
+            return load_crimes(crime_store, columns=columns)
+    else:
+        def load_crime(columns=CRIME_INPUT_COLUMNS):
+            return load_input(crime_file, columnar_dir, usecols=columns)
+    with stage("load crime") as record:
+        if crime_store_dir is None:
+            df_crime = load_crime()
+        else:
+            df_crime = cached_crime_store(crime_file, load_crime, crime_store_dir)
+        record["rows"] = len(df_crime)
+
+    tables = {"restaurants": df_restaurants, "stores": df_stores, "schools": df_schools,
+              "hospitals": df_hospital, "crime": df_crime}
+    return tables, source_files, load_crime
+
+def load_crime_time(load_crime, crime_windows_days=None, crime_half_lives_days=None):
+    """
+    Sort the crimes by date for the time-windowed / decayed crime features.
+
+    Inputs:
+      load_crime: function loading the crime DataFrame (see load_input_tables).
+      crime_windows_days, crime_half_lives_days: see process_data.
+
+    Returns:
+      TemporalCrimeIndex, or None if there are no windows nor half-lives.
+    """
+    if not (crime_windows_days or crime_half_lives_days):
+        return None
+    with stage("index crime dates") as record:
+        crime_time = TemporalCrimeIndex(load_crime(CRIME_INPUT_COLUMNS + ["date"]),
+                                        windows_days=crime_windows_days or (),
+                                        half_lives_days=crime_half_lives_days or ())
+        record["rows"] = len(crime_time.dates)
+    return crime_time
+
+def process_data(radius_km=1.0, max_memory_mb=DEFAULT_MAX_MEMORY_MB, cache_dir=None,
+                 impute_mode="radius", impute_k=5, columnar_dir=None, redfin_db=None,
+                 crime_store_dir=None, crime_windows_days=None, crime_half_lives_days=None,
+                 workers=1):
+    """
+    To process the data, calculate essential data and aggregate data 
+    to a master data frame
+
+    Inputs:
+      radius_km: search radius in km for the nearby features, or a list of
+                 radii (e.g., [0.25, 0.5, 1, 2]) to get every feature per
+                 radius, suffixed like num_crimes_500m, num_crimes_1km.
+      max_memory_mb: cap on the memory used for house-to-place distance
+                     pairs; houses are processed in chunks to stay under it.
+      cache_dir: directory of the feature cache. If given, only the features
+                 whose input CSV changed, or of houses that are new, are
+                 recomputed (see feature_cache.py).
+      impute_mode: how missing price_per_sq_ft is imputed: 'radius' (mean
+                   within 1 km), 'knn' or 'idw' (see impute.py).
+      impute_k: number of nearest priced houses for 'knn' and 'idw'.
+      columnar_dir: directory of the typed Parquet cache of the cleaned input
+                    CSVs, or None to parse the CSVs every time.
+      redfin_db: path to redfin_properties.db to select the houses from its
+                 typed `listings` table (see redfin_data/property_store.py)
+                 instead of reading redfin_cleaned_v2.csv.
+      crime_store_dir: directory of the compact, memory-mapped crime store
+                       (float32 coordinates and uint8 crime type codes, see
+                       crime_store.py), rebuilt only when the crime data
+                       changed; None (default) to keep the crime table as a
+                       DataFrame. The float32 coordinates move crimes by
+                       less than a meter, so the counts of a few houses can
+                       differ from the DataFrame's for crimes on the radius.
+      crime_windows_days: time windows in days (e.g., [30, 90, 365]) for
+                          crime counts over the most recent crimes only,
+                          added as columns like num_crimes_90d (see
+                          temporal_crime.py).
+      crime_half_lives_days: half-lives in days of exponentially time-decayed
+                             crime counts, added as columns like crime_decay_90d.
+      workers: number of worker processes for the features. With more than
+               one, the houses are split into shards computed in parallel,
+               and the tables are shared with the workers through memory-
+               mapped files (see shard_executor.py); the output is the same.
+    """
+    tables, source_files, load_crime = load_input_tables(columnar_dir, crime_store_dir)
+    df_restaurants, df_stores, df_schools, df_hospital, df_crime = (
+        tables[group] for group in ("restaurants", "stores", "schools", "hospitals", "crime"))
+    redfin_data_dir = os.path.join(os.getcwd(), "redfin_data")
+
+    # Crimes sorted by date for the time-windowed / decayed crime features
+    crime_time = load_crime_time(load_crime, crime_windows_days, crime_half_lives_days)
     
     # --- Load Housing Data from Redfin) ---
-    redfin_file = os.path.join(redfin_data_dir, "redfin_cleaned_v2.csv")
-    df_houses = pd.read_csv(redfin_file)
-
-    # --- Compute Nearby Features for Each House ---
-    df_houses['price_per_sq_ft'] = df_houses.apply(
-        lambda row: impute_house_price_per_sq_ft(row, df_houses, radius_km=1.0),
-        axis=1
-    )
-    df_houses['num_restaurants'] = df_houses.apply(
-        lambda row: count_nearby(row['latitude'], row['longitude'], df_restaurants, radius_km=1.0),
-        axis=1
-    )
-    df_houses['avg_restaurant_price_level'] = df_houses.apply(
-        lambda row: compute_restaurant_stats(row['latitude'], row['longitude'], df_restaurants, 'Price Level', radius_km=1.0),
-        axis=1
-    )
-    df_houses['avg_restaurant_rating'] = df_houses.apply(
-        lambda row: compute_restaurant_stats(row['latitude'], row['longitude'], df_restaurants, 'Rating', radius_km=1.0),
-        axis=1
-    )
-    df_houses['num_stores'] = df_houses.apply(
-        lambda row: count_nearby(row['latitude'], row['longitude'], df_stores, radius_km=1.0),
-        axis=1
-    )
-    df_houses['num_schools'] = df_houses.apply(
-        lambda row: count_nearby(row['latitude'], row['longitude'], df_schools, radius_km=1.0),
-        axis=1
-    )
-    df_houses['num_hospitals'] = df_houses.apply(
-        lambda row: count_nearby(row['latitude'], row['longitude'], df_hospital, radius_km=1.0),
-        axis=1
-    )
-    df_houses['num_crimes'] = df_houses.apply(
-        lambda row: count_nearby(row['latitude'], row['longitude'], df_crime, radius_km=1.0),
-        axis=1
-    )
-    
-    # Compute a crime summary (e.g., counts and most prevalent crime) for each house
-    crime_summary_list = [
-        crime_summary(row['latitude'], row['longitude'], df_crime, radius_km=1.0)
-        for _, row in df_houses.iterrows()
-    ]
-    crime_summary_df = pd.DataFrame(crime_summary_list).fillna(0)
-    df_master = df_houses.join(crime_summary_df)
+    with stage("load houses") as record:
+        if redfin_db is None:
+            redfin_file = os.path.join(redfin_data_dir, "redfin_cleaned_v2.csv")
+            df_houses = pd.read_csv(redfin_file)
+        else:
+            df_houses = load_houses(redfin_db)
+        record["rows"] = len(df_houses)
+
+    # --- Compute Nearby Features for All Houses at Once ---
+    with stage("impute price_per_sq_ft", rows=len(df_houses)):
+        df_houses['price_per_sq_ft'] = impute_price_per_sq_ft(
+            df_houses, mode=impute_mode, radius_km=1.0, k=impute_k,
+            max_memory_mb=max_memory_mb
+        )
+    tables[TEMPORAL_GROUP] = crime_time
+    executor = None
+    if workers > 1:
+        with stage(f"start {workers} workers"):
+            executor = ShardExecutor(tables, workers)
+    try:
+        if cache_dir is None:
+            df_features = build_features(
+                df_houses, df_restaurants, df_stores, df_schools, df_hospital, df_crime,
+                radius_km=radius_km, max_memory_mb=max_memory_mb, crime_time=crime_time,
+                executor=executor
+            )
+        else:
+            source_files[TEMPORAL_GROUP] = source_files["crime"]
+            df_features, report = cached_build_features(
+                df_houses, tables, source_files, cache_dir,
+                radius_km=radius_km, max_memory_mb=max_memory_mb, executor=executor
+            )
+            print(f"Recomputed {report['rows']} rows and {report['columns']} columns "
+                  f"(of {len(df_houses)} rows and {df_features.shape[1]} columns)")
+            for group, counts in report["groups"].items():
+                print(f"  {group}: {counts['rows']} rows, {counts['columns']} columns")
+    finally:
+        if executor is not None:
+            executor.close()
+    with stage("join features", rows=len(df_houses)):
+        df_master = df_houses.join(df_features)
 
     return df_master
 
 def save_output(df_master):
     current_directory = os.getcwd()
     output_csv_path = os.path.join(current_directory, "summary_redfin.csv")
-    df_master.to_csv(output_csv_path, index=False)
+    with stage("write csv", rows=len(df_master)):
+        df_master.to_csv(output_csv_path, index=False)
     print(f"Master DataFrame saved to {output_csv_path}")
 
+    # Columnar copy so the notebooks can read only the columns they need
+    output_parquet_path = os.path.join(current_directory, "summary_redfin.parquet")
+    with stage("write parquet", rows=len(df_master)):
+        written = write_columnar(df_master, output_parquet_path)
+    if written:
+        print(f"Master DataFrame saved to {output_parquet_path}")
+
 def main():
-    master_df = process_data()
+    parser = argparse.ArgumentParser(description="Build summary_redfin.csv")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes for the features (default 1)")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"report the time and memory of every stage (also enabled by "
+                             f"{instrument.ENV_VAR}=1)")
+    parser.add_argument("--profile-dir",
+                        help="also dump a cProfile of every stage into this directory")
+    parser.add_argument("--crime-store", action="store_true",
+                        help="use the compact, memory-mapped crime store in crime_store/ "
+                             "(float32 coordinates: a few counts can differ from the "
+                             "default for crimes right on the radius)")
+    args = parser.parse_args()
+
+    recorder = instrument.enable_from_env()
+    if args.profile or args.profile_dir:
+        recorder = instrument.enable(args.profile_dir)
+
+    cache_dir = os.path.join(os.getcwd(), "feature_cache")
+    columnar_dir = os.path.join(os.getcwd(), "columnar_cache")
+    crime_store_dir = os.path.join(os.getcwd(), "crime_store") if args.crime_store else None
+    master_df = process_data(cache_dir=cache_dir, columnar_dir=columnar_dir,
+                             crime_store_dir=crime_store_dir, workers=args.workers)
     save_output(master_df)
 
+    if recorder is not None:
+        print(recorder.report())
+        report_path = os.path.join(os.getcwd(), instrument.REPORT_FILE)
+        recorder.save(report_path)
+        print(f"Stage report saved to {report_path}")
+
 if __name__ == '__main__':
     main()
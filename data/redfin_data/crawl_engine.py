@@ -0,0 +1,298 @@
+# This python script runs the Redfin crawl of redfin_crawler.py concurrently.
+# Instead of walking the ZIP codes one after another and sleeping a fixed
+# 12 s / 2 s between requests, several ZIP codes are crawled at the same time
+# by a pool of worker threads. Every request goes through a token-bucket rate
+# limiter per host (md.dhr.wtf and ScraperAPI each have their own budget), so
+# the total request rate to a host stays bounded no matter how many workers
+# run. Failed requests (connection errors, 429 and 5xx responses) are retried
+# with exponential backoff.
+
+# Discovered URLs go to the crawl frontier of the database (see frontier.py),
+# from which the workers claim batches, so an interrupted crawl continues
+# where it stopped, and several crawl processes can share one database.
+
+# The proxy and ScraperAPI base URLs can be changed on the command line, so the
+# crawl can be run against a local stub HTTP server, e.g.:
+#   python crawl_engine.py --workers 4 --proxy-url http://localhost:8000/md?url= \
+#       --scraperapi-endpoint http://localhost:8000/scraperapi --zipcodes 60601 60602
+
+# Resources:
+# - https://en.wikipedia.org/wiki/Token_bucket
+# - https://docs.python.org/3/library/concurrent.futures.html
+# - https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Retry-After
+# - https://docs.python-requests.org/en/latest/user/advanced/#session-objects
+
+import argparse
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import requests
+
+from frontier import Frontier
+from redfin_crawler import (
+    MARKDOWN_PROXY_URL,
+    SCRAPERAPI_ENDPOINT,
+    ZIPCODES,
+    PropertyWriter,
+    process_property_urls,
+    scrape_zipcode
+)
+
+# Requests per second and burst size allowed per host. md.dhr.wtf is a free
+# service, so it keeps a budget close to the original 12 s between pages;
+# ScraperAPI plans allow several concurrent requests.
+DEFAULT_HOST_RATES = {
+    "md.dhr.wtf": (0.2, 2),
+    "api.scraperapi.com": (2.0, 5),
+}
+# Budget for any other host (e.g., a local stub server)
+DEFAULT_RATE = (5.0, 5)
+
+# Responses worth retrying: rate limited, or a temporary server error
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: holds up to `capacity` tokens and refills at
+    `rate` tokens per second. Every request takes one token, waiting for the
+    bucket to refill if it is empty.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        Args:
+            rate (float): Tokens added per second.
+            capacity (int): Maximum number of tokens (burst size).
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take one token, blocking until one is available.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class RateLimitedClient:
+    """
+    HTTP client shared by the crawler threads. Requests are rate limited per
+    host and retried with exponential backoff. Every thread uses its own
+    requests.Session, so connections to a host are kept alive and reused.
+    """
+
+    def __init__(self, host_rates=None, default_rate=DEFAULT_RATE, retries=4,
+                 backoff=1.0, max_backoff=60.0):
+        """
+        Args:
+            host_rates (dict): Host name -> (requests per second, burst size).
+            default_rate (tuple): (requests per second, burst size) for other hosts.
+            retries (int): Number of retries after the first attempt.
+            backoff (float): Seconds to wait before the first retry; doubled
+                after every further failure (with random jitter).
+            max_backoff (float): Upper bound on the wait between retries.
+        """
+        self.host_rates = dict(DEFAULT_HOST_RATES if host_rates is None else host_rates)
+        self.default_rate = default_rate
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "throttled_s": 0.0}
+
+    def bucket(self, host):
+        """
+        Token bucket of a host (created on first use).
+        """
+        with self.buckets_lock:
+            if host not in self.buckets:
+                rate, capacity = self.host_rates.get(host, self.default_rate)
+                self.buckets[host] = TokenBucket(rate, capacity)
+            return self.buckets[host]
+
+    def session(self):
+        """
+        requests.Session of the calling thread.
+        """
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def count(self, key, value=1):
+        with self.stats_lock:
+            self.stats[key] += value
+
+    def retry_wait(self, attempt, response=None):
+        """
+        Seconds to wait before retrying: the server's Retry-After header if it
+        gives one in seconds, otherwise exponential backoff with jitter.
+        """
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self.max_backoff)
+        wait = min(self.backoff * 2 ** attempt, self.max_backoff)
+        return wait * random.uniform(0.5, 1.0)
+
+    def get(self, url, **kwargs):
+        """
+        Rate-limited GET with retries; same arguments as requests.get.
+
+        Returns:
+            Response: The last response (the caller checks its status).
+
+        Raises:
+            requests.RequestException: If the last attempt failed to connect.
+        """
+        kwargs.setdefault("timeout", 30)
+        bucket = self.bucket(urlsplit(url).hostname)
+
+        for attempt in range(self.retries + 1):
+            self.count("throttled_s", bucket.acquire())
+            self.count("requests")
+            try:
+                response = self.session().get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    self.count("failures")
+                    raise
+                wait = self.retry_wait(attempt)
+                print(f"Retrying {url} in {wait:.1f}s ({str(e)})")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    if response.status_code in RETRY_STATUSES:
+                        self.count("failures")
+                    return response
+                wait = self.retry_wait(attempt, response)
+                print(f"Retrying {url} in {wait:.1f}s (HTTP {response.status_code})")
+            self.count("retries")
+            time.sleep(wait)
+
+
+def crawl_zipcode(zipcode, client, api_key, writer, frontier, proxy_url, endpoint):
+    """
+    Scrape the listing pages of one ZIP code and fetch all its properties.
+    Pacing is left to the client's rate limiter, so no fixed sleeps are used.
+
+    Args:
+        zipcode (int): The ZIP code to crawl.
+        client (RateLimitedClient): The shared HTTP client.
+        api_key (str): ScraperAPI API key.
+        writer (PropertyWriter): The shared database writer.
+        frontier (Frontier): The shared crawl frontier.
+        proxy_url (str): URL of the markdown proxy.
+        endpoint (str): ScraperAPI Redfin endpoint.
+
+    Returns:
+        int: Number of URLs processed.
+    """
+    print(f"\n====== Working on ZIP: {zipcode} ======")
+    urls = scrape_zipcode(zipcode, frontier, get=client.get, delay=0, proxy_url=proxy_url)
+    if not urls:
+        print(f"No listings found for ZIP {zipcode}.")
+        return 0
+
+    print(f"Found {len(urls)} URLs in {zipcode}. Starting processing...")
+    return process_property_urls(api_key, frontier, zipcode, get=client.get, delay=0,
+                                 endpoint=endpoint, writer=writer)
+
+
+def crawl(zipcodes, api_key, db_path='redfin_properties.db', workers=4, client=None,
+          proxy_url=MARKDOWN_PROXY_URL, endpoint=SCRAPERAPI_ENDPOINT):
+    """
+    Crawl several ZIP codes concurrently, then process the URLs left in the
+    frontier (by an earlier, interrupted crawl, or whose fetch failed once).
+
+    Args:
+        zipcodes (list): ZIP codes to crawl.
+        api_key (str): ScraperAPI API key.
+        db_path (str): Path to SQLite database file.
+        workers (int): Number of ZIP codes crawled at the same time.
+        client (RateLimitedClient): HTTP client (default one with DEFAULT_HOST_RATES).
+        proxy_url (str): URL of the markdown proxy.
+        endpoint (str): ScraperAPI Redfin endpoint.
+
+    Returns:
+        int: Number of URLs processed across all ZIP codes.
+    """
+    client = client or RateLimitedClient()
+
+    start = time.perf_counter()
+    total_processed = 0
+    # One database writer and one frontier shared by all threads
+    with PropertyWriter(db_path) as writer, Frontier(db_path) as frontier, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(crawl_zipcode, zc, client, api_key, writer, frontier,
+                               proxy_url, endpoint): zc for zc in zipcodes}
+        for future in as_completed(futures):
+            try:
+                total_processed += future.result() or 0
+            except Exception as e:
+                print(f"Error crawling ZIP {futures[future]}: {str(e)}")
+
+        # Drain the rest of the frontier with all workers
+        drains = [pool.submit(process_property_urls, api_key, frontier, get=client.get,
+                              delay=0, endpoint=endpoint, writer=writer)
+                  for _ in range(workers)]
+        for future in as_completed(drains):
+            try:
+                total_processed += future.result() or 0
+            except Exception as e:
+                print(f"Error processing the frontier: {str(e)}")
+        counts = frontier.counts()
+
+    elapsed = time.perf_counter() - start
+    print(f"\nTotal URLs processed across all ZIP codes: {total_processed}")
+    print(f"Crawled {len(zipcodes)} ZIP codes in {elapsed:.1f}s with {workers} workers "
+          f"({client.stats['requests']} requests, {client.stats['retries']} retries, "
+          f"{client.stats['failures']} failures)")
+    print(f"Frontier: {counts}")
+    return total_processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent, rate-limited Redfin crawler")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="number of ZIP codes crawled at the same time")
+    parser.add_argument("--zipcodes", type=int, nargs="+", default=ZIPCODES)
+    parser.add_argument("--db-path", default="redfin_properties.db")
+    parser.add_argument("--api-key", default=os.environ.get("SCRAPERAPI_KEY", ""),
+                        help="ScraperAPI API key (default $SCRAPERAPI_KEY)")
+    parser.add_argument("--proxy-url", default=MARKDOWN_PROXY_URL)
+    parser.add_argument("--scraperapi-endpoint", default=SCRAPERAPI_ENDPOINT)
+    parser.add_argument("--retries", type=int, default=4)
+    args = parser.parse_args()
+
+    client = RateLimitedClient(retries=args.retries)
+    crawl(args.zipcodes, args.api_key, args.db_path, args.workers, client,
+          args.proxy_url, args.scraperapi_endpoint)
+
+
+if __name__ == "__main__":
+    main()
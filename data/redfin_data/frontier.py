@@ -0,0 +1,295 @@
+# This python script keeps the crawl frontier of redfin_crawler.py in a
+# `frontier` table of redfin_properties.db, instead of one urls_{zip}.txt file
+# per ZIP code that is moved to urls/processed/ once done. Every discovered
+# listing URL is one row (url, zipcode, discovered_at, status, attempts,
+# last_error, claimed_at, next_attempt_at), indexed on its status and ZIP code.
+
+# Crawler threads or processes claim batches of pending URLs: the batch is
+# selected and marked as claimed in one write transaction (BEGIN IMMEDIATE),
+# so two workers never get the same URL. A URL whose fetch failed goes back
+# to pending until it has been tried max_attempts times, but is not claimed
+# again before its next_attempt_at (retry_delay seconds, doubled after every
+# failed attempt), so a crawl loop does not use up its attempts back to back
+# while e.g. the proxy is down. A claim that is
+# not finished within claim_timeout seconds (e.g., the worker was killed) can
+# be claimed again, so a restarted crawl simply continues where it stopped.
+
+# URLs of existing urls_*.txt files are imported with:
+#   python frontier.py redfin_properties.db urls_*.txt urls/processed/urls_*.txt
+
+# Resources:
+# https://www.sqlite.org/lang_transaction.html
+# https://www.sqlite.org/lang_createindex.html
+# https://www.sqlite.org/wal.html
+
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Statuses of a URL
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+
+# Number of fetch attempts before a URL is left as failed
+MAX_ATTEMPTS = 3
+
+# Seconds before a failed URL can be claimed again, doubled after every attempt
+RETRY_DELAY = 60
+
+# Seconds after which a claimed URL that was not finished can be claimed again
+CLAIM_TIMEOUT = 15 * 60
+
+# Number of URLs claimed at a time
+CLAIM_BATCH_SIZE = 20
+
+INDEXES = {
+    "idx_frontier_status": "status, zipcode",
+    "idx_frontier_zipcode": "zipcode",
+}
+
+
+def init_frontier(conn):
+    """
+    Create the `frontier` table and its indexes if they don't exist.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+    """
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS frontier (
+            url TEXT PRIMARY KEY,
+            zipcode TEXT,
+            discovered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT NOT NULL DEFAULT '{PENDING}',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            claimed_at REAL,
+            next_attempt_at REAL
+        )
+    ''')
+    # Frontiers created before failed URLs were backed off
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(frontier)")]
+    if "next_attempt_at" not in columns:
+        conn.execute("ALTER TABLE frontier ADD COLUMN next_attempt_at REAL")
+    for index, columns in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index} ON frontier ({columns})")
+    conn.commit()
+
+
+class Frontier:
+    """
+    The crawl frontier of a database. One Frontier can be shared by several
+    crawler threads, and several processes can each open their own on the
+    same database file.
+    """
+
+    def __init__(self, db_path, max_attempts=MAX_ATTEMPTS, claim_timeout=CLAIM_TIMEOUT,
+                 retry_delay=RETRY_DELAY):
+        """
+        Args:
+            db_path (str): The path to the SQLite database file.
+            max_attempts (int): Number of fetch attempts before a URL is left as failed.
+            claim_timeout (float): Seconds after which an unfinished claim expires.
+            retry_delay (float): Seconds before a failed URL can be claimed again,
+                doubled after every failed attempt.
+        """
+        # Transactions are started explicitly (see transaction)
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        init_frontier(self.conn)
+        self.max_attempts = max_attempts
+        self.claim_timeout = claim_timeout
+        self.retry_delay = retry_delay
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the `with` block in one write transaction of this thread.
+
+        BEGIN IMMEDIATE takes the database's write lock before anything is
+        read, so no other process can change the rows in between.
+        """
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def add(self, urls, zipcode=None):
+        """
+        Add discovered URLs; URLs already in the frontier are left as they are.
+
+        Args:
+            urls (iterable): Listing URLs.
+            zipcode (int or str): ZIP code the URLs were found in.
+
+        Returns:
+            int: Number of URLs that were new.
+        """
+        zipcode = None if zipcode is None else str(zipcode)
+        with self.transaction():
+            before = self.conn.total_changes
+            self.conn.executemany('''
+                INSERT OR IGNORE INTO frontier (url, zipcode) VALUES (?, ?)
+            ''', [(url, zipcode) for url in urls])
+            return self.conn.total_changes - before
+
+    def claim(self, batch_size=CLAIM_BATCH_SIZE, zipcode=None):
+        """
+        Atomically claim a batch of URLs to fetch: pending ones whose retry
+        delay is over, and claimed ones whose claim expired. Their attempt
+        counter is increased.
+
+        Args:
+            batch_size (int): Maximum number of URLs.
+            zipcode (int or str): Only claim URLs of this ZIP code (default any).
+
+        Returns:
+            list: The claimed URLs, oldest first (empty when there are none left).
+        """
+        now = time.time()
+        condition = ("((status = ? AND (next_attempt_at IS NULL OR next_attempt_at <= ?))"
+                     " OR (status = ? AND claimed_at < ?))")
+        params = [PENDING, now, CLAIMED, now - self.claim_timeout]
+        if zipcode is not None:
+            condition += " AND zipcode = ?"
+            params.append(str(zipcode))
+        with self.transaction():
+            urls = [row[0] for row in self.conn.execute(
+                f"SELECT url FROM frontier WHERE {condition} "
+                f"ORDER BY discovered_at, rowid LIMIT ?", params + [batch_size])]
+            self.conn.executemany('''
+                UPDATE frontier SET status = ?, attempts = attempts + 1, claimed_at = ?
+                WHERE url = ?
+            ''', [(CLAIMED, now, url) for url in urls])
+        return urls
+
+    def done(self, urls):
+        """
+        Mark URLs as done (stored in the database).
+
+        Args:
+            urls (iterable): The finished URLs.
+        """
+        with self.transaction():
+            self.conn.executemany('''
+                UPDATE frontier SET status = ?, last_error = NULL, claimed_at = NULL,
+                    next_attempt_at = NULL
+                WHERE url = ?
+            ''', [(DONE, url) for url in urls])
+
+    def fail(self, url, error):
+        """
+        Record a failed fetch: the URL goes back to pending, to be claimed
+        again after retry_delay * 2 ** (attempts - 1) seconds, or is left as
+        failed after max_attempts attempts.
+
+        Args:
+            url (str): The URL.
+            error (str): Description of the error.
+        """
+        with self.lock:
+            self.conn.execute('''
+                UPDATE frontier
+                SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+                    last_error = ?, claimed_at = NULL,
+                    next_attempt_at = ? + ? * (1 << MAX(attempts - 1, 0))
+                WHERE url = ?
+            ''', (self.max_attempts, FAILED, PENDING, str(error), time.time(),
+                  self.retry_delay, url))
+
+    def retry_failed(self, zipcode=None):
+        """
+        Put the failed URLs back to pending with a fresh attempt counter,
+        to be claimed right away.
+
+        Returns:
+            int: Number of URLs requeued.
+        """
+        query = ("UPDATE frontier SET status = ?, attempts = 0, next_attempt_at = NULL "
+                 "WHERE status = ?")
+        params = [PENDING, FAILED]
+        if zipcode is not None:
+            query += " AND zipcode = ?"
+            params.append(str(zipcode))
+        with self.lock:
+            return self.conn.execute(query, params).rowcount
+
+    def status(self, url):
+        """
+        Status of a URL (an indexed lookup), or None if it was never discovered.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT status FROM frontier WHERE url = ?',
+                                    (url,)).fetchone()
+        return None if row is None else row[0]
+
+    def counts(self, zipcode=None):
+        """
+        Number of URLs per status.
+
+        Args:
+            zipcode (int or str): Only count URLs of this ZIP code (default all).
+
+        Returns:
+            dict: Status -> number of URLs.
+        """
+        query = "SELECT status, COUNT(*) FROM frontier"
+        params = []
+        if zipcode is not None:
+            query += " WHERE zipcode = ?"
+            params.append(str(zipcode))
+        with self.lock:
+            rows = self.conn.execute(query + " GROUP BY status", params).fetchall()
+        counts = {status: 0 for status in (PENDING, CLAIMED, DONE, FAILED)}
+        counts.update(dict(rows))
+        return counts
+
+    def import_url_files(self, paths):
+        """
+        Add the URLs of urls_{zip}.txt files written by earlier crawls.
+
+        Args:
+            paths (list): Paths of the files.
+
+        Returns:
+            int: Number of URLs that were new.
+        """
+        added = 0
+        for path in paths:
+            match = re.search(r'urls_(\d{5})\.txt$', os.path.basename(path))
+            with open(path, 'r') as f:
+                urls = [line.strip() for line in f if line.strip()]
+            added += self.add(urls, match.group(1) if match else None)
+        return added
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python frontier.py redfin_properties.db urls_*.txt ...")
+        sys.exit(1)
+    with Frontier(sys.argv[1]) as frontier:
+        added = frontier.import_url_files(sys.argv[2:])
+        print(f"Imported {added} new URLs; frontier: {frontier.counts()}")
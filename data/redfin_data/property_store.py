@@ -0,0 +1,345 @@
+# This python script keeps a structured copy of the Redfin listings in
+# redfin_properties.db. Next to the raw ScraperAPI JSON in the `properties`
+# table, every listing is stored as one typed row of the `listings` table
+# (price, sq_ft, coordinates, beds, baths, property_type, year_built, HOA...),
+# with indexes on the ZIP code, the property type and a spatial grid bucket.
+# Downstream steps can then select only the rows and columns they need with
+# SQL instead of loading and json.loads-ing every blob in the database.
+
+# Existing databases are converted with:
+#   python property_store.py redfin_properties.db
+
+# Resources:
+# https://www.sqlite.org/lang_createindex.html
+# https://www.sqlite.org/datatype3.html
+# https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.executemany
+# https://pandas.pydata.org/docs/reference/api/pandas.read_sql_query.html
+
+import json
+import math
+import re
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Size (in degrees) of the grid cells used as spatial buckets, about 1.1 km
+# north-south in Chicago
+GEO_BUCKET_DEG = 0.01
+
+EARTH_RADIUS_KM = 6371.0
+
+# Property types dropped by redfin_cleaner_v2.ipynb
+EXCLUDED_PROPERTY_TYPES = ("Parking", "Vacant Land")
+
+# Columns of the `listings` table, with their SQLite types
+LISTING_COLUMNS = {
+    "url": "TEXT PRIMARY KEY",
+    "zipcode": "TEXT",
+    "address": "TEXT",
+    "type": "TEXT",
+    "price": "REAL",
+    "sq_ft": "REAL",
+    "price_per_sq_ft": "REAL",
+    "latitude": "REAL",
+    "longitude": "REAL",
+    "geo_bucket": "INTEGER",
+    "beds": "REAL",
+    "baths": "REAL",
+    "property_type": "TEXT",
+    "year_built": "INTEGER",
+    "hoa_dues": "TEXT",
+    "hoa_dues_monthly": "REAL",
+    "community": "TEXT",
+    "county": "TEXT",
+    "heating_cooling": "TEXT",
+    "laundry": "TEXT",
+    "parking": "TEXT",
+    "lot_size": "TEXT",
+    "tags": "TEXT",
+}
+
+# Columns read by process_and_combine.py (the ones of redfin_cleaned_v2.csv
+# it uses)
+HOUSE_COLUMNS = ["url", "price", "sq_ft", "price_per_sq_ft", "latitude", "longitude",
+                 "beds", "baths", "property_type", "year_built", "zipcode"]
+
+INDEXES = {
+    "idx_listings_zipcode": "zipcode",
+    "idx_listings_property_type": "property_type",
+    "idx_listings_geo_bucket": "geo_bucket",
+}
+
+
+def init_listings(conn):
+    """
+    Create the `listings` table and its indexes if they don't exist.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+    """
+    columns = ",\n".join(f"{name} {sql_type}" for name, sql_type in LISTING_COLUMNS.items())
+    conn.execute(f"CREATE TABLE IF NOT EXISTS listings (\n{columns}\n)")
+    for index, column in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index} ON listings ({column})")
+    conn.commit()
+
+
+def to_number(value):
+    """
+    Parse a number from ScraperAPI output, e.g., 465000, '$465,000' or
+    '998 sq ft'.
+
+    Returns:
+        float: The number, or None if there is none.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return None if math.isnan(value) else float(value)
+    match = re.search(r'-?\d[\d,]*\.?\d*', str(value))
+    if match is None:
+        return None
+    return float(match.group().replace(',', ''))
+
+
+def geo_bucket(lat, lon, cell_deg=GEO_BUCKET_DEG):
+    """
+    Id of the grid cell containing a point.
+
+    Args:
+        lat (float): Latitude.
+        lon (float): Longitude.
+        cell_deg (float): Size of the grid cells in degrees.
+
+    Returns:
+        int: The bucket id, or None if a coordinate is missing.
+    """
+    if lat is None or lon is None:
+        return None
+    n_columns = math.ceil(360 / cell_deg)
+    row = math.floor((lat + 90) / cell_deg)
+    col = math.floor((lon + 180) / cell_deg)
+    return row * n_columns + col
+
+
+def haversine_km(lat, lon, lats, lons):
+    """
+    Great-circle distances (in km) from a point to arrays of points, as
+    util.haversine_distance (kept here so the redfin_data scripts run on
+    their own).
+
+    Returns:
+        np.ndarray: The distances.
+    """
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = (np.sin((lats - lat) / 2) ** 2
+         + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def buckets_near(lat, lon, radius_km, cell_deg=GEO_BUCKET_DEG):
+    """
+    Ids of all grid cells that can hold points within radius_km of a point.
+
+    Returns:
+        list: The bucket ids.
+    """
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    dlon = dlat / max(math.cos(math.radians(min(abs(lat) + dlat, 89.0))), 1e-6)
+    rows = range(math.floor((lat - dlat + 90) / cell_deg),
+                  math.floor((lat + dlat + 90) / cell_deg) + 1)
+    cols = range(math.floor((lon - dlon + 180) / cell_deg),
+                 math.floor((lon + dlon + 180) / cell_deg) + 1)
+    n_columns = math.ceil(360 / cell_deg)
+    return [row * n_columns + col for row in rows for col in cols]
+
+
+def parse_zipcode(details):
+    """
+    ZIP code of a listing, from its address or else its URL.
+    """
+    for text, pattern in ((details.get('address'), r'\b(\d{5})(?:-\d{4})?\s*$'),
+                          (details.get('url'), r'-(\d{5})/')):
+        if text:
+            match = re.search(pattern, str(text))
+            if match:
+                return match.group(1)
+    return None
+
+
+def parse_hoa_monthly(hoa_dues):
+    """
+    Monthly HOA fee from text such as '$905 monthly HOA fee'.
+    """
+    amount = to_number(hoa_dues)
+    if amount is None:
+        return None
+    text = str(hoa_dues).lower()
+    if 'annual' in text or 'year' in text:
+        return amount / 12
+    if 'quarter' in text:
+        return amount / 3
+    return amount
+
+
+def listing_row(details):
+    """
+    Flatten the ScraperAPI JSON of one listing into a row of `listings`.
+
+    Args:
+        details (dict): Property details
+
+    Returns:
+        tuple: Values in the order of LISTING_COLUMNS.
+    """
+    amenities = details.get('amenities') or {}
+    lat = to_number(details.get('latitude'))
+    lon = to_number(details.get('longitude'))
+    year_built = to_number(details.get('year_built') or amenities.get('built'))
+    tags = details.get('tags')
+
+    row = {
+        "url": details['url'],
+        "zipcode": parse_zipcode(details),
+        "address": details.get('address'),
+        "type": details.get('type'),
+        "price": to_number(details.get('price')),
+        "sq_ft": to_number(details.get('sq_ft')),
+        "price_per_sq_ft": to_number(details.get('price_per_sq_ft')),
+        "latitude": lat,
+        "longitude": lon,
+        "geo_bucket": geo_bucket(lat, lon),
+        "beds": to_number(details.get('beds')),
+        "baths": to_number(details.get('baths')),
+        "property_type": details.get('property_type'),
+        "year_built": None if year_built is None else int(year_built),
+        "hoa_dues": amenities.get('hoa_dues'),
+        "hoa_dues_monthly": parse_hoa_monthly(amenities.get('hoa_dues')),
+        "community": amenities.get('community'),
+        "county": amenities.get('county'),
+        "heating_cooling": amenities.get('heating_cooling'),
+        "laundry": amenities.get('laundry'),
+        "parking": amenities.get('parking'),
+        "lot_size": amenities.get('lot_size'),
+        "tags": None if tags is None else json.dumps(tags),
+    }
+    return tuple(row[col] for col in LISTING_COLUMNS)
+
+
+def insert_listings(conn, rows):
+    """
+    Insert (or replace) rows of `listings`; the caller commits.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        rows (list): Tuples from listing_row.
+    """
+    placeholders = ", ".join("?" for _ in LISTING_COLUMNS)
+    conn.executemany(f"INSERT OR REPLACE INTO listings ({', '.join(LISTING_COLUMNS)}) "
+                     f"VALUES ({placeholders})", rows)
+
+
+def migrate_properties(db_path, batch_size=1000):
+    """
+    Fill `listings` from the JSON blobs of `properties` that are not in it yet.
+
+    Args:
+        db_path (str): Path to SQLite database file
+        batch_size (int): Number of rows converted per transaction
+
+    Returns:
+        int: Number of rows converted
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    init_listings(conn)
+
+    converted = 0
+    last_rowid = 0
+    while True:
+        # Walk the table by rowid, one batch per transaction
+        blobs = conn.execute('''
+            SELECT p.rowid, p.data FROM properties p
+            WHERE p.rowid > ?
+              AND NOT EXISTS (SELECT 1 FROM listings l WHERE l.url = p.url)
+            ORDER BY p.rowid
+            LIMIT ?
+        ''', (last_rowid, batch_size)).fetchall()
+        if not blobs:
+            break
+        last_rowid = blobs[-1][0]
+        rows = []
+        for _, data in blobs:
+            try:
+                rows.append(listing_row(json.loads(data)))
+            except Exception as e:
+                print(f"Error converting property data: {str(e)}")
+        with conn:
+            insert_listings(conn, rows)
+        converted += len(rows)
+
+    conn.close()
+    print(f"Converted {converted} properties into the listings table")
+    return converted
+
+
+def load_houses(db_path, columns=HOUSE_COLUMNS, zipcodes=None, property_types=None,
+                exclude_types=EXCLUDED_PROPERTY_TYPES, near=None):
+    """
+    Select listings from the database with SQL.
+
+    Args:
+        db_path (str): Path to SQLite database file
+        columns (list): Columns of `listings` to return
+        zipcodes (list): Only these ZIP codes (default all)
+        property_types (list): Only these property types (default all)
+        exclude_types (tuple): Property types to leave out (by default the
+            ones dropped by redfin_cleaner_v2.ipynb)
+        near (tuple): (lat, lon, radius_km) to only return listings within
+            radius_km of a point, found through the geo_bucket index
+
+    Returns:
+        DataFrame: One row per listing with the requested columns.
+    """
+    unknown = set(columns) - set(LISTING_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown listing columns: {sorted(unknown)}")
+
+    conditions, params = [], []
+    for column, values in (("zipcode", zipcodes), ("property_type", property_types)):
+        if values:
+            conditions.append(f"{column} IN ({', '.join('?' for _ in values)})")
+            params.extend(str(v) for v in values)
+    if exclude_types:
+        # NOT IN alone would also drop NULL types, which the cleaner notebook keeps
+        conditions.append(f"(property_type NOT IN ({', '.join('?' for _ in exclude_types)})"
+                          " OR property_type IS NULL)")
+        params.extend(exclude_types)
+    if near is not None:
+        buckets = buckets_near(*near)
+        conditions.append(f"geo_bucket IN ({', '.join('?' for _ in buckets)})")
+        params.extend(buckets)
+
+    select = list(dict.fromkeys(list(columns) + (["latitude", "longitude"] if near else [])))
+    query = f"SELECT {', '.join(select)} FROM listings"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+    if near is not None:
+        lat, lon, radius_km = near
+        distances = haversine_km(lat, lon, df["latitude"].to_numpy(dtype=float),
+                                 df["longitude"].to_numpy(dtype=float))
+        df = df[distances <= radius_km][list(columns)]
+        df = df.reset_index(drop=True)
+    return df
+
+
+if __name__ == "__main__":
+    migrate_properties(sys.argv[1] if len(sys.argv) > 1 else 'redfin_properties.db')
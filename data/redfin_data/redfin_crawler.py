@@ -1,8 +1,9 @@
 # Author: Andrew Koller
 
 # This python scripr is used to scrape Redfin listings for Chicago, IL. The script
-# scrapes the first 9 pages of each ZIP code in Chicago and saves the URLs to a file.
-# The URLs are then processed through ScraperAPI to fetch the property details. The
+# scrapes the first 9 pages of each ZIP code in Chicago and saves the URLs to the
+# crawl frontier table of the database (see frontier.py). The URLs are then claimed
+# in batches and processed through ScraperAPI to fetch the property details. The
 # property details are then stored in a SQLite database.
 
 # Resources:
@@ -14,6 +15,8 @@
 # https://www.sqlite.org/lang_createtable.html#the_primary_key
 # https://stackoverflow.com/questions/14461851/how-to-have-an-automatic-timestamp-in-sqlite
 # https://www.sqlite.org/docs.html
+# https://www.sqlite.org/wal.html
+# https://docs.python-requests.org/en/latest/user/advanced/#session-objects
 
 
 
@@ -22,9 +25,11 @@ import requests
 import re
 import time
 import json
-import os
 import sqlite3
+import threading
 from datetime import datetime
+from frontier import CLAIM_BATCH_SIZE, Frontier
+from property_store import init_listings, insert_listings, listing_row
 
 # NOTE: Adjust or shorten if needed; 
 ZIPCODES = [
@@ -39,11 +44,25 @@ ZIPCODES = [
     60696, 60697, 60699, 60701
 ]
 
+# md.dhr.wtf returns the page given after `url=` as markdown, and ScraperAPI
+# parses a Redfin listing into JSON. Both can be pointed at another server
+# (e.g., a local stub) through the functions' arguments.
+MARKDOWN_PROXY_URL = "https://md.dhr.wtf/?url="
+REDFIN_BASE_URL = "https://www.redfin.com"
+SCRAPERAPI_ENDPOINT = "https://api.scraperapi.com/structured/redfin/forsale"
+
 # We only want pages 1 to 9
 # Redfin will only return a maximum of 9 pages, and when we attempt to iterate past that
 # we will be redirected to the first page.
 PAGE_NUMBERS = range(1, 10)
 
+# Number of properties written to the database per transaction
+WRITE_BATCH_SIZE = 50
+
+# One HTTP session for the whole crawl, so connections to md.dhr.wtf and
+# ScraperAPI are kept alive and reused instead of reopened for every request
+session = requests.Session()
+
 
 def init_database(db_path):
     
@@ -75,6 +94,128 @@ def init_database(db_path):
     conn.close()
 
 
+class PropertyWriter:
+    """
+    Long-lived writer for the `properties` table.
+
+    The database is opened once (in WAL mode) and properties are buffered and
+    inserted in transactions of `batch_size` rows, instead of connecting,
+    creating the table and committing for every single property. Every
+    property is also written as a typed row of the `listings` table (see
+    property_store.py). The writer can be shared by several crawler threads.
+    """
+
+    def __init__(self, db_path, batch_size=WRITE_BATCH_SIZE):
+        """
+        Args:
+            db_path (str): The path to the SQLite database file.
+            batch_size (int): Number of properties per transaction.
+        """
+        init_database(db_path)
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        init_listings(self.conn)
+        self.batch_size = batch_size
+        self.pending = []
+        self.stored = 0
+        self.lock = threading.Lock()
+
+    def add(self, details):
+        """
+        Queue a property for insertion, writing the batch once it is full.
+
+        Args:
+            details (dict): Property details
+
+        Returns:
+            bool: False if the property could not be queued (no 'url' or not
+                serialisable), True otherwise.
+        """
+        try:
+            url = details['url']
+            if not isinstance(url, str) or not url:
+                raise ValueError(f"invalid url {url!r}")
+            data = json.dumps(details)
+        except Exception as e:
+            print(f"Error storing property data: {str(e)}")
+            return False
+        try:
+            listing = listing_row(details)
+        except Exception as e:
+            print(f"Error converting property data: {str(e)}")
+            listing = None
+        with self.lock:
+            self.pending.append((url, data, listing))
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+        return True
+
+    def _insert(self, rows):
+        with self.conn:
+            self.conn.executemany('''
+                INSERT OR REPLACE INTO properties (url, data)
+                VALUES (?, ?)
+            ''', [(url, data) for url, data, _ in rows])
+            insert_listings(self.conn, [listing for _, _, listing in rows
+                                        if listing is not None])
+
+    def _flush(self):
+        if not self.pending:
+            return
+        try:
+            self._insert(self.pending)
+            self.stored += len(self.pending)
+        except Exception as e:
+            # Retry the rows one by one, so one bad row doesn't drop the batch
+            print(f"Error storing property data: {str(e)}; retrying one by one")
+            for row in self.pending:
+                try:
+                    self._insert([row])
+                    self.stored += 1
+                except Exception as e:
+                    print(f"Error storing property data for {row[0]}: {str(e)}")
+        self.pending = []
+
+    def flush(self):
+        """
+        Write all queued properties.
+        """
+        with self.lock:
+            self._flush()
+
+    def is_stored(self, url):
+        """
+        Whether a property is already in the database (or queued), with an
+        indexed lookup on the primary key instead of loading every URL.
+
+        Args:
+            url (str): Redfin property URL
+
+        Returns:
+            bool: True if the property is stored.
+        """
+        with self.lock:
+            if any(pending_url == url for pending_url, _, _ in self.pending):
+                return True
+            return self.conn.execute('SELECT 1 FROM properties WHERE url = ?',
+                                     (url,)).fetchone() is not None
+
+    def close(self):
+        """
+        Write the queued properties and close the database.
+        """
+        with self.lock:
+            self._flush()
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 def extract_redfin_urls(content):
     """
     Extract Redfin URLs from markdown content.
@@ -89,10 +230,10 @@ def extract_redfin_urls(content):
     return ['https://redfin.com' + path for path in re.findall(pattern, content)]
 
 
-def scrape_zipcode(zipcode):
+def scrape_zipcode(zipcode, frontier, get=session.get, delay=12, proxy_url=MARKDOWN_PROXY_URL):
     """
     For a given ZIP, fetch pages until we detect a redirect or find all listings.
-    Returns a list of URLs and saves them to a ZIP-specific file. 
+    Returns a list of URLs and adds them to the crawl frontier. 
 
     md.dhr.wtf is a free scraping tool that we utilized to bypass Redfin's bot detection. 
     It returns the Redfin page HTML as markdown. md.dhr.wtf was chosen because it is 
@@ -100,19 +241,16 @@ def scrape_zipcode(zipcode):
 
     Args:
         zipcode (int): The ZIP code to scrape.
+        frontier (Frontier): The crawl frontier the URLs are added to.
+        get (function): Function used for HTTP GET requests (default the shared session).
+        delay (float): Seconds to sleep between pages to respect rate limits.
+        proxy_url (str): URL of the markdown proxy, followed by the Redfin URL.
 
     Outputs:
-        urls_file (str): The filename containing the URLs.
         all_urls (list): A list of all URLs found.
 
     """
     all_urls = set()
-    urls_file = f"urls_{zipcode}.txt"
-    
-    # Load existing URLs if file exists
-    if os.path.exists(urls_file):
-        with open(urls_file, 'r') as f:
-            all_urls.update(line.strip() for line in f)
     
     # Keep track of previous page's URLs
     previous_page_urls = set()  
@@ -123,14 +261,14 @@ def scrape_zipcode(zipcode):
         # add the redfin URL to the end of the md.dhr.wtf URL.
         if page == 1:
             # The first page of a Redfin search page does not have a page number in the URL
-            url = f"https://md.dhr.wtf/?url=https://www.redfin.com/zipcode/{zipcode}"
+            url = f"{proxy_url}{REDFIN_BASE_URL}/zipcode/{zipcode}"
         else:
             # Subsequent URLs have the page number in the URL
-            url = f"https://md.dhr.wtf/?url=https://www.redfin.com/zipcode/{zipcode}/page-{page}"
+            url = f"{proxy_url}{REDFIN_BASE_URL}/zipcode/{zipcode}/page-{page}"
         
         print(f"\nFetching {url}")
         try:
-            response = requests.get(url)
+            response = get(url)
             response.raise_for_status()
             content = response.text
             
@@ -150,14 +288,12 @@ def scrape_zipcode(zipcode):
             # Store current page URLs for next iteration's comparison
             previous_page_urls = current_page_urls
             
-            # Add new URLs to our set
-            new_urls = current_page_urls - all_urls
+            # Add new URLs to our set and to the frontier (URLs discovered by an
+            # earlier crawl are already in it)
+            all_urls.update(current_page_urls)
+            new_urls = frontier.add(current_page_urls, zipcode)
             if new_urls:
-                all_urls.update(new_urls)
-                with open(urls_file, 'a') as f:
-                    for url in new_urls:
-                        f.write(url + '\n')
-                print(f"Found {len(new_urls)} new URLs on page {page}")
+                print(f"Found {new_urls} new URLs on page {page}")
             else:
                 print("No new URLs found on this page")
             
@@ -173,84 +309,122 @@ def scrape_zipcode(zipcode):
                 break
             
             # Sleep to respect rate limits
-            time.sleep(12)
+            time.sleep(delay)
             
         except Exception as e:
             print(f"Error fetching {url}: {str(e)}")
             continue
     
     print(f"\nFound {len(all_urls)} total unique URLs in {zipcode}")
-    return urls_file, list(all_urls)
+    return list(all_urls)
 
 
-def process_property_urls(api_key, input_file, db_path='redfin_properties.db'):
+def process_property_urls(api_key, frontier, zipcode=None, db_path='redfin_properties.db',
+                          get=session.get, delay=2, endpoint=SCRAPERAPI_ENDPOINT,
+                          writer=None, batch_size=CLAIM_BATCH_SIZE):
     """
-    Process all Redfin URLs from the input file through ScraperAPI and save to SQLite 
-    database.
+    Process the pending Redfin URLs of the crawl frontier through ScraperAPI and save
+    to SQLite database.
+
+    URLs are claimed in batches, so several threads or processes can process the
+    same frontier without fetching a URL twice. A URL is marked as done once its
+    property is written to the database; a failed fetch is retried by a later call
+    once its retry delay is over (see Frontier.fail), not by this one.
     
     Args:
         api_key (str): ScraperAPI API key
-        input_file (str): File containing Redfin URLs (one per line)
+        frontier (Frontier): The crawl frontier
+        zipcode (int): Only process URLs found in this ZIP code (default any)
         db_path (str): Path to SQLite database file
-    
+        get (function): Function used for HTTP GET requests (default the shared session)
+        delay (float): Seconds to sleep between properties to respect rate limits
+        endpoint (str): ScraperAPI Redfin endpoint
+        writer (PropertyWriter): Open writer for db_path (default: one is opened
+            for this call and closed at the end)
+        batch_size (int): Number of URLs claimed at a time
+
     Returns:
         int: Number of URLs processed
         Updates the SQLite database with property details.
     """
-    if not os.path.exists(input_file):
-        print(f"Input file {input_file} not found")
-        return
-    
-    # Initialize database and create tables
-    init_database(db_path)
-    
-    # Get processed URLs from database
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT url FROM properties')
-    processed_urls = {row[0] for row in c.fetchall()}
-    conn.close()
-    
-    # Read and process URLs
-    with open(input_file, 'r') as f:
-        urls = [line.strip() for line in f if line.strip()]
-    
-    total_urls = len(urls)
+    # Open the database once for the whole run
+    own_writer = writer is None
+    if own_writer:
+        writer = PropertyWriter(db_path)
+
     processed_count = 0
-    
-    for url in urls:
-        if url in processed_urls:
-            print(f"Skipping already processed URL: {url}")
-            processed_count += 1
-            continue
-            
-        print(f"Processing: {url} ({processed_count + 1}/{total_urls})")
-        # Here we fetch the property details using the ScraperAPI function 
-        details = fetch_property_details(url, api_key)
-        
-        # If details are found, store them in the database
-        if details:
-            store_property_data(details, db_path)
-            processed_urls.add(url)
-            processed_count += 1
-            
-        # Sleep to respect rate limits
-        time.sleep(2)
-    
-    print(f"Processed {processed_count}/{total_urls} URLs for {input_file}")
+    stored_count = 0
+    failed_count = 0
+    start = time.perf_counter()
+
+    while True:
+        urls = frontier.claim(batch_size, zipcode)
+        if not urls:
+            break
+
+        fetched = []
+        skipped = set()
+        for url in urls:
+            # Indexed lookup instead of a set of every stored URL
+            if writer.is_stored(url):
+                print(f"Skipping already processed URL: {url}")
+                fetched.append(url)
+                skipped.add(url)
+                continue
+
+            print(f"Processing: {url}")
+            # Here we fetch the property details using the ScraperAPI function 
+            try:
+                details = request_property_details(url, api_key, get=get, endpoint=endpoint)
+            except Exception as e:
+                print(f"Error fetching details for {url}: {str(e)}")
+                frontier.fail(url, e)
+                failed_count += 1
+            else:
+                # Store the details in the database
+                if writer.add(details):
+                    fetched.append(url)
+                else:
+                    frontier.fail(url, "invalid property data")
+                    failed_count += 1
+
+            # Sleep to respect rate limits
+            time.sleep(delay)
+
+        # Only mark the URLs as done once their properties are written
+        writer.flush()
+        done = [url for url in fetched if writer.is_stored(url)]
+        frontier.done(done)
+        for url in set(fetched) - set(done):
+            frontier.fail(url, "property was not stored")
+            failed_count += 1
+        processed_count += len(done)
+        # Properties of this call that are actually in the database
+        stored_count += len(set(done) - skipped)
+
+    if own_writer:
+        writer.close()
+    elapsed = time.perf_counter() - start
+
+    where = f"ZIP {zipcode}" if zipcode is not None else "the frontier"
+    print(f"Processed {processed_count} URLs of {where} ({failed_count} failed)")
+    print(f"Stored {stored_count} properties in {elapsed:.1f}s "
+          f"({stored_count / elapsed if elapsed > 0 else 0:.2f} properties/sec)")
     return processed_count
 
 
-def fetch_property_details(url, api_key):
+def request_property_details(url, api_key, get=session.get, endpoint=SCRAPERAPI_ENDPOINT):
     """
     Fetch detailed property information from ScraperAPI's Redfin endpoint.
     
     Args:
         url (str): Redfin property URL
         api_key (str): ScraperAPI API key
-        
+        get (function): Function used for HTTP GET requests (default the shared session)
+        endpoint (str): ScraperAPI Redfin endpoint
+
     Returns:
-        dict: Property details or None if request fails
+        dict: Property details; raises an exception if the request fails
     """
 
     # Format payload for ScraperAPI
@@ -261,12 +435,28 @@ def fetch_property_details(url, api_key):
         'autoparse': 'true'
     }
     
+    r = get(endpoint, 
+            params=payload, 
+            timeout=30)
+    r.raise_for_status()
+    return r.json()
+
+
+def fetch_property_details(url, api_key, get=session.get, endpoint=SCRAPERAPI_ENDPOINT):
+    """
+    Fetch detailed property information from ScraperAPI's Redfin endpoint.
+    
+    Args:
+        url (str): Redfin property URL
+        api_key (str): ScraperAPI API key
+        get (function): Function used for HTTP GET requests (default the shared session)
+        endpoint (str): ScraperAPI Redfin endpoint
+
+    Returns:
+        dict: Property details or None if request fails
+    """
     try:
-        r = requests.get('https://api.scraperapi.com/structured/redfin/forsale', 
-                        params=payload, 
-                        timeout=30)
-        r.raise_for_status()
-        return r.json()
+        return request_property_details(url, api_key, get=get, endpoint=endpoint)
     except Exception as e:
         print(f"Error fetching details for {url}: {str(e)}")
         return None
@@ -275,12 +465,15 @@ def fetch_property_details(url, api_key):
 def store_property_data(details, db_path):
     """
     Store property data in SQLite database.
-    
+
+    Opens the database for a single property; use PropertyWriter to store many.
+
     Args:
         details (dict): Property details
         db_path (str): Path to SQLite database file
     """
-    conn = sqlite3.connect(db_path)
+    # Wait (up to 30 s) instead of failing if another crawler thread is writing
+    conn = sqlite3.connect(db_path, timeout=30)
     c = conn.cursor()
     
     try:
@@ -313,35 +506,32 @@ def store_property_data(details, db_path):
 def main():
     api_key = ''
     
-    # Create directories to store URLs
-    os.makedirs("urls", exist_ok=True)
-    os.makedirs("urls/processed", exist_ok=True)
-    
-    # Initialize database at startup
-    init_database('redfin_properties.db')
-    
+    # Open the database and its crawl frontier once at startup
+    writer = PropertyWriter('redfin_properties.db')
+    frontier = Frontier('redfin_properties.db')
+
     total_processed = 0
     
     for zc in ZIPCODES:
         print(f"\n====== Working on ZIP: {zc} ======")
-        urls_file, urls = scrape_zipcode(zc)
+        urls = scrape_zipcode(zc, frontier)
 
         if urls:
             print(f"Found {len(urls)} URLs in {zc}. Starting processing...")
             
-            processed = process_property_urls(api_key, urls_file)
+            processed = process_property_urls(api_key, frontier, zc, writer=writer)
             total_processed += processed
-            
-            # Move processed file to a 'processed' directory
-            try:
-                os.rename(urls_file, f"urls/processed/{urls_file}")
-                print(f"Moved {urls_file} to processed directory")
-            except Exception as e:
-                print(f"Error moving file: {str(e)}")
         else:
             print(f"No listings found for ZIP {zc}.")
-    
+
+    # URLs left by an earlier, interrupted crawl, or whose fetch failed and whose
+    # retry delay is over
+    total_processed += process_property_urls(api_key, frontier, writer=writer)
+
+    writer.close()
     print(f"\nTotal URLs processed across all ZIP codes: {total_processed}")
+    print(f"Frontier: {frontier.counts()}")
+    frontier.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,405 @@
+# This file contains a point-query scoring API over the amenity and crime
+# data: for any latitude / longitude (or a batch of them), it returns the
+# nearby-amenity and crime columns that process_and_combine.process_data
+# computes for the houses of summary_redfin.csv, without rerunning it.
+
+# The input tables are loaded and indexed once when the scorer is created
+# (spatial indexes of the amenities, the crime aggregator, and optionally the
+# date-sorted crimes), so a query only runs the radius searches of the new
+# points. The feature vectors of the most recently scored coordinates are
+# kept in an LRU cache.
+
+# With an index directory (--index-dir), the indexed tables are saved there
+# the first time, with their large arrays as .npy files, and later starts
+# memory-map them instead of reading the input files and indexing them
+# again. They are rebuilt when an input file or a crime setting changes.
+
+# The scorer can also be served over HTTP (from data/):
+#   python scoring.py --port 8000
+#   curl "http://127.0.0.1:8000/score?lat=41.8781&lon=-87.6298"
+#   curl -X POST -d '{"lat": [41.88, 41.79], "lon": [-87.63, -87.60]}' http://127.0.0.1:8000/score
+
+# Resource:
+    # 1) https://docs.python.org/3/library/http.server.html
+    # 2) https://docs.python.org/3/library/collections.html#collections.OrderedDict
+
+import argparse
+import glob
+import json
+import math
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+from features import (
+    DEFAULT_MAX_MEMORY_MB,
+    TEMPORAL_GROUP,
+    all_feature_columns,
+    feature_groups,
+    group_features,
+    prepare_table
+)
+from shard_executor import SharedArrayPickler
+from util import source_hash
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+
+# Largest batch accepted by one HTTP request
+MAX_BATCH = 100000
+
+# Files of an index directory
+INDEX_MANIFEST_FILE = "manifest.json"
+INDEX_TABLES_FILE = "tables.pkl"
+
+
+def load_prepared_tables(index_dir, key):
+    """
+    Indexed tables saved by save_prepared_tables, if they were saved with
+    the same key.
+
+    Inputs:
+      index_dir (str): The index directory.
+      key (dict): Hashes of the input files and the crime settings.
+
+    Returns:
+      dict of indexed tables (arrays memory-mapped), or None if missing or
+      out of date.
+    """
+    manifest_path = os.path.join(index_dir, INDEX_MANIFEST_FILE)
+    tables_path = os.path.join(index_dir, INDEX_TABLES_FILE)
+    if not (os.path.exists(manifest_path) and os.path.exists(tables_path)):
+        return None
+    with open(manifest_path, "r") as f:
+        if json.load(f).get("key") != key:
+            return None
+    with open(tables_path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_prepared_tables(index_dir, tables, key):
+    """
+    Save indexed tables (see PointScorer.tables), with their large arrays as
+    .npy files (see shard_executor.SharedArrayPickler).
+    """
+    index_dir = os.path.abspath(index_dir)
+    os.makedirs(index_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(index_dir, "array_*.npy")):
+        os.remove(path)
+    with open(os.path.join(index_dir, INDEX_TABLES_FILE), "wb") as f:
+        SharedArrayPickler(f, index_dir).dump(tables)
+    with open(os.path.join(index_dir, INDEX_MANIFEST_FILE), "w") as f:
+        json.dump({"key": key}, f, indent=4)
+
+
+class PointScorer:
+    """
+    Feature vectors of arbitrary points, from input tables indexed once.
+
+    Thread-safe: the indexes are only read, and the cache is behind a lock.
+    """
+
+    def __init__(self, tables, radius_km=1.0, cache_size=DEFAULT_CACHE_SIZE,
+                 max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+        """
+        Index the input tables.
+
+        Inputs:
+          tables (dict): Input table of every feature group, as returned by
+                         process_and_combine.load_input_tables (plus a
+                         TemporalCrimeIndex under TEMPORAL_GROUP, if any).
+          radius_km (float or list of float): Search radius (or radii) in
+                                              kilometers, as in process_data.
+          cache_size (int): Number of coordinates kept in the LRU cache (0 to
+                            not cache).
+          max_memory_mb (float): Memory cap for one chunk of neighbour pairs.
+        """
+        self.radius_km = radius_km
+        self.cache_size = cache_size
+        self.max_memory_mb = max_memory_mb
+        self.groups = feature_groups(tables)
+        self.tables = {group: prepare_table(group, tables[group]) for group in self.groups}
+        self.columns = all_feature_columns(radius_km, self.tables)
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_data(cls, radius_km=1.0, cache_size=DEFAULT_CACHE_SIZE,
+                  max_memory_mb=DEFAULT_MAX_MEMORY_MB, columnar_dir=None,
+                  crime_store_dir=None, crime_windows_days=None, crime_half_lives_days=None,
+                  index_dir=None):
+        """
+        Load the input tables from the data directories under the current
+        working directory (see process_and_combine.load_input_tables) and
+        index them, or load the indexed tables from index_dir.
+
+        Inputs:
+          radius_km, cache_size, max_memory_mb: see __init__.
+          columnar_dir, crime_store_dir, crime_windows_days,
+          crime_half_lives_days: see process_and_combine.process_data; reuse
+                                 its prebuilt caches to start faster. With the
+                                 default crime_store_dir=None, the features
+                                 are the same as process_data's.
+          index_dir (str): Directory where the indexed tables are saved and
+                           loaded from (None to index them every time).
+
+        Returns:
+          PointScorer
+        """
+        # Imported here, as it pulls in the whole pipeline
+        from process_and_combine import input_source_files, load_crime_time, load_input_tables
+
+        if index_dir is not None:
+            key = {"sources": {group: source_hash(path)
+                               for group, path in input_source_files().items()},
+                   "crime_store": crime_store_dir is not None,
+                   "crime_windows_days": list(crime_windows_days or []),
+                   "crime_half_lives_days": list(crime_half_lives_days or [])}
+            tables = load_prepared_tables(index_dir, key)
+            if tables is not None:
+                return cls(tables, radius_km, cache_size, max_memory_mb)
+
+        tables, _, load_crime = load_input_tables(columnar_dir, crime_store_dir)
+        tables[TEMPORAL_GROUP] = load_crime_time(load_crime, crime_windows_days,
+                                                 crime_half_lives_days)
+        scorer = cls(tables, radius_km, cache_size, max_memory_mb)
+        if index_dir is not None:
+            save_prepared_tables(index_dir, scorer.tables, key)
+        return scorer
+
+    def compute(self, lat, lon):
+        """
+        Feature columns of some points, without the cache.
+
+        Returns:
+          DataFrame: One row per point with the columns of `columns`.
+        """
+        features = pd.concat([group_features(group, self.tables[group], lat, lon,
+                                             self.radius_km, self.max_memory_mb)
+                              for group in self.groups], axis=1)
+        return features[self.columns]
+
+    def score_batch(self, lat, lon):
+        """
+        Feature vectors of many points; only the coordinates missing from the
+        cache are computed, together in one batch.
+
+        Inputs:
+          lat, lon (array-like): Coordinates of the points.
+
+        Returns:
+          DataFrame: One row per point with the same feature columns (and,
+                     for the same input tables, values) as summary_redfin.csv.
+        """
+        lat = np.asarray(lat, dtype=float).ravel()
+        lon = np.asarray(lon, dtype=float).ravel()
+        if len(lat) != len(lon):
+            raise ValueError("lat and lon must have the same length")
+
+        keys = list(zip(lat.tolist(), lon.tolist()))
+        rows = [None] * len(keys)
+        missing = {}
+        with self.lock:
+            for i, key in enumerate(keys):
+                row = self.cache.get(key)
+                if row is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self.cache.move_to_end(key)
+                    rows[i] = row
+            self.hits += len(keys) - sum(len(positions) for positions in missing.values())
+            self.misses += len(missing)
+
+        if missing:
+            new_keys = list(missing)
+            features = self.compute(np.array([key[0] for key in new_keys]),
+                                    np.array([key[1] for key in new_keys]))
+            new_rows = list(features.itertuples(index=False, name=None))
+            for key, row in zip(new_keys, new_rows):
+                for i in missing[key]:
+                    rows[i] = row
+            if self.cache_size > 0:
+                with self.lock:
+                    for key, row in zip(new_keys, new_rows):
+                        self.cache[key] = row
+                        self.cache.move_to_end(key)
+                    while len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+
+        return pd.DataFrame(rows, columns=self.columns)
+
+    def score(self, lat, lon):
+        """
+        Feature vector of a single point.
+
+        Returns:
+          dict: Column name -> value, e.g., {'num_restaurants': 51, ...}.
+        """
+        return self.score_batch([lat], [lon]).iloc[0].to_dict()
+
+    def cache_info(self):
+        """
+        Cache hits, misses, current size and maximum size.
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self.cache), "max_size": self.cache_size}
+
+    def clear_cache(self):
+        with self.lock:
+            self.cache.clear()
+            self.hits = self.misses = 0
+
+
+def _json_value(value):
+    """
+    A feature value as a JSON value (NaN / None as null, numpy scalars as numbers).
+    """
+    if value is None:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _coordinates(values, name):
+    """
+    Parse a coordinate or a list of coordinates of a request.
+
+    Returns:
+      np array of float; raises ValueError if a value is not a valid coordinate.
+    """
+    values = np.atleast_1d(np.asarray(values, dtype=float))
+    if values.ndim != 1 or len(values) == 0:
+        raise ValueError(f"'{name}' must be a number or a non-empty list of numbers")
+    limit = 90 if name == "lat" else 180
+    if not np.all(np.abs(values) <= limit):
+        raise ValueError(f"'{name}' must be between -{limit} and {limit}")
+    return values
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """
+    HTTP endpoints of the scorer of the server (self.server.scorer):
+      GET  /health                   -> cache statistics and feature columns
+      GET  /score?lat=...&lon=...    -> {"features": {...}}
+      POST /score {"lat": [...], "lon": [...]} -> {"features": [{...}, ...]}
+    """
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_features(self, lat, lon, single):
+        try:
+            lat, lon = _coordinates(lat, "lat"), _coordinates(lon, "lon")
+        except (TypeError, ValueError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        if len(lat) != len(lon):
+            self.send_json(400, {"error": "'lat' and 'lon' must have the same length"})
+            return
+        if len(lat) > MAX_BATCH:
+            self.send_json(413, {"error": f"at most {MAX_BATCH} points per request"})
+            return
+        features = self.server.scorer.score_batch(lat, lon)
+        records = [{col: _json_value(value) for col, value in zip(features.columns, row)}
+                   for row in features.itertuples(index=False, name=None)]
+        self.send_json(200, {"features": records[0] if single else records})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            self.send_json(200, {"status": "ok", "columns": self.server.scorer.columns,
+                                 "cache": self.server.scorer.cache_info()})
+        elif url.path == "/score":
+            query = parse_qs(url.query)
+            if "lat" not in query or "lon" not in query:
+                self.send_json(400, {"error": "'lat' and 'lon' query parameters are required"})
+                return
+            single = len(query["lat"]) == 1 and len(query["lon"]) == 1
+            self.send_features(query["lat"], query["lon"], single)
+        else:
+            self.send_json(404, {"error": f"unknown path {url.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/score":
+            self.send_json(404, {"error": f"unknown path {url.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": "the body must be JSON"})
+            return
+        if not isinstance(body, dict) or "lat" not in body or "lon" not in body:
+            self.send_json(400, {"error": "the body must have 'lat' and 'lon'"})
+            return
+        single = np.ndim(body["lat"]) == 0 and np.ndim(body["lon"]) == 0
+        self.send_features(body["lat"], body["lon"], single)
+
+
+def make_server(scorer, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    A threaded HTTP server for a scorer (call serve_forever() to start it).
+    """
+    server = ThreadingHTTPServer((host, port), ScoringHandler)
+    server.scorer = scorer
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the features of any location")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--radius", type=float, nargs="+", default=[1.0],
+                        help="search radius in km, or several radii (default 1)")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--crime-windows", type=float, nargs="*",
+                        help="time windows in days of the crime counts, e.g., 30 90 365")
+    parser.add_argument("--crime-half-lives", type=float, nargs="*",
+                        help="half-lives in days of the time-decayed crime counts")
+    parser.add_argument("--max-memory-mb", type=float, default=DEFAULT_MAX_MEMORY_MB,
+                        help="memory cap for the neighbour pairs of one batch")
+    parser.add_argument("--crime-store", action="store_true",
+                        help="use the compact crime store of process_and_combine.py "
+                             "--crime-store (float32 coordinates)")
+    parser.add_argument("--index-dir", default="scoring_index",
+                        help="directory of the saved indexed tables (default scoring_index)")
+    args = parser.parse_args()
+
+    # Same caches as process_and_combine.py, so the inputs load quickly
+    radius_km = args.radius[0] if len(args.radius) == 1 else args.radius
+    crime_store_dir = os.path.join(os.getcwd(), "crime_store") if args.crime_store else None
+    scorer = PointScorer.from_data(radius_km, args.cache_size, args.max_memory_mb,
+                                   columnar_dir=os.path.join(os.getcwd(), "columnar_cache"),
+                                   crime_store_dir=crime_store_dir,
+                                   crime_windows_days=args.crime_windows,
+                                   crime_half_lives_days=args.crime_half_lives,
+                                   index_dir=os.path.join(os.getcwd(), args.index_dir))
+    server = make_server(scorer, args.host, args.port)
+    print(f"Serving {len(scorer.columns)} features on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
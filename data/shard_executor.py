@@ -0,0 +1,159 @@
+# This file contains a multiprocessing executor for the feature engine in
+# features.py. The houses are split into contiguous shards that are handled
+# by a pool of worker processes, and the per-shard feature columns are
+# concatenated back in order. Every house's features only depend on its own
+# neighbour pairs, so the result is identical to the serial path.
+
+# The input tables are not pickled to every task. When the executor starts,
+# the spatial indexes / crime aggregators are built once in the parent and
+# pickled to a temporary directory, with every large numeric array (the
+# coordinates, the sorted grid cells, the crime type codes...) written to its
+# own .npy file instead. Each worker unpickles the tables once, and the arrays
+# are opened with np.load(..., mmap_mode='r'), so all workers share the same
+# pages of the OS page cache instead of holding their own copies.
+
+# Resource:
+    # 1) https://docs.python.org/3/library/multiprocessing.html#module-multiprocessing.pool
+    # 2) https://docs.python.org/3/library/pickle.html#custom-reduction-for-types-functions-and-other-objects
+    # 3) https://numpy.org/doc/stable/reference/generated/numpy.load.html
+
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from features import DEFAULT_MAX_MEMORY_MB, group_features, prepare_table
+
+# Number of shards per worker, so a slow shard does not hold up the others
+SHARDS_PER_WORKER = 4
+
+# Arrays smaller than this are pickled as usual
+MIN_SHARED_BYTES = 1 << 16
+
+# Input tables of the worker process, set by _init_worker
+_worker_tables = None
+
+
+def _load_shared(path):
+    """
+    Open an array written by SharedArrayPickler as a read-only memory map.
+    """
+    return np.load(path, mmap_mode="r")
+
+
+class SharedArrayPickler(pickle.Pickler):
+    """
+    Pickler that writes large numeric arrays to .npy files in array_dir and
+    only pickles their paths. An array referenced several times (e.g., by
+    an index and its DataFrame) is written once.
+    """
+
+    def __init__(self, file, array_dir, min_bytes=MIN_SHARED_BYTES):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.array_dir = array_dir
+        self.min_bytes = min_bytes
+        self.n_arrays = 0
+
+    def reducer_override(self, obj):
+        if (not isinstance(obj, np.ndarray) or obj.dtype.hasobject
+                or obj.nbytes < self.min_bytes):
+            return NotImplemented
+        path = os.path.join(self.array_dir, f"array_{self.n_arrays}.npy")
+        self.n_arrays += 1
+        np.save(path, np.asarray(obj))
+        return _load_shared, (path,)
+
+
+def _init_worker(tables_path):
+    """
+    Load the shared input tables once per worker process.
+    """
+    global _worker_tables
+    with open(tables_path, "rb") as f:
+        _worker_tables = pickle.load(f)
+
+
+def _shard_features(task):
+    """
+    Compute the columns of one feature group for one shard of houses.
+    """
+    group, house_lat, house_lon, radius_km, max_memory_mb = task
+    return group_features(group, _worker_tables[group], house_lat, house_lon,
+                          radius_km, max_memory_mb)
+
+
+class ShardExecutor:
+    """
+    A pool of worker processes computing feature groups for shards of houses.
+
+    Use it as a context manager, so the pool and the temporary directory of
+    shared arrays are cleaned up:
+
+        with ShardExecutor(tables, workers=4) as executor:
+            df = executor.group_features("crime", lat, lon, radius_km=1.0)
+    """
+
+    def __init__(self, tables, workers, shards_per_worker=SHARDS_PER_WORKER):
+        """
+        Build the input tables' indexes and share them with a new worker pool.
+
+        Inputs:
+          tables (dict): Input table of every feature group (a DataFrame, or
+                         its index / CrimeAggregator / CrimeStore /
+                         TemporalCrimeIndex); groups with a None table are skipped.
+          workers (int): Number of worker processes.
+          shards_per_worker (int): Number of shards the houses are split into,
+                                   per worker.
+        """
+        self.workers = workers
+        self.n_shards = workers * shards_per_worker
+        self.tables = {group: prepare_table(group, table)
+                       for group, table in tables.items() if table is not None}
+
+        self.array_dir = tempfile.mkdtemp(prefix="feature_shards_")
+        tables_path = os.path.join(self.array_dir, "tables.pkl")
+        with open(tables_path, "wb") as f:
+            SharedArrayPickler(f, self.array_dir).dump(self.tables)
+        self.pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                         initargs=(tables_path,))
+
+    def group_features(self, group, house_lat, house_lon, radius_km=1.0,
+                       max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+        """
+        Same result as features.group_features for the shared table of `group`.
+
+        Inputs:
+          group (str): The feature group.
+          house_lat, house_lon (np array): Coordinates of the houses.
+          radius_km (float or list of float): Search radius (or radii) in kilometers.
+          max_memory_mb (float): Memory cap for the neighbour pairs of all
+                                 workers together (split evenly between them).
+
+        Returns:
+          DataFrame: One row per house, in the order of house_lat / house_lon.
+        """
+        house_lat = np.asarray(house_lat, dtype=float)
+        house_lon = np.asarray(house_lon, dtype=float)
+        shards = [shard for shard in np.array_split(np.arange(len(house_lat)), self.n_shards)
+                  if len(shard)]
+        if len(shards) <= 1:
+            return group_features(group, self.tables[group], house_lat, house_lon,
+                                  radius_km, max_memory_mb)
+
+        worker_memory_mb = max_memory_mb / self.workers
+        tasks = [(group, house_lat[shard], house_lon[shard], radius_km, worker_memory_mb)
+                 for shard in shards]
+        return pd.concat(self.pool.map(_shard_features, tasks), ignore_index=True)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        shutil.rmtree(self.array_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,368 @@
+# This file contains a grid-bucketed spatial index used to answer radius
+# queries ("which amenities / crimes are within r km of this house?")
+# without computing the distance from every house to every point.
+
+# Points are bucketed into lat/lng cells roughly `cell_km` wide. A radius
+# query only looks at the cells that can possibly contain a match, and then
+# uses the exact same haversine_distance as the brute-force helpers in
+# util.py, so the results are identical to a full scan.
+
+# Resource:
+    # 1) https://en.wikipedia.org/wiki/Haversine_formula
+    # 2) https://numpy.org/doc/stable/reference/generated/numpy.searchsorted.html
+
+import numpy as np
+from util import haversine_distance, EARTH_RADIUS_KM
+
+# Relative padding on the search window so floating point rounding can
+# never drop a point that sits exactly on the radius boundary.
+WINDOW_PADDING = 1e-6
+
+DEFAULT_MAX_MEMORY_MB = 256
+
+# Rough number of bytes needed per neighbour pair while querying (candidate
+# pairs from the grid, their coordinates and the haversine temporaries).
+BYTES_PER_PAIR = 200
+
+# Number of queries in the first chunk, before the pair density is known.
+FIRST_CHUNK_SIZE = 256
+
+
+def _expand_ranges(starts, counts):
+    """
+    Turn a set of [start, start + count) ranges into one flat array of positions.
+
+    Inputs:
+      starts (np array): Start position of every range.
+      counts (np array): Length of every range.
+
+    Returns:
+      np array: The concatenation of all the ranges.
+    """
+    total = counts.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    shift = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return shift + np.arange(total)
+
+
+class SpatialIndex:
+    """
+    A grid index over the coordinates of a DataFrame.
+
+    The index keeps a reference to the DataFrame it was built from (`df`),
+    and every query returns positional row numbers into that DataFrame, so
+    `index.df.iloc[rows]` gives the matching rows in their original order.
+    Rows with a missing latitude or longitude are never returned, which is
+    the same as the brute-force `distances <= radius_km` filter.
+    """
+
+    def __init__(self, df, lat_col="Latitude", lon_col="Longitude", cell_km=1.0):
+        """
+        Build the index once for a DataFrame.
+
+        Inputs:
+          df (DataFrame): The amenity, crime or house DataFrame.
+          lat_col (str): Name of the latitude column.
+          lon_col (str): Name of the longitude column.
+          cell_km (float): Approximate width of a grid cell in km. Queries
+                           are fastest when this is close to the radius used.
+        """
+        self.df = df
+        self.lat_col = lat_col
+        self.lon_col = lon_col
+
+        lat = df[lat_col].to_numpy(dtype=float)
+        lon = df[lon_col].to_numpy(dtype=float)
+        valid = ~(np.isnan(lat) | np.isnan(lon))
+        rows = np.flatnonzero(valid)
+        lat = lat[valid]
+        lon = lon[valid]
+
+        self.max_abs_lat = float(np.abs(lat).max()) if len(lat) else 0.0
+        self.lat_step = np.degrees(cell_km / EARTH_RADIUS_KM)
+        self.lon_step = self.lat_step / max(np.cos(np.radians(self.max_abs_lat)), 1e-6)
+        self.lat0 = float(lat.min()) if len(lat) else 0.0
+        self.lon0 = float(lon.min()) if len(lon) else 0.0
+
+        iy = np.floor((lat - self.lat0) / self.lat_step).astype(np.int64)
+        ix = np.floor((lon - self.lon0) / self.lon_step).astype(np.int64)
+        self.n_y = int(iy.max()) + 1 if len(iy) else 0
+        self.n_x = int(ix.max()) + 1 if len(ix) else 0
+
+        # Sort points by cell (stable, so rows inside a cell stay in order)
+        cells = iy * self.n_x + ix
+        order = np.argsort(cells, kind="stable")
+        self._set_points(cells[order], rows[order], lat[order], lon[order])
+
+    def _set_points(self, sorted_cells, rows, lat, lon):
+        """
+        Keep the points sorted by cell, with the start of every non-empty cell.
+        """
+        self._cell_ids, starts = np.unique(sorted_cells, return_index=True)
+        self._cell_starts = np.append(starts, len(sorted_cells)).astype(np.int64)
+        self._rows = rows
+        self._lat = lat
+        self._lon = lon
+
+    @property
+    def grid(self):
+        """
+        Parameters of the grid, to rebuild the index with from_sorted.
+        """
+        return {"max_abs_lat": self.max_abs_lat, "lat_step": self.lat_step,
+                "lon_step": self.lon_step, "lat0": self.lat0, "lon0": self.lon0,
+                "n_y": self.n_y, "n_x": self.n_x}
+
+    @property
+    def cells(self):
+        """
+        tuple (cell_ids, cell_starts): The non-empty cells, in sorted order,
+        and the position in point_rows where every cell starts (plus the
+        number of points at the end).
+        """
+        return self._cell_ids, self._cell_starts
+
+    @property
+    def point_rows(self):
+        """
+        Positional rows of `df` of the indexed points, in cell order.
+        """
+        if self._rows is None:
+            return np.arange(len(self._lat))
+        return self._rows
+
+    @classmethod
+    def from_sorted(cls, df, grid, cell_ids, cell_starts, lat, lon, rows=None,
+                    lat_col="Latitude", lon_col="Longitude"):
+        """
+        Rebuild an index from its grid and points already sorted by cell
+        (e.g., saved with a crime_store.CrimeStore), without sorting again.
+
+        Inputs:
+          df (DataFrame): The indexed DataFrame.
+          grid (dict): The grid parameters (see grid).
+          cell_ids, cell_starts (np array): The non-empty cells (see cells).
+          lat, lon (np array): Coordinates of the points in cell order; they
+                               can be float32 (e.g., memory-mapped).
+          rows (np array): Positional row in df of every point, or None if
+                           the i-th point is row i of df.
+
+        Returns:
+          SpatialIndex
+        """
+        index = cls.__new__(cls)
+        index.df = df
+        index.lat_col = lat_col
+        index.lon_col = lon_col
+        for name, value in grid.items():
+            setattr(index, name, value)
+        index._cell_ids = cell_ids
+        index._cell_starts = cell_starts
+        index._rows = rows
+        index._lat = lat
+        index._lon = lon
+        return index
+
+    def __len__(self):
+        return len(self._lat)
+
+    def _window(self, query_lat, radius_km):
+        """
+        Number of cells to search on each side of the query cell.
+
+        Every point within radius_km of the query differs from it by at most
+        radius/R radians in latitude, and (from the haversine formula) by at
+        most 2 * asin(sin(radius / 2R) / cos(max_lat)) in longitude.
+        """
+        if len(query_lat) == 0:
+            return 0, 0
+        angle = radius_km / EARTH_RADIUS_KM * (1 + WINDOW_PADDING)
+        max_lat = max(self.max_abs_lat, float(np.nanmax(np.abs(query_lat), initial=0.0)))
+        cos_lat = np.cos(np.radians(max_lat))
+        ratio = np.sin(angle / 2) / cos_lat if cos_lat > 0 else 1.0
+        dlat = np.degrees(angle)
+        dlon = np.degrees(2 * np.arcsin(min(1.0, ratio)))
+        k_y = int(np.ceil(dlat / self.lat_step))
+        k_x = int(np.ceil(dlon / self.lon_step))
+        return k_y, k_x
+
+    def query_pairs(self, query_lat, query_lon, radius_km=1.0):
+        """
+        Find every (query, point) pair within radius_km of each other.
+
+        Inputs:
+          query_lat, query_lon (array-like): Coordinates of the query points
+                                             (e.g., all houses).
+          radius_km (float): Search radius in kilometers.
+
+        Returns:
+          tuple of np arrays (query_idx, rows, distances), sorted by query and
+          then by row. query_idx is the position in the query arrays, rows is
+          the positional row in `df`, and distances are in km.
+        """
+        query_lat = np.asarray(query_lat, dtype=float).ravel()
+        query_lon = np.asarray(query_lon, dtype=float).ravel()
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+        if len(self) == 0 or len(query_lat) == 0:
+            return empty
+
+        valid = ~(np.isnan(query_lat) | np.isnan(query_lon))
+        q_idx = np.flatnonzero(valid)
+        q_iy = np.floor((query_lat[valid] - self.lat0) / self.lat_step).astype(np.int64)
+        q_ix = np.floor((query_lon[valid] - self.lon0) / self.lon_step).astype(np.int64)
+        k_y, k_x = self._window(query_lat[valid], radius_km)
+
+        # Cells of every query's window that are inside the grid (a query can
+        # be outside the grid's bounding box and still reach into it)
+        lo_y = np.maximum(q_iy - k_y, 0)
+        hi_y = np.minimum(q_iy + k_y, self.n_y - 1)
+        lo_x = np.maximum(q_ix - k_x, 0)
+        hi_x = np.minimum(q_ix + k_x, self.n_x - 1)
+        reach = (lo_y <= hi_y) & (lo_x <= hi_x)
+        if not reach.any():
+            return empty
+        q_idx, lo_y, hi_y, lo_x, hi_x = (q_idx[reach], lo_y[reach], hi_y[reach],
+                                          lo_x[reach], hi_x[reach])
+        span_y = int((hi_y - lo_y).max()) + 1
+        span_x = int((hi_x - lo_x).max()) + 1
+
+        found_q = []
+        found_pos = []
+        for dy in range(span_y):
+            iy = lo_y + dy
+            in_y = iy <= hi_y
+            for dx in range(span_x):
+                ix = lo_x + dx
+                inside = in_y & (ix <= hi_x)
+                if not inside.any():
+                    continue
+                cells = iy[inside] * self.n_x + ix[inside]
+                pos = np.minimum(np.searchsorted(self._cell_ids, cells),
+                                 len(self._cell_ids) - 1)
+                starts = self._cell_starts[pos]
+                counts = np.where(self._cell_ids[pos] == cells,
+                                  self._cell_starts[pos + 1] - starts, 0)
+                found_q.append(np.repeat(q_idx[inside], counts))
+                found_pos.append(_expand_ranges(starts, counts))
+
+        if not found_q:
+            return empty
+        cand_q = np.concatenate(found_q)
+        cand_pos = np.concatenate(found_pos)
+
+        # float32 coordinates (see from_sorted) are compared in float64
+        distances = haversine_distance(query_lat[cand_q], query_lon[cand_q],
+                                       self._lat[cand_pos].astype(float),
+                                       self._lon[cand_pos].astype(float))
+        keep = distances <= radius_km
+        cand_q = cand_q[keep]
+        rows = cand_pos[keep] if self._rows is None else self._rows[cand_pos[keep]]
+        distances = distances[keep]
+
+        order = np.lexsort((rows, cand_q))
+        return cand_q[order], rows[order], distances[order]
+
+    def query_radius(self, lat, lon, radius_km=1.0):
+        """
+        Positional rows of `df` within radius_km of a single coordinate.
+
+        Inputs:
+          lat, lon (float): Coordinates of the query point.
+          radius_km (float): Search radius in kilometers.
+
+        Returns:
+          np array: Sorted positional row numbers into `df`.
+        """
+        _, rows, _ = self.query_pairs([lat], [lon], radius_km)
+        return rows
+
+    def iter_pairs(self, query_lat, query_lon, radius_km=1.0,
+                   max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+        """
+        Run query_pairs over chunks of the query points.
+
+        The chunk size adapts to the number of pairs per query seen so far,
+        so that each chunk needs roughly max_memory_mb of memory at most.
+        Every query point belongs to exactly one chunk.
+
+        Inputs:
+          query_lat, query_lon (array-like): Coordinates of the query points.
+          radius_km (float): Search radius in kilometers.
+          max_memory_mb (float): Memory cap for one chunk of pairs.
+
+        Yields:
+          tuple (chunk, query_idx, rows, distances), where chunk is the slice
+          of query points covered and query_idx is relative to chunk.start.
+        """
+        query_lat = np.asarray(query_lat, dtype=float).ravel()
+        query_lon = np.asarray(query_lon, dtype=float).ravel()
+        n_queries = len(query_lat)
+        budget_pairs = max(1, int(max_memory_mb * 1024 * 1024 / BYTES_PER_PAIR))
+
+        start = 0
+        chunk_size = FIRST_CHUNK_SIZE
+        while start < n_queries:
+            chunk = slice(start, min(n_queries, start + chunk_size))
+            query_idx, rows, distances = self.query_pairs(
+                query_lat[chunk], query_lon[chunk], radius_km
+            )
+            yield chunk, query_idx, rows, distances
+
+            # Resize the next chunk from the pair density seen in this one
+            pairs_per_query = max(len(rows) / (chunk.stop - chunk.start), 1.0)
+            chunk_size = max(1, int(budget_pairs / pairs_per_query))
+            start = chunk.stop
+
+    def query_knn(self, query_lat, query_lon, k=5, start_km=1.0):
+        """
+        Find the k nearest points of every query point.
+
+        The search radius starts at start_km and is doubled for the queries
+        that have fewer than k points within it, so a query only looks at the
+        cells around it. Ties in distance are broken by row order.
+
+        Inputs:
+          query_lat, query_lon (array-like): Coordinates of the query points.
+          k (int): Number of neighbours.
+          start_km (float): First search radius in kilometers.
+
+        Returns:
+          tuple of np arrays (query_idx, rows, distances), sorted by query and
+          then by distance. Every query gets min(k, len(index)) neighbours
+          (none if its coordinates are missing).
+        """
+        query_lat = np.asarray(query_lat, dtype=float).ravel()
+        query_lon = np.asarray(query_lon, dtype=float).ravel()
+        pending = np.flatnonzero(~(np.isnan(query_lat) | np.isnan(query_lon)))
+        k = min(k, len(self))
+        # No two points are further apart than half the Earth's circumference
+        max_km = np.pi * EARTH_RADIUS_KM
+
+        found_q, found_rows, found_dist = [], [], []
+        radius_km = start_km
+        while len(pending) and k > 0:
+            query_idx, rows, distances = self.query_pairs(query_lat[pending],
+                                                          query_lon[pending], radius_km)
+            counts = np.bincount(query_idx, minlength=len(pending))
+            done = (counts >= k) | (radius_km >= max_km)
+            keep = done[query_idx]
+            found_q.append(pending[query_idx[keep]])
+            found_rows.append(rows[keep])
+            found_dist.append(distances[keep])
+            pending = pending[~done]
+            radius_km = min(radius_km * 2, max_km)
+
+        if not found_q:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        query_idx = np.concatenate(found_q)
+        rows = np.concatenate(found_rows)
+        distances = np.concatenate(found_dist)
+
+        # Keep the k closest of every query
+        order = np.lexsort((rows, distances, query_idx))
+        query_idx, rows, distances = query_idx[order], rows[order], distances[order]
+        starts = np.searchsorted(query_idx, query_idx, side="left")
+        rank = np.arange(len(query_idx)) - starts
+        keep = rank < k
+        return query_idx[keep], rows[keep], distances[keep]
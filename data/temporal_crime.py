@@ -0,0 +1,165 @@
+# This file contains the time-windowed and time-decayed crime features, e.g.,
+# the number of crimes within 1 km of a house in the last 30 / 90 / 365 days,
+# or a count where every crime is weighted by 0.5 ** (age / half-life).
+
+# The crimes are sorted by date once, so the crimes of any window that ends
+# at the reference date are one contiguous range of rows [start, end), found
+# with np.searchsorted. A single radius query per house then gives every
+# window: a (house, crime) pair is in a window iff its row is >= the window's
+# start row, so adding windows only adds integer comparisons and a bincount,
+# not another spatial query. Decay weights are computed once per crime.
+
+# Resource:
+    # 1) https://numpy.org/doc/stable/reference/generated/numpy.searchsorted.html
+    # 2) https://en.wikipedia.org/wiki/Exponential_decay#Half-life
+
+import numpy as np
+import pandas as pd
+from spatial_index import SpatialIndex, DEFAULT_MAX_MEMORY_MB
+from util import VIOLENT_CRIME_TYPES, as_radius_list, radius_label
+
+DEFAULT_WINDOWS_DAYS = (30, 90, 365)
+
+
+def days_label(days):
+    """
+    Short label for a number of days used in column names, e.g., 90 -> '90d'.
+    """
+    return f"{float(days):g}d"
+
+
+class TemporalCrimeIndex:
+    """
+    Crime incidents sorted by date, with the row ranges of the time windows.
+
+    Ages are measured back from `reference_date` (by default the date of the
+    latest crime, i.e., the end of the fetched data). Crimes without a date
+    or coordinates, and crimes after the reference date, are left out.
+    """
+
+    def __init__(self, crime_df, windows_days=DEFAULT_WINDOWS_DAYS, half_lives_days=(),
+                 reference_date=None, date_col="date"):
+        """
+        Sort the crimes by date and index their coordinates once.
+
+        Inputs:
+          crime_df (DataFrame): Crime incidents with 'Latitude', 'Longitude',
+                                'primary_type' and date_col columns.
+          windows_days (list): Length of each time window in days.
+          half_lives_days (list): Half-life in days of each decayed count.
+          reference_date (str or Timestamp): End of the windows (default the
+                                             date of the latest crime).
+          date_col (str): Name of the date column.
+        """
+        dates = pd.to_datetime(crime_df[date_col], errors="coerce").to_numpy("datetime64[ns]")
+        lat = pd.to_numeric(crime_df["Latitude"], errors="coerce").to_numpy(dtype=float)
+        lon = pd.to_numeric(crime_df["Longitude"], errors="coerce").to_numpy(dtype=float)
+        valid = ~(np.isnat(dates) | np.isnan(lat) | np.isnan(lon))
+        if reference_date is None:
+            reference_date = dates[valid].max() if valid.any() else np.datetime64("NaT")
+        self.reference_date = pd.Timestamp(reference_date)
+        valid &= dates <= self.reference_date.to_datetime64()
+
+        rows = np.flatnonzero(valid)
+        order = rows[np.argsort(dates[rows], kind="stable")]
+        self.dates = dates[order]
+        self.df = pd.DataFrame({"Latitude": lat[order], "Longitude": lon[order]})
+        self.index = SpatialIndex(self.df)
+        types = crime_df["primary_type"].to_numpy(dtype=object)[order]
+        self.is_violent = np.isin(types, list(VIOLENT_CRIME_TYPES))
+
+        self.windows_days = [float(w) for w in windows_days]
+        self.half_lives_days = [float(h) for h in half_lives_days]
+        age_days = ((self.reference_date.to_datetime64() - self.dates)
+                    / np.timedelta64(1, "D"))
+        self.window_starts = {
+            w: int(np.searchsorted(self.dates, (self.reference_date
+                                                - pd.Timedelta(days=w)).to_datetime64(),
+                                   side="left"))
+            for w in self.windows_days
+        }
+        self.decay_weights = {h: 0.5 ** (age_days / h) for h in self.half_lives_days}
+
+    @property
+    def settings(self):
+        """
+        Everything the features depend on besides the crime data (used by the
+        feature cache to tell whether cached columns are still valid).
+        """
+        return {"windows_days": self.windows_days, "half_lives_days": self.half_lives_days,
+                "reference_date": self.reference_date.isoformat()}
+
+    @property
+    def columns(self):
+        """
+        Names of the feature columns, in order.
+        """
+        columns = []
+        for w in self.windows_days:
+            columns += [f"num_crimes_{days_label(w)}", f"violent_crime_count_{days_label(w)}"]
+        for h in self.half_lives_days:
+            columns += [f"crime_decay_{days_label(h)}", f"violent_crime_decay_{days_label(h)}"]
+        return columns
+
+    def features(self, house_lat, house_lon, radius_km=1.0,
+                 max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+        """
+        Windowed and decayed crime counts for all houses in one batched call.
+
+        Inputs:
+          house_lat, house_lon (np array): Coordinates of all houses.
+          radius_km (float or list of float): Search radius in kilometers. A
+                     list of radii is answered from a single search at the largest one.
+          max_memory_mb (float): Memory cap for one chunk of pairs.
+
+        Returns:
+          DataFrame: One row per house with the columns of `columns` (suffixed
+                     per radius for a list of radii, e.g., 'num_crimes_90d_500m').
+        """
+        radii = as_radius_list(radius_km)
+        n_houses = len(house_lat)
+        values = {r: {col: np.zeros(n_houses) for col in self.columns} for r in radii}
+
+        for chunk, house_idx, rows, distances in self.index.iter_pairs(
+                house_lat, house_lon, max(radii), max_memory_mb):
+            n_chunk = chunk.stop - chunk.start
+            violent = self.is_violent[rows]
+            for r in radii:
+                within = distances <= r
+                for w, start in self.window_starts.items():
+                    recent = within & (rows >= start)
+                    values[r][f"num_crimes_{days_label(w)}"][chunk] = np.bincount(
+                        house_idx[recent], minlength=n_chunk)
+                    values[r][f"violent_crime_count_{days_label(w)}"][chunk] = np.bincount(
+                        house_idx[recent & violent], minlength=n_chunk)
+                for h, weights in self.decay_weights.items():
+                    nearby_weights = weights[rows]
+                    values[r][f"crime_decay_{days_label(h)}"][chunk] = np.bincount(
+                        house_idx[within], weights=nearby_weights[within], minlength=n_chunk)
+                    values[r][f"violent_crime_decay_{days_label(h)}"][chunk] = np.bincount(
+                        house_idx[within & violent], weights=nearby_weights[within & violent],
+                        minlength=n_chunk)
+
+        for r in radii:
+            for col in values[r]:
+                if col.startswith(("num_crimes_", "violent_crime_count_")):
+                    values[r][col] = values[r][col].astype(np.int64)
+
+        if np.ndim(radius_km) == 0:
+            return pd.DataFrame(values[radii[0]])
+        return pd.DataFrame({f"{col}_{radius_label(r)}": vals
+                             for r in radii for col, vals in values[r].items()})
+
+    def summary(self, house_lat, house_lon, radius_km=1.0):
+        """
+        Windowed and decayed crime counts for a single house.
+
+        Returns:
+          dict: The value of every column of `columns` (a dict per radius if a
+                list of radii is given).
+        """
+        features = self.features([house_lat], [house_lon], radius_km)
+        if np.ndim(radius_km) == 0:
+            return {col: features[col].iloc[0] for col in self.columns}
+        return {r: {col: features[f"{col}_{radius_label(r)}"].iloc[0] for col in self.columns}
+                for r in as_radius_list(radius_km)}
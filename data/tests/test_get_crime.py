@@ -0,0 +1,109 @@
+# Tests of the paged crime ingest of crime_data/get_crime.py, against a stub
+# of the SoQL endpoint (no network).
+# Run from data/:  python -m pytest -q tests
+
+import json
+import os
+import sys
+from datetime import datetime
+
+DATA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DATA_DIR)
+sys.path.insert(0, os.path.join(DATA_DIR, "crime_data"))
+
+import get_crime
+from util import source_hash
+
+START, END = datetime(2024, 1, 1), datetime(2024, 1, 8)
+
+
+class StubResponse:
+    def __init__(self, records):
+        self.records = records
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.records
+
+
+def make_records(n, primary_type="THEFT"):
+    return [{"id": str(i), "case_number": f"JA{i:06d}", "date": "2024-01-02T10:00:00",
+             "block": "001XX N STATE ST", "primary_type": primary_type,
+             "description": "OVER $500", "location_description": "STREET",
+             "arrest": False, "domestic": False,
+             "latitude": "41.88", "longitude": "-87.63"} for i in range(n)]
+
+
+def stub_get(records, calls=None):
+    """
+    GET function serving records by $offset/$limit, recording the params.
+    """
+    def get(url, params, timeout):
+        if calls is not None:
+            calls.append(dict(params))
+        offset, limit = params["$offset"], params["$limit"]
+        return StubResponse(records[offset:offset + limit])
+    return get
+
+
+def test_fetch_pages_pages_by_offset():
+    calls = []
+    pages = list(get_crime.fetch_pages(START, END, page_size=3,
+                                       get=stub_get(make_records(7), calls)))
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [call["$offset"] for call in calls] == [0, 3, 6]
+    assert all(call["$order"] == "date, id" for call in calls)
+
+
+def test_fetch_pages_stops_on_empty_page():
+    calls = []
+    pages = list(get_crime.fetch_pages(START, END, page_size=3,
+                                       get=stub_get(make_records(6), calls)))
+    assert [len(page) for page in pages] == [3, 3]
+    assert [call["$offset"] for call in calls] == [0, 3, 6]
+
+
+def test_ingest_writes_part_and_manifest(tmp_path):
+    store_dir = str(tmp_path / "store")
+    rows = get_crime.ingest(START, END, store_dir, page_size=3, get=stub_get(make_records(7)))
+    assert rows == 7
+
+    manifest = get_crime.load_manifest(store_dir)
+    [window] = manifest["windows"]
+    part = os.path.join(store_dir, window["file"])
+    assert window["rows"] == 7
+    assert window["hash"] == get_crime.part_hash(part)
+    datetime.strptime(window["fetched_at"], get_crime.DATE_FORMAT)
+    assert not os.path.exists(part + ".tmp")
+
+    crimes = get_crime.load_crimes(store_dir)
+    assert len(crimes) == 7
+    assert set(crimes["primary_type"]) == {"THEFT"}
+
+
+def test_reingest_same_rows_changes_hash(tmp_path):
+    store_dir = str(tmp_path / "store")
+    manifest_path = os.path.join(store_dir, get_crime.MANIFEST_FILE)
+    get_crime.ingest(START, END, store_dir, page_size=3, get=stub_get(make_records(5)))
+    with open(manifest_path) as f:
+        first = json.load(f)["windows"][0]
+    first_source = source_hash(manifest_path)
+
+    # Same window and number of rows, but the crimes were reclassified
+    get_crime.ingest(START, END, store_dir, page_size=3,
+                     get=stub_get(make_records(5, "BATTERY")))
+    with open(manifest_path) as f:
+        [second] = json.load(f)["windows"]
+    assert second["rows"] == first["rows"]
+    assert second["hash"] != first["hash"]
+    assert source_hash(manifest_path) != first_source
+    assert set(get_crime.load_crimes(store_dir)["primary_type"]) == {"BATTERY"}
+
+
+def test_ingest_empty_window(tmp_path):
+    store_dir = str(tmp_path / "store")
+    assert get_crime.ingest(START, END, store_dir, get=stub_get([])) == 0
+    assert get_crime.load_manifest(store_dir) == {"windows": []}
+    assert len(get_crime.load_crimes(store_dir)) == 0
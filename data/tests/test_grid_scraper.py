@@ -0,0 +1,139 @@
+# Tests of the resumable grid and quadtree scrapes of
+# place_data/grid_scraper.py, against a stub Places endpoint (no network).
+# Run from data/:  python -m pytest -q tests
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+import requests
+
+DATA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DATA_DIR, "place_data"))
+
+import grid_scraper
+
+
+class StubResponse:
+    def __init__(self, results, ok=True):
+        self.results = results
+        self.ok = ok
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError("503 Service Unavailable")
+
+    def json(self):
+        return {"status": "OK" if self.results else "ZERO_RESULTS", "results": self.results}
+
+
+def make_place(place_id, lat, lng):
+    return {"place_id": place_id, "name": place_id, "vicinity": "Chicago",
+            "geometry": {"location": {"lat": lat, "lng": lng}}}
+
+
+def stub_session(results, failing=(), calls=None):
+    """
+    requests.Session replacement answering with results(location), and
+    failing the requests of the locations in `failing`.
+    """
+    class StubSession:
+        def get(self, url, params, timeout):
+            location = params["location"]
+            if calls is not None:
+                calls.append(location)
+            return StubResponse(results(location), ok=location not in failing)
+    return StubSession
+
+
+def location_of(lat, lng):
+    return f"{lat},{lng}"
+
+
+@pytest.fixture
+def small_grid(monkeypatch):
+    cells = grid_scraper.grid_cells(lat_min=41.88, lat_max=41.9,
+                                    lng_min=-87.64, lng_max=-87.62)
+    monkeypatch.setattr(grid_scraper, "grid_cells", lambda: cells)
+    return cells
+
+
+def grid_results(location):
+    # One place of its own per cell, and one place found by every cell
+    lat, lng = map(float, location.split(","))
+    return [make_place(f"p{location}", lat, lng), make_place("shared", 41.89, -87.63)]
+
+
+def test_grid_resumes_from_checkpoint(monkeypatch, tmp_path, small_grid):
+    failing = {location_of(lat, lng) for _, _, lat, lng in small_grid[:2]}
+    monkeypatch.setattr(requests, "Session", stub_session(grid_results, failing))
+    report = grid_scraper.scrape_grid("restaurant", str(tmp_path), workers=2,
+                                      tile_size=1, page_delay=(0, 0))
+    assert report["cells"] == len(small_grid) - 2
+    assert report["failed"] == 2
+
+    # The rerun only requests the cells that failed
+    calls = []
+    monkeypatch.setattr(requests, "Session", stub_session(grid_results, calls=calls))
+    report = grid_scraper.scrape_grid("restaurant", str(tmp_path), workers=2,
+                                      tile_size=1, page_delay=(0, 0))
+    assert sorted(calls) == sorted(failing)
+    assert report["cells"] == 2
+    assert report["failed"] == 0
+    assert report["unique_places"] == 2
+
+    places = pd.read_csv(tmp_path / "restaurant_data.csv")
+    assert len(places) == len(small_grid) + 1
+    assert places["Name"].is_unique
+
+
+def test_grid_restart_ignores_checkpoint(monkeypatch, tmp_path, small_grid):
+    monkeypatch.setattr(requests, "Session", stub_session(grid_results))
+    grid_scraper.scrape_grid("restaurant", str(tmp_path), page_delay=(0, 0))
+    calls = []
+    monkeypatch.setattr(requests, "Session", stub_session(grid_results, calls=calls))
+    report = grid_scraper.scrape_grid("restaurant", str(tmp_path), page_delay=(0, 0),
+                                      restart=True)
+    assert len(calls) == len(small_grid)
+    assert report["unique_places"] == len(small_grid) + 1
+    assert len(pd.read_csv(tmp_path / "restaurant_data.csv")) == len(small_grid) + 1
+
+
+def test_quadtree_resumes_split_cells(monkeypatch, tmp_path):
+    bounds = (41.88, 41.92, -87.68, -87.62)
+    monkeypatch.setattr(grid_scraper, "quad_roots", lambda: [("q0_0-", bounds)])
+    lat, lng, _ = grid_scraper.quad_center(bounds)
+    root = location_of(lat, lng)
+    children = {location_of(*grid_scraper.quad_center(child)[:2])
+                for _, child in grid_scraper.quad_children("q0_0-", bounds)}
+
+    def results(location):
+        # The root hits the result cap, so it is split into its four children
+        if location == root:
+            return [make_place(f"r{k}", lat, lng) for k in range(grid_scraper.MAX_RESULTS)]
+        child_lat, child_lng = map(float, location.split(","))
+        return [make_place(f"c{location}", child_lat, child_lng)]
+
+    monkeypatch.setattr(requests, "Session", stub_session(results, failing=children))
+    report = grid_scraper.scrape_quadtree("restaurant", str(tmp_path), max_depth=1,
+                                          page_delay=(0, 0))
+    assert report["cells"] == 1
+    assert report["failed"] == 4
+
+    # The saturated root is expanded from the checkpoint, not requested again
+    calls = []
+    monkeypatch.setattr(requests, "Session", stub_session(results, calls=calls))
+    report = grid_scraper.scrape_quadtree("restaurant", str(tmp_path), max_depth=1,
+                                          page_delay=(0, 0))
+    assert sorted(calls) == sorted(children)
+    assert report["cells"] == 4
+    assert report["unique_places"] == 4
+    assert len(pd.read_csv(tmp_path / "restaurant_data.csv")) == grid_scraper.MAX_RESULTS + 4
+
+
+def test_checkpoint_of_other_mode_is_refused(monkeypatch, tmp_path, small_grid):
+    monkeypatch.setattr(requests, "Session", stub_session(grid_results))
+    grid_scraper.scrape_grid("restaurant", str(tmp_path), page_delay=(0, 0))
+    with pytest.raises(ValueError):
+        grid_scraper.scrape_quadtree("restaurant", str(tmp_path), page_delay=(0, 0))
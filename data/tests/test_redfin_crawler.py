@@ -0,0 +1,142 @@
+# Tests of the frontier-driven property fetch of redfin_data/redfin_crawler.py,
+# against a stub ScraperAPI endpoint (no network).
+# Run from data/:  python -m pytest -q tests
+
+import os
+import sqlite3
+import sys
+
+import requests
+
+DATA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DATA_DIR)
+sys.path.insert(0, os.path.join(DATA_DIR, "redfin_data"))
+
+import frontier as frontier_module
+from frontier import Frontier
+from redfin_crawler import PropertyWriter, process_property_urls
+
+URLS = [f"https://www.redfin.com/IL/Chicago/home/{i}" for i in range(5)]
+
+
+class StubResponse:
+    def __init__(self, details, ok=True):
+        self.details = details
+        self.ok = ok
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError("500 Internal Server Error")
+
+    def json(self):
+        return self.details
+
+
+def stub_get(failing=(), invalid=(), calls=None):
+    """
+    GET function answering like ScraperAPI, failing the requests of the URLs
+    in `failing` and returning details without a 'url' for those in `invalid`.
+    """
+    def get(endpoint, params, timeout):
+        url = params["url"]
+        if calls is not None:
+            calls.append(url)
+        details = {"price": "$350,000", "latitude": 41.88, "longitude": -87.63,
+                   "address": "1 N State St, Chicago, IL 60602"}
+        if url not in invalid:
+            details["url"] = url
+        return StubResponse(details, ok=url not in failing)
+    return get
+
+
+def stored_urls(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return {row[0] for row in conn.execute("SELECT url FROM properties")}
+
+
+def run(frontier, db_path, get):
+    writer = PropertyWriter(db_path)
+    try:
+        return process_property_urls("", frontier, 60602, db_path=db_path, get=get,
+                                     delay=0, writer=writer, batch_size=2)
+    finally:
+        writer.close()
+
+
+def test_fetched_urls_are_done(tmp_path):
+    db_path = str(tmp_path / "redfin_properties.db")
+    with Frontier(db_path) as frontier:
+        frontier.add(URLS, 60602)
+        assert run(frontier, db_path, stub_get()) == len(URLS)
+        assert frontier.counts(60602)[frontier_module.DONE] == len(URLS)
+    assert stored_urls(db_path) == set(URLS)
+
+
+def test_failed_urls_back_off(tmp_path):
+    db_path = str(tmp_path / "redfin_properties.db")
+    failing, invalid = URLS[1], URLS[3]
+    calls = []
+    with Frontier(db_path, retry_delay=3600) as frontier:
+        frontier.add(URLS, 60602)
+        assert run(frontier, db_path, stub_get({failing}, {invalid}, calls)) == 3
+
+        # Each failed URL is tried once per call, then waits for its retry delay
+        assert sorted(calls) == sorted(URLS)
+        assert frontier.status(failing) == frontier_module.PENDING
+        assert frontier.status(invalid) == frontier_module.PENDING
+        assert frontier.claim(10, 60602) == []
+        attempts, error = frontier.conn.execute(
+            "SELECT attempts, last_error FROM frontier WHERE url = ?", (failing,)).fetchone()
+        assert attempts == 1
+        assert "500" in error
+    assert stored_urls(db_path) == set(URLS) - {failing, invalid}
+
+
+class Clock:
+    """
+    Stand-in for the time module of frontier.py.
+    """
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+def test_failed_urls_are_retried_then_failed(monkeypatch, tmp_path):
+    db_path = str(tmp_path / "redfin_properties.db")
+    failing = URLS[0]
+    clock = Clock()
+    monkeypatch.setattr(frontier_module, "time", clock)
+    with Frontier(db_path, max_attempts=2, retry_delay=60) as frontier:
+        frontier.add(URLS, 60602)
+        run(frontier, db_path, stub_get({failing}))
+        assert frontier.status(failing) == frontier_module.PENDING
+
+        # Retried by a call after the retry delay, and left as failed after
+        # max_attempts
+        clock.now += 60
+        calls = []
+        assert run(frontier, db_path, stub_get({failing}, calls=calls)) == 0
+        assert calls == [failing]
+        assert frontier.status(failing) == frontier_module.FAILED
+
+        # Requeued by hand, it is fetched once the endpoint works again
+        assert frontier.retry_failed(60602) == 1
+        assert run(frontier, db_path, stub_get()) == 1
+        assert frontier.counts(60602)[frontier_module.DONE] == len(URLS)
+
+
+def test_stored_urls_are_not_fetched_again(tmp_path):
+    db_path = str(tmp_path / "redfin_properties.db")
+    with Frontier(db_path) as frontier:
+        frontier.add(URLS[:2], 60602)
+        run(frontier, db_path, stub_get())
+
+        # A URL stored by an earlier crawl is marked done without a request
+        frontier.conn.execute("UPDATE frontier SET status = ? WHERE url = ?",
+                              (frontier_module.PENDING, URLS[0]))
+        calls = []
+        assert run(frontier, db_path, stub_get(calls=calls)) == 1
+        assert calls == []
+        assert frontier.status(URLS[0]) == frontier_module.DONE
@@ -0,0 +1,66 @@
+# Tests of the grid spatial index against a brute-force haversine scan.
+# Run from data/:  python -m pytest -q tests
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spatial_index import SpatialIndex
+from util import haversine_distance
+
+
+def make_points(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"Latitude": rng.uniform(41.8, 41.9, n),
+                         "Longitude": rng.uniform(-87.7, -87.6, n)})
+
+
+def brute_force(df, lat, lon, radius_km):
+    distances = haversine_distance(lat, lon, df["Latitude"].to_numpy(),
+                                   df["Longitude"].to_numpy())
+    return np.flatnonzero(distances <= radius_km)
+
+
+def test_query_inside_bbox():
+    df = make_points()
+    index = SpatialIndex(df)
+    for radius_km in (0.3, 1.0, 5.0):
+        expected = brute_force(df, 41.85, -87.65, radius_km)
+        assert np.array_equal(index.query_radius(41.85, -87.65, radius_km), expected)
+
+
+def test_query_outside_bbox():
+    df = make_points()
+    index = SpatialIndex(df)
+    for lat, lon, radius_km in [(41.3, -87.65, 100), (42.5, -87.65, 80),
+                                (41.85, -86.5, 120), (41.3, -87.65, 50)]:
+        expected = brute_force(df, lat, lon, radius_km)
+        assert np.array_equal(index.query_radius(lat, lon, radius_km), expected)
+    assert len(brute_force(df, 41.3, -87.65, 100)) == len(df)
+
+
+def test_query_pairs_mixed_queries():
+    df = make_points()
+    index = SpatialIndex(df)
+    rng = np.random.default_rng(1)
+    lat = rng.uniform(41.0, 42.7, 200)
+    lon = rng.uniform(-88.5, -86.8, 200)
+    query_idx, rows, _ = index.query_pairs(lat, lon, 60)
+    for q in range(len(lat)):
+        expected = brute_force(df, lat[q], lon[q], 60)
+        assert np.array_equal(rows[query_idx == q], expected)
+
+
+def test_knn_far_query():
+    df = make_points()
+    index = SpatialIndex(df)
+    query_idx, rows, distances = index.query_knn([40.0], [-87.65], k=3)
+    all_distances = haversine_distance(40.0, -87.65, df["Latitude"].to_numpy(),
+                                       df["Longitude"].to_numpy())
+    assert np.array_equal(query_idx, [0, 0, 0])
+    assert np.array_equal(rows, np.argsort(all_distances, kind="stable")[:3])
+    assert np.allclose(distances, np.sort(all_distances)[:3])
@@ -9,6 +9,31 @@
 import numpy as np
 import pandas as pd
 import ast
+import hashlib
+import json
+import os
+
+EARTH_RADIUS_KM = 6371.0
+
+VIOLENT_CRIME_TYPES = {
+    'ASSAULT', 'BATTERY',
+    'CRIMINAL SEXUAL ASSAULT',
+    'SEX OFFENSE', 'WEAPONS VIOLATION',
+    'ROBBERY', 'HOMICIDE', 'ARSON',
+    'KIDNAPPING', 'STALKING',
+    'OFFENSE INVOLVING CHILDREN',
+    'INTIMIDATION', 'HUMAN TRAFFICKING'
+}
+
+NONVIOLENT_CRIME_TYPES = {
+    'MOTOR VEHICLE THEFT', 'CRIMINAL DAMAGE',
+    'BURGLARY', 'DECEPTIVE PRACTICE', 'THEFT',
+    'OTHER OFFENSE', 'PUBLIC PEACE VIOLATION',
+    'LIQUOR LAW VIOLATION',
+    'CONCEALED CARRY LICENSE VIOLATION', 'PUBLIC INDECENCY',
+    'OBSCENITY', 'GAMBLING', 'OTHER NARCOTIC VIOLATION',
+    'NON-CRIMINAL', 'CRIMINAL TRESPASS'
+}
 
 
 def haversine_distance(lat1, lon1, lat2, lon2):
@@ -23,7 +48,7 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     Returns:
       A np array of distances (in km).
     """
-    R = 6371.0  # Earth radius in kilometers
+    R = EARTH_RADIUS_KM  # Earth radius in kilometers
     lat1_rad = np.radians(lat1)
     lon1_rad = np.radians(lon1)
     lat2_rad = np.radians(lat2)
@@ -36,6 +61,115 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
     return R * c
 
+def file_hash(filepath, block_size=1 << 20):
+    """
+    SHA-256 of a file's content, used to tell whether an input file changed.
+
+    Parameters:
+      filepath (str): Path to the file.
+      block_size (int): Number of bytes read at a time.
+
+    Returns:
+      str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_hash(filepath):
+    """
+    Hash of an input table's source, used as its cache key: the file_hash of
+    a file, or for the manifest.json of a store of part files (see
+    crime_data/get_crime.py), the hashes of the manifest and of every part
+    file it lists, so re-fetched parts are noticed even if the manifest is
+    unchanged.
+
+    Parameters:
+      filepath (str): Path to the source file or store manifest.
+
+    Returns:
+      str: The hex digest.
+    """
+    if os.path.basename(filepath) != "manifest.json":
+        return file_hash(filepath)
+    with open(filepath, "r") as f:
+        manifest = json.load(f)
+    store_dir = os.path.dirname(filepath)
+    digest = hashlib.sha256(file_hash(filepath).encode())
+    for window in manifest.get("windows", []):
+        digest.update(file_hash(os.path.join(store_dir, window["file"])).encode())
+    return digest.hexdigest()
+
+def as_radius_list(radius_km):
+    """
+    Turn a single radius or a list of radii into a list of floats.
+
+    Parameters:
+      radius_km (float or list of float): Search radius (or radii) in kilometers.
+
+    Returns:
+      list: The radii as floats.
+    """
+    if np.ndim(radius_km) == 0:
+        return [float(radius_km)]
+    return [float(r) for r in radius_km]
+
+def radius_label(radius_km):
+    """
+    Short label for a radius used in column names, e.g., 0.5 -> '500m', 1 -> '1km'.
+
+    Parameters:
+      radius_km (float): Radius in kilometers.
+
+    Returns:
+      str: The label.
+    """
+    meters = round(radius_km * 1000, 6)
+    if meters % 1000 == 0:
+        return f"{int(meters // 1000)}km"
+    if meters == int(meters):
+        return f"{int(meters)}m"
+    return f"{meters:g}m"
+
+def nearby_rows(house_lat, house_lon, data, radius_km=1.0,
+                lat_col='Latitude', lon_col='Longitude', return_distances=False):
+    """
+    Get the rows of `data` that fall within the given radius (in km) of a house.
+
+    `data` can either be a raw DataFrame, in which case the distance to every
+    row is computed, or a spatial_index.SpatialIndex built once over that
+    DataFrame, in which case only the nearby grid cells are checked. Both give
+    the same rows in the same order.
+
+    Parameters:
+      house_lat (float): Latitude of the house.
+      house_lon (float): Longitude of the house.
+      data (DataFrame or SpatialIndex): The amenity/crime data or its index.
+      radius_km (float): Search radius in kilometers (default to 1 km).
+      lat_col, lon_col (str): Coordinate columns of a raw DataFrame.
+      return_distances (bool): Also return the distance (in km) of each row.
+
+    Returns:
+      DataFrame: The rows within the specified radius, and a np array of their
+                 distances if return_distances is True.
+    """
+    if hasattr(data, 'query_pairs'):
+        _, rows, distances = data.query_pairs([house_lat], [house_lon], radius_km)
+        nearby = data.df.iloc[rows]
+    else:
+        distances = haversine_distance(house_lat, house_lon,
+                                       data[lat_col].values,
+                                       data[lon_col].values)
+        within = distances <= radius_km
+        nearby = data[within]
+        distances = distances[within]
+
+    if return_distances:
+        return nearby, distances
+    return nearby
+
 def count_nearby(house_lat, house_lon, place_df, radius_km=1.0):
     """
     Count the number of amenities (e.g., convenience/grocery stores) within a given radius (in km) of a house.
@@ -43,17 +177,50 @@ def count_nearby(house_lat, house_lon, place_df, radius_km=1.0):
     Parameters:
       house_lat (float): Latitude of the house.
       house_lon (float): Longitude of the house.
-      place_df (DataFrame): DataFrame for the amenity.
-      radius_km (float): Search radius in kilometers (default to 1 km).
+      place_df (DataFrame, SpatialIndex or CrimeStore): DataFrame for the amenity, its spatial
+                 index, or a crime_store.CrimeStore of crime incidents.
+      radius_km (float or list of float): Search radius in kilometers (default to 1 km).
+                 A list of radii is answered from a single search at the largest one.
       
     Returns:
-      int: Number of amenities within the specified radius.
+      int: Number of amenities within the specified radius, or a dict mapping
+           each radius to its count if a list of radii is given.
     """
+    if np.ndim(radius_km) > 0:
+        radii = as_radius_list(radius_km)
+        _, distances = nearby_rows(house_lat, house_lon, place_df, max(radii),
+                                   return_distances=True)
+        counts = np.searchsorted(np.sort(distances), radii, side='right')
+        return dict(zip(radii, counts.tolist()))
+
+    if hasattr(place_df, 'query_radius'):
+        return len(place_df.query_radius(house_lat, house_lon, radius_km))
+
     distances = haversine_distance(house_lat, house_lon,
                                                place_df['Latitude'].values,
                                                place_df['Longitude'].values)
     return np.sum(distances <= radius_km)
 
+def lookup_nearby(house_lat, house_lon, cells, radius_km=1.0, exact=False):
+    """
+    Aggregates of the amenities or crimes within a given radius (in km) of a house,
+    from the precomputed geohash cells of cell_aggregates.py instead of the points.
+    
+    Parameters:
+      house_lat (float): Latitude of the house.
+      house_lon (float): Longitude of the house.
+      cells (CellAggregates): The cell_aggregates.CellAggregates of the amenity or crime table.
+      radius_km (float): Search radius in kilometers (default to 1 km).
+      exact (bool): If True, the points of the cells on the edge of the radius are checked
+                    one by one, which gives the same counts as count_nearby and crime_summary.
+                    Otherwise whole cells are counted in or out by their center.
+      
+    Returns:
+      dict: 'count', 'mean_<column>' for the averaged columns (e.g., 'mean_Rating'), and for
+            crimes the keys of crime_summary plus 'type_counts'.
+    """
+    return cells.lookup(house_lat, house_lon, radius_km, exact)
+
 
 def crime_summary(house_lat, house_lon, crime_df, radius_km=1.0):
     """
@@ -68,43 +235,45 @@ def crime_summary(house_lat, house_lon, crime_df, radius_km=1.0):
     Parameters:
       house_lat (float): Latitude of the house.
       house_lon (float): Longitude of the house.
-      crime_df (DataFrame): DataFrame containing crime incidents with columns
-                            'Latitude', 'Longitude', and 'Crime Type'.
-      radius_km (float): Search radius in kilometers (default to 1 km).
+      crime_df (DataFrame, SpatialIndex, CrimeAggregator or CrimeStore): DataFrame containing
+                            crime incidents with columns 'Latitude', 'Longitude', and 'primary_type',
+                            its spatial index, a crime_aggregator.CrimeAggregator built on it
+                            (fastest, as the crime types are only encoded once), or the compact
+                            crime_store.CrimeStore (float32 coordinates and uint8 type codes).
+      radius_km (float or list of float): Search radius in kilometers (default to 1 km).
+                 A list of radii is answered from a single search at the largest one.
       
     Returns:
       dict: A dictionary with keys 'crime_counts', 'most_prevalent_crime', and 'crime_proportion'.
             If no crime incidents are found within the radius, returns an empty dictionary for counts,
-            and None and 0 for the other values.
+            and None and 0 for the other values. If a list of radii is given, returns a dict
+            mapping each radius to its summary.
     """
-    # Compute distances from the house to each crime incident.
-    distances = haversine_distance(house_lat, house_lon,
-                                               crime_df['Latitude'].values,
-                                               crime_df['Longitude'].values)
-    
-    violent_crime_types = {
-    'ASSAULT', 'BATTERY',
-    'CRIMINAL SEXUAL ASSAULT',
-    'SEX OFFENSE', 'WEAPONS VIOLATION',
-    'ROBBERY', 'HOMICIDE', 'ARSON',
-    'KIDNAPPING', 'STALKING',
-    'OFFENSE INVOLVING CHILDREN',
-    'INTIMIDATION', 'HUMAN TRAFFICKING'
-    }
-    
-    nonviolent_crime_types = {
-    'MOTOR VEHICLE THEFT', 'CRIMINAL DAMAGE',
-    'BURGLARY', 'DECEPTIVE PRACTICE', 'THEFT',
-    'OTHER OFFENSE', 'PUBLIC PEACE VIOLATION',
-    'LIQUOR LAW VIOLATION',
-    'CONCEALED CARRY LICENSE VIOLATION', 'PUBLIC INDECENCY',
-    'OBSCENITY', 'GAMBLING', 'OTHER NARCOTIC VIOLATION',
-    'NON-CRIMINAL', 'CRIMINAL TRESPASS'
-    }
-    
+    # A precompiled aggregator (or compact store) counts the crime type codes directly.
+    if hasattr(crime_df, 'summary'):
+        return crime_df.summary(house_lat, house_lon, radius_km)
+
+    if np.ndim(radius_km) > 0:
+        radii = as_radius_list(radius_km)
+        crime_nearby, distances = nearby_rows(house_lat, house_lon, crime_df, max(radii),
+                                              return_distances=True)
+        return {r: summarize_crimes(crime_nearby[distances <= r]) for r in radii}
+
     # Include incidents within the specified radius.
-    crime_nearby = crime_df[distances <= radius_km]
-    
+    crime_nearby = nearby_rows(house_lat, house_lon, crime_df, radius_km)
+    return summarize_crimes(crime_nearby)
+
+
+def summarize_crimes(crime_nearby):
+    """
+    Summarize the crime incidents around a house (see crime_summary).
+
+    Parameters:
+      crime_nearby (DataFrame): The crime incidents within the radius.
+
+    Returns:
+      dict: The crime summary of crime_summary.
+    """
     # Initialize the summary dictionary.
     summary = {}
     if crime_nearby.empty:
@@ -118,8 +287,8 @@ def crime_summary(house_lat, house_lon, crime_df, radius_km=1.0):
     crime_counts = crime_nearby.groupby("primary_type").size()
 
     # Compute violent and non-violent totals.
-    violent_total = sum(crime_counts.get(ct, 0) for ct in violent_crime_types)
-    nonviolent_total = sum(crime_counts.get(ct, 0) for ct in nonviolent_crime_types)
+    violent_total = sum(crime_counts.get(ct, 0) for ct in VIOLENT_CRIME_TYPES)
+    nonviolent_total = sum(crime_counts.get(ct, 0) for ct in NONVIOLENT_CRIME_TYPES)
     summary["violent_crime_count"] = violent_total
     summary["nonviolent_crime_count"] = nonviolent_total
 
@@ -142,22 +311,28 @@ def compute_restaurant_stats(house_lat, house_lon, restaurant_df, column, radius
     Parameters:
       house_lat (float): Latitude of the house.
       house_lon (float): Longitude of the house.
-      restaurant_df (DataFrame): DataFrame with 'Price Level', 'Latitude', and 'Longitude' columns.
-      radius_km (float): Search radius in kilometers (default is 1 km).
+      restaurant_df (DataFrame or SpatialIndex): DataFrame with 'Price Level', 'Latitude', and 'Longitude' columns,
+                                                 or its spatial index.
+      radius_km (float or list of float): Search radius in kilometers (default is 1 km).
+                 A list of radii is answered from a single search at the largest one.
     
     Returns:
       float: The average price level of the restaurants within the radius.
-             If no restaurants are found, returns NaN.
+             If no restaurants are found, returns NaN. If a list of radii is given,
+             returns a dict mapping each radius to its average.
     """
-    # Compute distances from the house to each restaurant.
-    distances = haversine_distance(
-        house_lat, house_lon,
-        restaurant_df['Latitude'].values,
-        restaurant_df['Longitude'].values
-    )
-    
+    if np.ndim(radius_km) > 0:
+        radii = as_radius_list(radius_km)
+        nearby_restaurants, distances = nearby_rows(house_lat, house_lon, restaurant_df,
+                                                    max(radii), return_distances=True)
+        stats = {}
+        for r in radii:
+            within = nearby_restaurants[distances <= r]
+            stats[r] = np.nan if within.empty else within[f"{column}"].mean()
+        return stats
+
     # Filter restaurants within the specified radius.
-    nearby_restaurants = restaurant_df[distances <= radius_km]
+    nearby_restaurants = nearby_rows(house_lat, house_lon, restaurant_df, radius_km)
     
     # If no restaurants are found, return NaN.
     if nearby_restaurants.empty:
@@ -176,7 +351,8 @@ def impute_house_price_per_sq_ft(house_row, houses_df, radius_km=1.0):
     Parameters:
       house_row (Series): A row from the houses DataFrame containing at least
                           'latitude', 'longitude', and 'price_per_sq_ft' columns.
-      houses_df (DataFrame): The entire houses DataFrame.
+      houses_df (DataFrame or SpatialIndex): The entire houses DataFrame, or a spatial
+                                             index built on its 'latitude'/'longitude' columns.
       radius_km (float): The radius in kilometers within which to consider nearby houses (default to 1 km).
     
     Returns:
@@ -187,14 +363,9 @@ def impute_house_price_per_sq_ft(house_row, houses_df, radius_km=1.0):
     if pd.notna(house_row['price_per_sq_ft']):
         return house_row['price_per_sq_ft']
     
-    # Compute distances from the current house to all houses in houses_df.
-    distances = haversine_distance(
-        house_row['latitude'], house_row['longitude'],
-        houses_df['latitude'].values, houses_df['longitude'].values
-    )
-    
-    # Exclude the house itself and get houses within the radius.
-    nearby_houses = houses_df[distances <= radius_km]
+    # Get houses within the radius.
+    nearby_houses = nearby_rows(house_row['latitude'], house_row['longitude'], houses_df,
+                                radius_km, lat_col='latitude', lon_col='longitude')
     
     # Average only the houses that have a non-missing price_per_sq_ft.
     nearby_valid = nearby_houses[nearby_houses['price_per_sq_ft'].notna()]
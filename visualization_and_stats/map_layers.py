@@ -0,0 +1,346 @@
+# This file contains the map-layer builder of viz.ipynb. Instead of pushing
+# every house (or crime) into a folium HeatMap / FeatureGroup, the points are
+# pre-aggregated into bins sized for the zoom level of the map, so the HTML
+# of a map grows with the number of occupied bins, not with the input.
+
+# Bins are laid out in web mercator pixels (the projection of the map tiles)
+# at the given zoom, so a bin of cell_px pixels looks the same size anywhere
+# on the map: square bins, or hexagonal bins (the nearest center of two
+# offset rectangular lattices, as matplotlib's hexbin). Each bin becomes one
+# heatmap point at the centroid of its points, weighted by their mean (for a
+# value like price per sq ft) or sum / count (for a density like crimes).
+# Markers are clustered the same way on a coarser grid: a cluster is one
+# marker with its number of points and the mean of some columns. If a layer
+# still has more than max_points bins, the bins are doubled in size until it
+# fits.
+
+# Aggregated layers are cached on disk, keyed by a hash of the input
+# coordinates / values and the settings, so re-rendering a map only reads
+# the small aggregated tables.
+
+# Resource:
+    # 1) https://en.wikipedia.org/wiki/Web_Mercator_projection#Formulas
+    # 2) https://www.redblobgames.com/grids/hexagons/
+    # 3) https://python-visualization.github.io/folium/latest/user_guide/plugins/heatmap.html
+
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+try:
+    import folium
+    from folium.plugins import HeatMap
+    HAS_FOLIUM = True
+except ImportError:
+    # The bins can still be computed; only the folium layers need it
+    HAS_FOLIUM = False
+
+TILE_SIZE = 256
+MAX_MERCATOR_LAT = 85.05112878
+
+DEFAULT_ZOOM = 12
+HEAT_CELL_PX = 8
+MARKER_CELL_PX = 60
+MAX_POINTS = 20000
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "map_layer_cache")
+
+AGGREGATIONS = ("mean", "sum", "count")
+
+
+def mercator_pixels(lat, lon, zoom):
+    """
+    Web mercator pixel coordinates of points at a zoom level.
+
+    Returns:
+      tuple of np arrays (x, y), y growing southwards as on the tiles.
+    """
+    lat = np.clip(np.asarray(lat, dtype=float), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    lon = np.asarray(lon, dtype=float)
+    world = TILE_SIZE * 2.0 ** zoom
+    x = (lon + 180) / 360 * world
+    phi = np.radians(lat)
+    y = (1 - np.log(np.tan(phi) + 1 / np.cos(phi)) / np.pi) / 2 * world
+    return x, y
+
+
+def _factorize_cells(ix, iy):
+    """
+    Number the (ix, iy) cells 0, 1, ... in order of first appearance.
+    """
+    if len(ix) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ix = ix - ix.min()
+    iy = iy - iy.min()
+    return pd.factorize(ix * (int(iy.max()) + 1) + iy)[0]
+
+
+def bin_keys(lat, lon, zoom, cell_px, shape="grid"):
+    """
+    Bin of every point, as an integer code.
+
+    Inputs:
+      lat, lon (np array): Coordinates of the points.
+      zoom (int): Zoom level of the map.
+      cell_px (float): Width of a bin in pixels at that zoom.
+      shape (str): 'grid' for square bins or 'hex' for hexagonal bins.
+
+    Returns:
+      np array of int: Bin code of every point (same code, same bin).
+    """
+    x, y = mercator_pixels(lat, lon, zoom)
+    if shape == "grid":
+        ix = np.floor(x / cell_px).astype(np.int64)
+        iy = np.floor(y / cell_px).astype(np.int64)
+        return _factorize_cells(ix, iy)
+    if shape != "hex":
+        raise ValueError(f"unknown bin shape {shape!r}")
+
+    # Centers of two rectangular lattices, the second offset by half a cell
+    dx, dy = cell_px, cell_px * np.sqrt(3)
+    ix1, iy1 = np.round(x / dx), np.round(y / dy)
+    ix2, iy2 = np.floor(x / dx), np.floor(y / dy)
+    d1 = (x - ix1 * dx) ** 2 + (y - iy1 * dy) ** 2
+    d2 = (x - (ix2 + 0.5) * dx) ** 2 + (y - (iy2 + 0.5) * dy) ** 2
+    second = d2 < d1
+    ix = np.where(second, ix2, ix1).astype(np.int64)
+    iy = np.where(second, iy2, iy1).astype(np.int64)
+    return _factorize_cells(2 * ix + second, iy)
+
+
+def fit_bins(lat, lon, zoom, cell_px, shape="grid", max_points=MAX_POINTS):
+    """
+    bin_keys with bins enlarged (doubled in width) until there are at most
+    max_points of them.
+
+    Returns:
+      tuple: (bin code of every point, number of bins).
+    """
+    while True:
+        codes = bin_keys(lat, lon, zoom, cell_px, shape)
+        n_bins = int(codes.max()) + 1 if len(codes) else 0
+        if n_bins <= max_points:
+            return codes, n_bins
+        cell_px *= 2
+
+
+def aggregate_bins(lat, lon, values=None, zoom=DEFAULT_ZOOM, cell_px=HEAT_CELL_PX,
+                   shape="grid", agg="mean", max_points=MAX_POINTS):
+    """
+    Aggregate points into bins.
+
+    Inputs:
+      lat, lon (array-like): Coordinates of the points.
+      values (array-like): Value of every point (e.g., price per sq ft), not
+                           needed for agg='count'.
+      zoom (int): Zoom level the bins are sized for.
+      cell_px (float): Width of a bin in pixels at that zoom.
+      shape (str): 'grid' or 'hex'.
+      agg (str): 'mean', 'sum' or 'count' of the values of a bin.
+      max_points (int): Bins are enlarged until there are at most this many.
+
+    Returns:
+      DataFrame: One row per bin with 'latitude' / 'longitude' (centroid of
+                 its points), 'count' and 'value' (the aggregate).
+    """
+    if agg not in AGGREGATIONS:
+        raise ValueError(f"agg must be one of {AGGREGATIONS}")
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    values = np.ones(len(lat)) if values is None else np.asarray(values, dtype=float)
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    if agg != "count":
+        valid &= ~np.isnan(values)
+    lat, lon, values = lat[valid], lon[valid], values[valid]
+
+    codes, n_bins = fit_bins(lat, lon, zoom, cell_px, shape, max_points)
+    counts = np.bincount(codes, minlength=n_bins)
+    bins = pd.DataFrame({
+        "latitude": np.bincount(codes, weights=lat, minlength=n_bins) / counts,
+        "longitude": np.bincount(codes, weights=lon, minlength=n_bins) / counts,
+        "count": counts,
+    })
+    sums = np.bincount(codes, weights=values, minlength=n_bins)
+    bins["value"] = {"mean": sums / np.maximum(counts, 1), "sum": sums,
+                     "count": counts.astype(float)}[agg]
+    return bins
+
+
+def cluster_markers(df, zoom=DEFAULT_ZOOM, cell_px=MARKER_CELL_PX, value_cols=(),
+                    label_col=None, max_points=MAX_POINTS, lat_col="latitude",
+                    lon_col="longitude"):
+    """
+    Cluster the rows of a table into one marker per grid bin.
+
+    Inputs:
+      df (DataFrame): Points to show as markers (e.g., houses).
+      zoom (int): Zoom level the clusters are sized for.
+      cell_px (float): Width of a cluster in pixels at that zoom.
+      value_cols (iterable): Numeric columns averaged per cluster.
+      label_col (str): Column kept as the label of single-point clusters.
+      max_points (int): Clusters are enlarged until there are at most this many.
+      lat_col, lon_col (str): Coordinate columns.
+
+    Returns:
+      DataFrame: One row per cluster with 'latitude', 'longitude', 'count',
+                 'mean_<column>' for every value column, and 'label' (None
+                 for clusters of several points) if label_col is given.
+    """
+    df = df.dropna(subset=[lat_col, lon_col])
+    lat = df[lat_col].to_numpy(dtype=float)
+    lon = df[lon_col].to_numpy(dtype=float)
+    codes, n_bins = fit_bins(lat, lon, zoom, cell_px, "grid", max_points)
+    counts = np.bincount(codes, minlength=n_bins)
+    clusters = pd.DataFrame({
+        "latitude": np.bincount(codes, weights=lat, minlength=n_bins) / counts,
+        "longitude": np.bincount(codes, weights=lon, minlength=n_bins) / counts,
+        "count": counts,
+    })
+    for col in value_cols:
+        values = df[col].to_numpy(dtype=float)
+        present = ~np.isnan(values)
+        sums = np.bincount(codes[present], weights=values[present], minlength=n_bins)
+        n = np.bincount(codes[present], minlength=n_bins)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            clusters[f"mean_{col}"] = sums / n
+    if label_col is not None:
+        # Codes are numbered in order of first appearance
+        first = np.unique(codes, return_index=True)[1]
+        labels = df[label_col].to_numpy(dtype=object)[first]
+        clusters["label"] = np.where(counts == 1, labels, None)
+    return clusters
+
+
+def layer_key(kind, arrays, params):
+    """
+    Cache key of a layer: a hash of its input arrays and settings.
+    """
+    digest = hashlib.sha1(kind.encode())
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str(array.dtype).encode())
+        digest.update(array.tobytes() if array.dtype != object
+                      else json.dumps(array.tolist(), default=str).encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def cached_layer(kind, arrays, params, compute, cache_dir=CACHE_DIR):
+    """
+    An aggregated layer, read from cache_dir if it was computed before.
+
+    Inputs:
+      kind (str): Kind of layer, e.g., 'heat' (part of the file name).
+      arrays (list): Input arrays of the layer.
+      params (dict): Settings of the layer.
+      compute (function): Computes the layer DataFrame.
+      cache_dir (str): Directory of the cache, or None to not cache.
+
+    Returns:
+      DataFrame: The aggregated layer.
+    """
+    if cache_dir is None:
+        return compute()
+    path = os.path.join(cache_dir, f"{kind}_{layer_key(kind, arrays, params)}.pkl")
+    if os.path.exists(path):
+        return pd.read_pickle(path)
+    layer = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    layer.to_pickle(path)
+    return layer
+
+
+def heat_bins(df, value_col=None, zoom=DEFAULT_ZOOM, cell_px=HEAT_CELL_PX, shape="grid",
+              agg="mean", max_points=MAX_POINTS, cache_dir=CACHE_DIR,
+              lat_col="latitude", lon_col="longitude"):
+    """
+    aggregate_bins of a table's column, through the on-disk cache.
+    """
+    lat = df[lat_col].to_numpy(dtype=float)
+    lon = df[lon_col].to_numpy(dtype=float)
+    values = None if value_col is None else df[value_col].to_numpy(dtype=float)
+    params = {"zoom": zoom, "cell_px": cell_px, "shape": shape, "agg": agg,
+              "max_points": max_points}
+    arrays = [lat, lon] if values is None else [lat, lon, values]
+    return cached_layer("heat", arrays, params,
+                        lambda: aggregate_bins(lat, lon, values, zoom, cell_px, shape, agg,
+                                               max_points), cache_dir)
+
+
+def heatmap_layer(df, value_col=None, name=None, zoom=DEFAULT_ZOOM, cell_px=HEAT_CELL_PX,
+                  shape="grid", agg="mean", max_points=MAX_POINTS, cache_dir=CACHE_DIR,
+                  lat_col="latitude", lon_col="longitude", **heatmap_kwargs):
+    """
+    A folium FeatureGroup with a HeatMap of the binned points of a table.
+
+    Inputs:
+      df (DataFrame): Points (e.g., houses or crimes).
+      value_col (str): Column used as the weight (None to weight by count).
+      name (str): Name of the layer in the LayerControl (default value_col).
+      zoom, cell_px, shape, agg, max_points: see aggregate_bins.
+      cache_dir (str): Directory of the layer cache, or None to not cache.
+      lat_col, lon_col (str): Coordinate columns.
+      heatmap_kwargs: passed to folium.plugins.HeatMap (radius, blur, gradient...).
+
+    Returns:
+      folium.FeatureGroup
+    """
+    if not HAS_FOLIUM:
+        raise ImportError("folium is required for the map layers")
+    if value_col is None and agg == "mean":
+        agg = "count"
+    bins = heat_bins(df, value_col, zoom, cell_px, shape, agg, max_points, cache_dir,
+                     lat_col, lon_col)
+    layer = folium.FeatureGroup(name=name or value_col or "Density")
+    HeatMap(bins[["latitude", "longitude", "value"]].to_numpy().tolist(),
+            **heatmap_kwargs).add_to(layer)
+    return layer
+
+
+def marker_layer(df, name="Markers", zoom=DEFAULT_ZOOM, cell_px=MARKER_CELL_PX,
+                 value_cols=(), label_col=None, max_points=MAX_POINTS, cache_dir=CACHE_DIR,
+                 color="blue", lat_col="latitude", lon_col="longitude"):
+    """
+    A folium FeatureGroup with one circle marker per cluster of points; the
+    marker size grows with the cluster size, and its tooltip shows the count
+    and the means of value_cols.
+
+    Inputs:
+      df (DataFrame): Points to show (e.g., houses).
+      name (str): Name of the layer in the LayerControl.
+      zoom, cell_px, value_cols, label_col, max_points: see cluster_markers.
+      cache_dir (str): Directory of the layer cache, or None to not cache.
+      color (str): Color of the markers.
+      lat_col, lon_col (str): Coordinate columns.
+
+    Returns:
+      folium.FeatureGroup
+    """
+    if not HAS_FOLIUM:
+        raise ImportError("folium is required for the map layers")
+    value_cols = list(value_cols)
+    columns = [lat_col, lon_col] + value_cols + ([label_col] if label_col else [])
+    params = {"zoom": zoom, "cell_px": cell_px, "value_cols": value_cols,
+              "label_col": label_col, "max_points": max_points}
+    clusters = cached_layer(
+        "markers", [df[col].to_numpy() for col in columns], params,
+        lambda: cluster_markers(df, zoom, cell_px, value_cols, label_col, max_points,
+                                lat_col, lon_col), cache_dir)
+
+    layer = folium.FeatureGroup(name=name)
+    for cluster in clusters.to_dict("records"):
+        lines = [str(cluster["label"])] if cluster.get("label") is not None else []
+        lines.append(f"{cluster['count']} points")
+        for col in value_cols:
+            value = cluster[f"mean_{col}"]
+            if not pd.isna(value):
+                lines.append(f"mean {col}: {value:,.2f}")
+        folium.CircleMarker(
+            location=[cluster["latitude"], cluster["longitude"]],
+            radius=4 + 3 * np.log2(cluster["count"]),
+            color=color, fill=True, fill_opacity=0.6, weight=1,
+            tooltip="<br>".join(lines)
+        ).add_to(layer)
+    return layer
@@ -0,0 +1,355 @@
+# This file contains a batched OLS specification sweep for the models of
+# stats.ipynb: raw vs sqrt vs log1p transforms of the counts, total vs violent
+# crime, crime interactions and squared terms, fitted all at once instead of
+# one sm.OLS(...).fit() / smf.ols cell at a time.
+
+# Every term used by any specification is put in one shared design matrix,
+# which is factored once as X = QR (Householder QR). A specification is a
+# subset s of its columns, and since y = QQ'y + (residual orthogonal to all
+# columns), its least squares problem reduces to a small one on R[:, s] and
+# z = Q'y: only a (p x k) problem per model, where p is the number of shared
+# columns, instead of another pass over the rows. All specifications are fit
+# on the same rows (complete for every term), so their AIC / BIC compare.
+
+# Usage (from visualization_and_stats/):
+#   python model_sweep.py --workers 4 --output sweep.csv
+
+# Resource:
+    # 1) https://en.wikipedia.org/wiki/QR_decomposition#Using_for_solution_to_linear_inverse_problems
+    # 2) https://www.statsmodels.org/stable/generated/statsmodels.regression.linear_model.OLSResults.html
+    # 3) https://en.wikipedia.org/wiki/Variance_inflation_factor
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+
+try:
+    from scipy import stats
+    HAS_SCIPY = True
+except ImportError:
+    # scipy comes with statsmodels; without it p-values are left as NaN
+    HAS_SCIPY = False
+
+RESPONSE = "log_price_per_sq_ft"
+CONSTANT = "const"
+
+# Transforms that can prefix a column name, e.g., 'sqrt_num_crimes'
+TRANSFORMS = {
+    "raw": None,
+    "sqrt": np.sqrt,
+    "log1p": np.log1p,
+    "log": np.log,
+}
+
+# Variables of the models in stats.ipynb
+COUNT_FEATURES = ["num_restaurants", "num_stores", "num_schools", "num_hospitals"]
+RATING_FEATURES = ["avg_restaurant_price_level", "avg_restaurant_rating"]
+CRIME_FEATURES = ["num_crimes", "violent_crime_count"]
+
+# Columns that must be present, as dropped on in stats.ipynb
+REQUIRED_COLUMNS = ["price", "price_per_sq_ft", "longitude", "latitude",
+                    "avg_restaurant_price_level", "avg_restaurant_rating"]
+
+# Columns read from the master table: the model columns, and the address /
+# URL for the ZIP code blocks of spatial_bootstrap.py
+SUMMARY_COLUMNS = (["url", "address"] + REQUIRED_COLUMNS + COUNT_FEATURES + CRIME_FEATURES)
+
+
+def transformed(column, transform):
+    """
+    Name of a column under a transform, e.g., ('num_crimes', 'sqrt') -> 'sqrt_num_crimes'.
+    """
+    return column if transform == "raw" else f"{transform}_{column}"
+
+
+def term_values(df, term):
+    """
+    Values of a term of a specification, computed from the columns of df.
+
+    A term is a column name, optionally prefixed by a transform of TRANSFORMS
+    ('sqrt_num_crimes'), suffixed with '_squared', or an interaction of such
+    terms joined by ':' ('sqrt_num_crimes:sqrt_num_schools'), as named by
+    stats.ipynb and statsmodels formulas.
+
+    Returns:
+      np array of float.
+    """
+    if ":" in term:
+        return np.prod([term_values(df, part) for part in term.split(":")], axis=0)
+    if term in df.columns:
+        return df[term].to_numpy(dtype=float)
+    if term.endswith("_squared"):
+        return term_values(df, term[:-len("_squared")]) ** 2
+    for name, func in TRANSFORMS.items():
+        if func is not None and term.startswith(name + "_"):
+            base = term[len(name) + 1:]
+            if base in df.columns:
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    return func(df[base].to_numpy(dtype=float))
+    raise KeyError(f"unknown term {term!r}")
+
+
+def spec_grid(transforms=("raw", "sqrt", "log1p"), crime_features=CRIME_FEATURES,
+              interactions=(False, True), squares=(False, True)):
+    """
+    The grid of specifications of stats.ipynb: every transform of the counts,
+    crime variable, with or without crime interactions and squared terms.
+
+    Inputs:
+      transforms (iterable): Transforms of the count variables (see TRANSFORMS).
+      crime_features (iterable): Crime variable of each model.
+      interactions (iterable of bool): Whether to interact the crime variable
+                                       with every other variable.
+      squares (iterable of bool): Whether to add the square of every
+                                  (transformed) count variable.
+
+    Returns:
+      dict: Specification name -> list of terms (without the constant).
+    """
+    specs = {}
+    for transform, crime, interact, square in itertools.product(
+            transforms, crime_features, interactions, squares):
+        crime_term = transformed(crime, transform)
+        others = [transformed(col, transform) for col in COUNT_FEATURES] + RATING_FEATURES
+        terms = [crime_term] + others
+        if interact:
+            terms += [f"{crime_term}:{other}" for other in others]
+        if square:
+            terms += [f"{term}_squared" for term in [crime_term] + others[:len(COUNT_FEATURES)]]
+        name = f"{transform} {crime}"
+        if interact:
+            name += " + interactions"
+        if square:
+            name += " + squares"
+        specs[name] = terms
+    return specs
+
+
+def prepare_data(df, remove_outliers=True):
+    """
+    The rows used for the models in stats.ipynb: houses with a price, a
+    location and restaurant stats, optionally without the price outliers
+    (outside 1.5 IQR of the quartiles), with the log price per sq ft.
+    """
+    df = df.dropna(subset=REQUIRED_COLUMNS)
+    if remove_outliers:
+        q1, q3 = df["price"].quantile(0.25), df["price"].quantile(0.75)
+        iqr = q3 - q1
+        df = df[(df["price"] >= q1 - 1.5 * iqr) & (df["price"] <= q3 + 1.5 * iqr)]
+    df = df.copy()
+    df[RESPONSE] = np.log(df["price_per_sq_ft"])
+    return df
+
+
+def load_summary(data_dir=None, columns=SUMMARY_COLUMNS):
+    """
+    Load the master table from data/ (the Parquet copy if there is one),
+    with only the given columns (None for all).
+    """
+    if data_dir is None:
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+    parquet_path = os.path.join(data_dir, "summary_redfin.parquet")
+    if os.path.exists(parquet_path):
+        return pd.read_parquet(parquet_path, columns=columns)
+    return pd.read_csv(os.path.join(data_dir, "summary_redfin.csv"), usecols=columns)
+
+
+class SharedDesign:
+    """
+    The design matrix of every term of a sweep, with its QR factors.
+    """
+
+    def __init__(self, df, terms, response=RESPONSE):
+        """
+        Build the shared design matrix and factor it.
+
+        Inputs:
+          df (DataFrame): The data (see prepare_data).
+          terms (iterable): Every term used by the specifications.
+          response (str): The dependent variable.
+        """
+        self.terms = [CONSTANT] + list(dict.fromkeys(terms))
+        columns = [np.ones(len(df))] + [term_values(df, term) for term in self.terms[1:]]
+        X = np.column_stack(columns)
+        y = term_values(df, response)
+        rows = np.isfinite(X).all(axis=1) & np.isfinite(y)
+        X, y = X[rows], y[rows]
+        self.n = len(y)
+        self.position = {term: j for j, term in enumerate(self.terms)}
+
+        Q, self.R = np.linalg.qr(X)
+        self.z = Q.T @ y
+        # Residual sum of squares of y outside the span of all the columns
+        self.rss_outside = float(((y - Q @ self.z) ** 2).sum())
+        self.tss = float(((y - y.mean()) ** 2).sum())
+
+    def fit(self, terms):
+        """
+        OLS fit of the response on the constant and some terms.
+
+        Returns:
+          tuple: (summary dict, coefficient DataFrame); see fit_spec.
+        """
+        return fit_spec(self.R, self.z, self.rss_outside, self.tss, self.n,
+                        [CONSTANT] + list(terms), self.position)
+
+
+def _vif(gram, n, has_constant):
+    """
+    Variance inflation factors of the non-constant columns, from their Gram
+    matrix: the diagonal of the inverse correlation matrix of the columns.
+    """
+    k = gram.shape[0]
+    start = 1 if has_constant else 0
+    if k - start == 0:
+        return np.array([])
+    means = gram[0, start:] / n if has_constant else np.zeros(k - start)
+    centered = gram[start:, start:] - n * np.outer(means, means)
+    scale = np.sqrt(np.diag(centered))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = centered / np.outer(scale, scale)
+        try:
+            return np.diag(np.linalg.inv(corr))
+        except np.linalg.LinAlgError:
+            return np.full(k - start, np.inf)
+
+
+def fit_spec(R, z, rss_outside, tss, n, terms, position):
+    """
+    Fit one specification from the shared QR factors.
+
+    Inputs:
+      R (np array): R factor of the shared design matrix.
+      z (np array): Q'y.
+      rss_outside (float): ||y||^2 - ||Q'y||^2.
+      tss (float): Total sum of squares of y.
+      n (int): Number of rows.
+      terms (list): Terms of the specification, 'const' first.
+      position (dict): Column of every term in the shared matrix.
+
+    Returns:
+      tuple: (dict with 'n', 'k', 'r2', 'adj_r2', 'aic', 'bic', 'max_vif';
+              DataFrame with 'term', 'coef', 'se', 't', 'p_value', 'vif').
+    """
+    R_s = R[:, [position[term] for term in terms]]
+    k = len(terms)
+    # Small least squares problem min ||R_s b - z||
+    Q_s, R_ss = np.linalg.qr(R_s)
+    coef = np.linalg.solve(R_ss, Q_s.T @ z)
+    rss = float(((z - R_s @ coef) ** 2).sum()) + rss_outside
+
+    df_resid = n - k
+    sigma2 = rss / df_resid
+    R_inv = np.linalg.inv(R_ss)
+    se = np.sqrt(sigma2 * (R_inv ** 2).sum(axis=1))
+    t = coef / se
+    if HAS_SCIPY:
+        p_value = 2 * stats.t.sf(np.abs(t), df_resid)
+    else:
+        p_value = np.full(k, np.nan)
+
+    has_constant = terms[0] == CONSTANT
+    vif = _vif(R_s.T @ R_s, n, has_constant)
+    if has_constant:
+        vif = np.concatenate([[np.nan], vif])
+
+    # Same definitions as statsmodels' OLSResults
+    llf = -n / 2 * (np.log(2 * np.pi) + np.log(rss / n) + 1)
+    r2 = 1 - rss / tss
+    summary = {
+        "n": n,
+        "k": k,
+        "r2": r2,
+        "adj_r2": 1 - (1 - r2) * (n - 1) / df_resid,
+        "aic": -2 * llf + 2 * k,
+        "bic": -2 * llf + np.log(n) * k,
+        "max_vif": float(np.nanmax(vif)) if k > 1 else np.nan,
+    }
+    coefficients = pd.DataFrame({"term": terms, "coef": coef, "se": se, "t": t,
+                                 "p_value": p_value, "vif": vif})
+    return summary, coefficients
+
+
+# Shared QR factors of the worker process, set by _init_worker
+_worker_design = None
+
+
+def _init_worker(design):
+    global _worker_design
+    _worker_design = design
+
+
+def _fit_worker(task):
+    name, terms = task
+    design = _worker_design
+    return name, fit_spec(design["R"], design["z"], design["rss_outside"], design["tss"],
+                          design["n"], [CONSTANT] + list(terms), design["position"])
+
+
+def sweep(df, specs, response=RESPONSE, workers=1):
+    """
+    Fit every specification on the same rows, from one shared factorization.
+
+    Inputs:
+      df (DataFrame): The data (see prepare_data).
+      specs (dict): Specification name -> list of terms (see spec_grid and
+                    term_values); a constant is always added.
+      response (str): The dependent variable.
+      workers (int): Number of worker processes. The fits only use the small
+                     R factor, which is sent to every worker once.
+
+    Returns:
+      tuple: (DataFrame with one row per specification, sorted by AIC, with
+              'n', 'k', 'r2', 'adj_r2', 'aic', 'bic', 'max_vif';
+              DataFrame with one row per specification and term with 'coef',
+              'se', 't', 'p_value' and 'vif').
+    """
+    design = SharedDesign(df, [term for terms in specs.values() for term in terms], response)
+    tasks = list(specs.items())
+    if workers > 1 and len(tasks) > 1:
+        shared = {"R": design.R, "z": design.z, "rss_outside": design.rss_outside,
+                  "tss": design.tss, "n": design.n, "position": design.position}
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(shared,)) as pool:
+            results = pool.map(_fit_worker, tasks,
+                               chunksize=max(1, len(tasks) // (4 * workers)))
+    else:
+        results = [(name, design.fit(terms)) for name, terms in tasks]
+
+    summary = pd.DataFrame([dict(spec=name, **fit[0]) for name, fit in results])
+    coefficients = pd.concat([fit[1].assign(spec=name) for name, fit in results],
+                             ignore_index=True)
+    coefficients = coefficients[["spec", "term", "coef", "se", "t", "p_value", "vif"]]
+    summary = summary.sort_values("aic").reset_index(drop=True)
+    return summary, coefficients
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the stats.ipynb model grid at once")
+    parser.add_argument("--data-dir", help="directory of summary_redfin (default ../data)")
+    parser.add_argument("--transforms", nargs="+", default=["raw", "sqrt", "log1p"],
+                        choices=[name for name in TRANSFORMS if name != "log"])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--keep-outliers", action="store_true",
+                        help="do not remove the price outliers")
+    parser.add_argument("--output", help="CSV file for the comparison table")
+    parser.add_argument("--coef-output", help="CSV file for the coefficients")
+    args = parser.parse_args()
+
+    df = prepare_data(load_summary(args.data_dir), remove_outliers=not args.keep_outliers)
+    specs = spec_grid(transforms=args.transforms)
+    summary, coefficients = sweep(df, specs, workers=args.workers)
+    print(summary.to_string(index=False, float_format="%.4f"))
+    if args.output:
+        summary.to_csv(args.output, index=False)
+        print(f"Comparison table saved to {args.output}")
+    if args.coef_output:
+        coefficients.to_csv(args.coef_output, index=False)
+        print(f"Coefficients saved to {args.coef_output}")
+
+
+if __name__ == "__main__":
+    main()
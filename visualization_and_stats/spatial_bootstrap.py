@@ -0,0 +1,271 @@
+# This file contains a spatial block bootstrap of the OLS coefficients of the
+# stats.ipynb models. Nearby houses share the same amenity and crime counts,
+# so their errors are correlated and the analytic OLS standard errors are
+# too small. Here houses are resampled by spatial blocks (a lat/lng grid of
+# about block_km x block_km, or the ZIP code of the address): every bootstrap
+# replicate draws as many blocks as there are, with replacement, and refits
+# the model on all the houses of the drawn blocks.
+
+# A replicate is only a weighted sum of per-block terms: with W[r, b] the
+# number of times block b is drawn in replicate r, the normal equations are
+#   (sum_b W[r, b] X_b'X_b) beta_r = sum_b W[r, b] X_b'y_b,
+# so X_b'X_b and X_b'y_b are computed once per block, and a batch of
+# replicates is two matrix products and a batched np.linalg.solve. Batches
+# are spread over a process pool; each batch has its own seed, so the result
+# does not depend on the number of workers.
+
+# Usage (from visualization_and_stats/):
+#   python spatial_bootstrap.py --replicates 5000 --blocks grid --block-km 2 --workers 4
+
+# Resource:
+    # 1) https://en.wikipedia.org/wiki/Bootstrapping_(statistics)#Block_bootstrap
+    # 2) https://numpy.org/doc/stable/reference/random/parallel.html#seedsequence-spawning
+    # 3) https://numpy.org/doc/stable/reference/generated/numpy.linalg.solve.html
+
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+from model_sweep import (
+    CONSTANT,
+    RESPONSE,
+    load_summary,
+    prepare_data,
+    spec_grid,
+    term_values
+)
+
+EARTH_RADIUS_KM = 6371.0
+DEFAULT_REPLICATES = 2000
+DEFAULT_BLOCK_KM = 2.0
+
+# Replicates per batch (and per seed)
+BATCH_SIZE = 250
+
+# Model of the first OLS regression of stats.ipynb
+DEFAULT_SPEC = "sqrt num_crimes"
+
+# Same patterns as redfin_data/property_store.parse_zipcode
+ADDRESS_ZIP_PATTERN = r"\b(\d{5})(?:-\d{4})?\s*$"
+URL_ZIP_PATTERN = r"-(\d{5})/"
+
+
+def grid_blocks(df, block_km=DEFAULT_BLOCK_KM):
+    """
+    Block of every house on a lat/lng grid of about block_km x block_km
+    (longitude cells are widened by 1 / cos(latitude) of the mean latitude).
+
+    Returns:
+      np array of int: Block label of every row.
+    """
+    lat = df["latitude"].to_numpy(dtype=float)
+    lon = df["longitude"].to_numpy(dtype=float)
+    cell_lat = np.degrees(block_km / EARTH_RADIUS_KM)
+    cell_lon = cell_lat / np.cos(np.radians(np.nanmean(lat)))
+    iy = np.floor(lat / cell_lat).astype(np.int64)
+    ix = np.floor(lon / cell_lon).astype(np.int64)
+    return pd.factorize(pd.Series(list(zip(iy, ix))))[0]
+
+
+def zip_blocks(df, block_km=DEFAULT_BLOCK_KM):
+    """
+    Block of every house by ZIP code (from the address, else the URL); houses
+    without a ZIP code fall back to their grid block.
+
+    Returns:
+      np array of int: Block label of every row.
+    """
+    zipcode = pd.Series(np.nan, index=df.index, dtype=object)
+    if "address" in df.columns:
+        zipcode = df["address"].astype(str).str.extract(ADDRESS_ZIP_PATTERN)[0]
+    if "url" in df.columns:
+        zipcode = zipcode.fillna(df["url"].astype(str).str.extract(URL_ZIP_PATTERN)[0])
+    fallback = pd.Series(grid_blocks(df, block_km), index=df.index).map("grid {}".format)
+    return pd.factorize(zipcode.fillna(fallback))[0]
+
+
+BLOCKINGS = {"grid": grid_blocks, "zip": zip_blocks}
+
+
+class BlockDesign:
+    """
+    The design matrix of a model, reduced to per-block Gram matrices.
+
+    Columns are scaled to unit standard deviation (the constant is left as
+    is) so the normal equations stay well conditioned with squared and
+    interaction terms; coefficients are scaled back at the end.
+    """
+
+    def __init__(self, df, terms, blocks, response=RESPONSE):
+        """
+        Inputs:
+          df (DataFrame): The data (see model_sweep.prepare_data).
+          terms (list): Terms of the model (see model_sweep.term_values),
+                        without the constant.
+          blocks (np array): Block label of every row of df.
+          response (str): The dependent variable.
+        """
+        self.terms = [CONSTANT] + list(terms)
+        X = np.column_stack([np.ones(len(df))] + [term_values(df, term) for term in terms])
+        y = term_values(df, response)
+        rows = np.isfinite(X).all(axis=1) & np.isfinite(y)
+        X, y = X[rows], y[rows]
+        self.n = len(y)
+        block_codes, self.block_labels = pd.factorize(np.asarray(blocks)[rows])
+        self.n_blocks = len(self.block_labels)
+
+        self.scale = X.std(axis=0)
+        self.scale[0] = 1.0
+        self.scale[self.scale == 0] = 1.0
+        X = X / self.scale
+        k = X.shape[1]
+
+        # Per-block X_b'X_b (flattened) and X_b'y_b, summed with np.add.at
+        self.block_gram = np.zeros((self.n_blocks, k * k))
+        np.add.at(self.block_gram, block_codes,
+                  (X[:, :, None] * X[:, None, :]).reshape(self.n, k * k))
+        self.block_xty = np.zeros((self.n_blocks, k))
+        np.add.at(self.block_xty, block_codes, X * y[:, None])
+        self.block_sizes = np.bincount(block_codes, minlength=self.n_blocks)
+
+        # Full-sample fit and its analytic (iid) standard errors
+        gram = self.block_gram.sum(axis=0).reshape(k, k)
+        coef = np.linalg.solve(gram, self.block_xty.sum(axis=0))
+        resid = y - X @ coef
+        sigma2 = resid @ resid / (self.n - k)
+        self.coef = coef / self.scale
+        self.se = np.sqrt(sigma2 * np.diag(np.linalg.inv(gram))) / self.scale
+
+    def solve(self, weights):
+        """
+        Coefficients of the fits with the given block weights.
+
+        Inputs:
+          weights (np array): (n_replicates, n_blocks) number of times every
+                              block is drawn.
+
+        Returns:
+          np array: (n_replicates, k) coefficients; NaN for a replicate whose
+                    normal equations are singular (e.g., too few blocks drawn).
+        """
+        k = len(self.terms)
+        gram = (weights @ self.block_gram).reshape(-1, k, k)
+        xty = weights @ self.block_xty
+        try:
+            coef = np.linalg.solve(gram, xty[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            coef = np.full(xty.shape, np.nan)
+            for r in range(len(xty)):
+                try:
+                    coef[r] = np.linalg.solve(gram[r], xty[r])
+                except np.linalg.LinAlgError:
+                    pass
+        return coef / self.scale
+
+    def replicates(self, n_replicates, seed):
+        """
+        Coefficients of n_replicates block bootstrap replicates.
+        """
+        rng = np.random.default_rng(seed)
+        probabilities = np.full(self.n_blocks, 1.0 / self.n_blocks)
+        weights = rng.multinomial(self.n_blocks, probabilities, size=n_replicates)
+        return self.solve(weights.astype(float))
+
+
+# Block design of the worker process, set by _init_worker
+_worker_design = None
+
+
+def _init_worker(design):
+    global _worker_design
+    _worker_design = design
+
+
+def _replicate_batch(task):
+    n_replicates, seed = task
+    return _worker_design.replicates(n_replicates, seed)
+
+
+def block_bootstrap(df, terms, blocks, n_replicates=DEFAULT_REPLICATES, alpha=0.05,
+                    workers=1, seed=0, response=RESPONSE):
+    """
+    Spatial block bootstrap of the OLS coefficients of a model.
+
+    Inputs:
+      df (DataFrame): The data (see model_sweep.prepare_data).
+      terms (list): Terms of the model, without the constant (e.g., a value
+                    of model_sweep.spec_grid()).
+      blocks (np array): Block label of every row (see grid_blocks / zip_blocks).
+      n_replicates (int): Number of bootstrap replicates.
+      alpha (float): The percentile intervals cover 1 - alpha.
+      workers (int): Number of worker processes.
+      seed (int): Seed of the random draws; the result is the same for any
+                  number of workers.
+      response (str): The dependent variable.
+
+    Returns:
+      DataFrame: One row per term with 'coef', the analytic 'se', the
+                 bootstrap 'boot_se', 'ci_low' / 'ci_high' (percentile
+                 interval), 'se_ratio' (boot_se / se); its attrs hold the
+                 number of rows, blocks and replicates that failed.
+    """
+    design = BlockDesign(df, terms, blocks, response)
+    sizes = [BATCH_SIZE] * (n_replicates // BATCH_SIZE)
+    if n_replicates % BATCH_SIZE:
+        sizes.append(n_replicates % BATCH_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = list(zip(sizes, seeds))
+
+    if workers > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(design,)) as pool:
+            batches = pool.map(_replicate_batch, tasks)
+    else:
+        batches = [design.replicates(size, batch_seed) for size, batch_seed in tasks]
+    coefs = np.concatenate(batches)
+
+    failed = int(np.isnan(coefs).any(axis=1).sum())
+    coefs = coefs[~np.isnan(coefs).any(axis=1)]
+    boot_se = coefs.std(axis=0, ddof=1)
+    ci_low, ci_high = np.percentile(coefs, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    result = pd.DataFrame({"term": design.terms, "coef": design.coef, "se": design.se,
+                           "boot_se": boot_se, "ci_low": ci_low, "ci_high": ci_high,
+                           "se_ratio": boot_se / design.se})
+    result.attrs.update({"n": design.n, "blocks": design.n_blocks,
+                         "replicates": n_replicates, "failed": failed})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spatial block bootstrap of a stats.ipynb model")
+    parser.add_argument("--data-dir", help="directory of summary_redfin (default ../data)")
+    parser.add_argument("--spec", default=DEFAULT_SPEC,
+                        help=f"model of model_sweep.spec_grid() (default '{DEFAULT_SPEC}')")
+    parser.add_argument("--replicates", type=int, default=DEFAULT_REPLICATES)
+    parser.add_argument("--blocks", choices=list(BLOCKINGS), default="grid")
+    parser.add_argument("--block-km", type=float, default=DEFAULT_BLOCK_KM)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="CSV file for the intervals")
+    args = parser.parse_args()
+
+    specs = spec_grid()
+    if args.spec not in specs:
+        parser.error(f"unknown spec {args.spec!r}; one of: {', '.join(specs)}")
+    df = prepare_data(load_summary(args.data_dir))
+    blocks = BLOCKINGS[args.blocks](df, args.block_km)
+    result = block_bootstrap(df, specs[args.spec], blocks, args.replicates, args.alpha,
+                             args.workers, args.seed)
+
+    print(f"{args.spec}: {result.attrs['n']} houses in {result.attrs['blocks']} "
+          f"{args.blocks} blocks, {args.replicates} replicates "
+          f"({result.attrs['failed']} singular)")
+    print(result.to_string(index=False, float_format="%.5f"))
+    if args.output:
+        result.to_csv(args.output, index=False)
+        print(f"Intervals saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()